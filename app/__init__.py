@@ -1,16 +1,27 @@
 # app/__init__.py
 
+import multiprocessing
+
 from flask import Flask
 from flask_cors import CORS
 from .extensions import db, jwt  
 from .config import Config  
 from .routes import register_routes 
+from .routes.analysis import start_analysis_service
+from .utils.uploads import InMemoryUploadRequest
+from .utils.log import setup_logging, init_request_logging
 
 def create_app():
 
+    # Logging no bloqueante con id de correlación por solicitud
+    setup_logging(Config.LOG_LEVEL, Config.LOG_DEBUG_SAMPLE_RATE)
+
     app = Flask(__name__)
+    # Archivos subidos en memoria: el análisis decodifica desde el buffer
+    app.request_class = InMemoryUploadRequest
 
     app.config.from_object(Config)
+    init_request_logging(app)
 
     # Inicializar extensiones
     db.init_app(app)  
@@ -19,15 +30,23 @@ def create_app():
     # Registrar blueprints (rutas)
     register_routes(app)
 
-    # Crear tablas si no existen
-    with app.app_context():
-        db.create_all()
+    # Los trabajadores 'spawn' de la cola de trabajos reimportan el módulo
+    # principal (run.py): ahí no se crean tablas ni se cargan modelos, cada
+    # trabajador carga los suyos
+    if multiprocessing.parent_process() is None:
+        # Crear tablas si no existen
+        with app.app_context():
+            db.create_all()
+
+        # Carga y calentamiento de modelos (lazy, background o eager)
+        start_analysis_service(Config.ANALYSIS_STARTUP)
     
     CORS(app, resources={
         r"/*":{
             "origins":["http://localhost:3000"],
             "methods":["GET","POST","PUT","DELETE","OPTIONS"],
-            "allow_headers":["Content-Type", "Authorization"]
+            "allow_headers":["Content-Type", "Authorization", "X-Request-ID"],
+            "expose_headers":["X-Request-ID"]
         }
     })
 
@@ -19,6 +19,10 @@ class Config:
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(days=7)    # Access token: 7 días
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=30)  # Refresh token: 30 días
 
+    # Logging
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", 0.1))  # Fracción de mensajes DEBUG
+
      # NUEVA CONFIGURACIÓN PARA EL SERVICIO DE ANÁLISIS (AGREGAR AL FINAL)
     # Rutas base para modelos
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -34,7 +38,24 @@ class Config:
             'conf': 0.15,                    # Confianza inicial
             'conf_range': [0.10, 0.30],      # Rango de confianza: 15%-50%
             'iou': 0.35,                     # IOU estándar
+            'max_det': 300,                  # Detecciones máximas por imagen
             'device': 'cpu',
+            'batch_size': 8,                 # Imágenes por llamada en análisis por lotes
+            'quantized': False,              # Usar yolo_best.int8.onnx (app/scripts/quantization.py)
+            'adaptive': {                    # Perfil adaptativo: imgsz/conf dentro de los rangos
+                'enabled': os.getenv("YOLO_ADAPTIVE", "0") == "1",
+                'max_load': 4,               # Análisis en espera por cupo para el perfil mínimo
+                'levels': 4,                 # Niveles de degradación (tamaños de entrada distintos)
+                'stride': 32,                # imgsz múltiplo del stride de YOLO
+            },
+            'tiling': {                      # Detección por teselas (?tiled=1)
+                'tile_size': 640,            # Lado de la tesela en píxeles de la imagen
+                'overlap': 0.2,              # Solapamiento entre teselas vecinas
+                'max_tiles': 16,             # Por imagen; las teselas crecen si se supera
+                'min_long_side': 2560,       # Resolución mínima de decodificación
+                'include_full': True,        # Pasada adicional con la imagen completa
+                'nms_iou': 0.5,              # NMS entre teselas
+            },
         },
         'SAM': {
             'checkpoint': os.path.join(MODELS_DIR, 'sam_vit_b_01ec64.pth'),
@@ -44,15 +65,98 @@ class Config:
             'stability_score_thresh': 0.95,
             'min_mask_region_area': 100,
             'device': 'cpu',
-            'mode': 'classify'
+            'mode': os.getenv("SAM_MODE", "off"),  # 'off', 'classify' (generador automático) o 'prompt'
+            'prompt_batch_size': 64,         # Cajas por pasada del decodificador (modo 'prompt')
+            'embedding_cache': {             # Embeddings reutilizados entre análisis (modo 'prompt')
+                'enabled': True,
+                'dir': os.path.join(UPLOADS_DIR, 'sam_embeddings'),
+                'max_bytes': 512 * 1024 * 1024,
+            },
+        },
+        'DECODE': {
+            'reduced_jpeg': True,            # Decodificar JPEG grandes a 1/2, 1/4 o 1/8 (DCT)
+            'min_long_side': 1280,           # Lado largo mínimo tras reducir (resolución de recortes)
+        },
+        'RENDER': {
+            'thumbnail_max_side': 320,       # Lado largo de la miniatura (processedImage=thumbnail)
+            'max_dim': 1600,                 # Lado largo máximo de la imagen completa (0 = sin reducir)
+            'format': 'jpeg',                # 'jpeg' o 'webp'
+            'jpeg_quality': 85,
+            'webp_quality': 80,
         },
         'RESNET': {
             'weights': os.path.join(MODELS_DIR, 'resnet18_best.pt'),
             'device': 'cpu',
+            'batch_size': 32,                # Máximo de recortes por pasada
+            'backend': 'eager',              # 'eager', 'torchscript', 'onnx' o 'int8' (exportado junto a los pesos)
+            'parity_atol': 1e-3,             # Diferencia máxima de probabilidades vs eager
+            'int8_parity_atol': None,        # Tolerancia del backend 'int8' (None: solo se informa)
         }
     }
     
-    SAM_MODE = 'classify'  # 'off', 'classify', 'save'
+    # Caché de resultados completos de /api/v1/classification/analyze
+    RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+    
+    # Trabajos de análisis asíncronos (/api/v1/classification/jobs)
+    ANALYSIS_JOBS = {
+        'workers': int(os.getenv("ANALYSIS_WORKERS", 2)),   # Procesos con modelos cargados
+        'max_queue': 32,                                    # Trabajos pendientes máximos
+        'result_ttl': 600,                                  # Segundos que se guardan los resultados
+        'dir': os.path.join(UPLOADS_DIR, 'jobs'),           # Estado compartido entre procesos web
+    }
+    
+    # Imágenes procesadas servidas por id (/api/v1/classification/images/<id>)
+    PROCESSED_IMAGES = {
+        'cache_max_bytes': 128 * 1024 * 1024,
+        'max_age': 3600,                     # Cache-Control (segundos)
+    }
+    
+    # Resultados guardados en analisis_imagen (escritura asíncrona)
+    ANALYSIS_PERSISTENCE = {
+        'enabled': os.getenv("ANALYSIS_PERSISTENCE", "1") == "1",
+        'max_queue': 1000,                   # Resultados pendientes; si se llena se descartan
+        'batch_size': 50,                    # Resultados por commit
+    }
+    
+    # Progreso por SSE (/api/v1/classification/analyze/stream)
+    ANALYSIS_STREAM = {
+        'heartbeat': 15,                     # Segundos entre comentarios ': ping' sin eventos
+    }
+    
+    # Recarga en caliente de modelos: sondea los pesos de MODELS (en MODELS_DIR) y,
+    # si cambian, carga y calienta la nueva versión en segundo plano antes de activarla
+    MODEL_RELOAD = {
+        'enabled': os.getenv("MODEL_RELOAD", "1") == "1",
+        'interval': float(os.getenv("MODEL_RELOAD_INTERVAL", "30")),  # Segundos entre sondeos
+    }
+    
+    # Control de admisión de /analyze y /analyze-batch (por proceso)
+    # Lo que excede la cola se rechaza con 503 + Retry-After; el límite por usuario con 429
+    ANALYSIS_ADMISSION = {
+        'max_in_flight': int(os.getenv("ANALYSIS_MAX_IN_FLIGHT", "2")),  # Análisis simultáneos
+        'max_waiting': int(os.getenv("ANALYSIS_MAX_WAITING", "16")),    # Solicitudes en espera por carril
+        'wait_timeout': 30.0,                # Segundos máximos en cola antes de 503
+        'per_user': int(os.getenv("ANALYSIS_PER_USER", "0")),          # 0 = sin límite por usuario
+        'reserved_interactive': 1,           # Cupos que las sincronizaciones masivas no pueden ocupar
+    }
+    
+    # Carga de modelos al iniciar la aplicación
+    # 'lazy': en la primera solicitud, 'background': hilo al arrancar, 'eager': bloquea create_app,
+    # 'preload': en el maestro de gunicorn antes de fork, pesos compartidos (ver gunicorn.conf.py)
+    ANALYSIS_STARTUP = os.getenv("ANALYSIS_STARTUP", "background")
+    ANALYSIS_WARMUP_RUNS = int(os.getenv("ANALYSIS_WARMUP_RUNS", 2))  # Inferencias de calentamiento
+    
+    # Hilos de inferencia en CPU (0 = automático: núcleos disponibles / procesos)
+    ANALYSIS_THREADS = {
+        'web_workers': int(os.getenv("WEB_CONCURRENCY", 2)),            # Procesos web con modelos cargados (workers de gunicorn)
+        'concurrency': int(os.getenv("ANALYSIS_CONCURRENCY", 1)),       # Análisis simultáneos por proceso
+        'intra_op': int(os.getenv("TORCH_INTRA_OP_THREADS", 0)),        # torch.set_num_threads
+        'inter_op': int(os.getenv("TORCH_INTER_OP_THREADS", 1)),        # torch.set_num_interop_threads
+        'opencv': int(os.getenv("OPENCV_THREADS", 0)),                  # cv2.setNumThreads
+    }
+    
+    # Máximo de imágenes por solicitud en /api/v1/classification/analyze-batch
+    MAX_BATCH_IMAGES = 50
     
     # Límites de archivo para análisis
     MAX_FILE_SIZE = 50 * 1024 * 1024
@@ -9,6 +9,7 @@ from .factor_model import Factor
 from .possible_value_model import PossibleValue
 from .response_factor_model import ResponseFactor
 from .data_tth_model import DataTTH
+from .image_analysis_model import ImageAnalysis
 
 # Exponer los modelos para facilitar su uso
 __all__ = [
@@ -20,5 +21,6 @@ __all__ = [
     'Factor',
     'PossibleValue',
     'ResponseFactor',
-    'DataTTH'
+    'DataTTH',
+    'ImageAnalysis'
 ]
\ No newline at end of file
@@ -0,0 +1,81 @@
+import struct
+
+from app.extensions import db
+
+# Hoja codificada: caja x1, y1, x2, y2 (uint16, px), clase (uint8),
+# score y conf (uint16, escalados a 0-65535) = 13 bytes por hoja
+LEAF_STRUCT = struct.Struct('<4HBHH')
+LEAF_CLASSES = ('healthy', 'affected')
+_UNKNOWN_CLASS = 255
+_SCORE_SCALE = 65535
+
+
+class ImageAnalysis(db.Model):
+    __tablename__ = 'analisis_imagen'
+    __table_args__ = (
+        db.Index('idx_analisis_imagen_hash', 'image_hash'),
+        db.Index('idx_analisis_imagen_finca_fecha', 'finca_id', 'created_at'),
+        db.Index('idx_analisis_imagen_encuesta', 'encuesta_id'),
+    )
+
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    image_hash = db.Column(db.String(64), nullable=False)
+    finca_id = db.Column(db.Integer, db.ForeignKey('finca.id'), nullable=True)
+    encuesta_id = db.Column(db.Integer, db.ForeignKey('encuesta.id'), nullable=True)
+    total_hojas = db.Column(db.Integer, nullable=False, default=0)
+    hojas_sanas = db.Column(db.Integer, nullable=False, default=0)
+    hojas_afectadas = db.Column(db.Integer, nullable=False, default=0)
+    confianza = db.Column(db.Float, nullable=False, default=0.0)
+    hojas = db.Column(db.LargeBinary, nullable=True)
+    huella_modelos = db.Column(db.String(16), nullable=False)
+    tiempos = db.Column(db.JSON, nullable=True)
+    created_at = db.Column(db.TIMESTAMP, default=db.func.current_timestamp())
+
+    # Relaciones
+    finca = db.relationship('Farm', lazy=True)
+    encuesta = db.relationship('Survey', lazy=True)
+
+    @staticmethod
+    def encode_leaves(leaves):
+        """Lista de hojas del análisis -> bytes compactos"""
+        buffer = bytearray(LEAF_STRUCT.size * len(leaves))
+        for i, leaf in enumerate(leaves):
+            x1, y1, x2, y2 = (min(65535, max(0, int(round(v)))) for v in leaf['box'])
+            class_idx = LEAF_CLASSES.index(leaf['class']) if leaf['class'] in LEAF_CLASSES else _UNKNOWN_CLASS
+            LEAF_STRUCT.pack_into(
+                buffer, i * LEAF_STRUCT.size,
+                x1, y1, x2, y2, class_idx,
+                int(round(leaf['score'] * _SCORE_SCALE)),
+                int(round(leaf['conf'] * _SCORE_SCALE)),
+            )
+        return bytes(buffer)
+
+    def decode_leaves(self):
+        """Bytes compactos -> lista de hojas con el formato del análisis"""
+        leaves = []
+        for x1, y1, x2, y2, class_idx, score, conf in LEAF_STRUCT.iter_unpack(self.hojas or b''):
+            leaves.append({
+                'box': [x1, y1, x2, y2],
+                'class': LEAF_CLASSES[class_idx] if class_idx < len(LEAF_CLASSES) else 'unknown',
+                'score': round(score / _SCORE_SCALE, 4),
+                'conf': round(conf / _SCORE_SCALE, 4),
+            })
+        return leaves
+
+    def to_dict(self, include_leaves=False):
+        data = {
+            "id": self.id,
+            "image_hash": self.image_hash,
+            "finca_id": self.finca_id,
+            "encuesta_id": self.encuesta_id,
+            "total_hojas": self.total_hojas,
+            "hojas_sanas": self.hojas_sanas,
+            "hojas_afectadas": self.hojas_afectadas,
+            "confianza": self.confianza,
+            "huella_modelos": self.huella_modelos,
+            "tiempos": self.tiempos,
+            "created_at": self.created_at
+        }
+        if include_leaves:
+            data["hojas"] = self.decode_leaves()
+        return data
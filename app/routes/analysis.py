@@ -1,85 +1,225 @@
 # app/routes/analysis.py
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context, url_for
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from sqlalchemy.exc import SQLAlchemyError
+from queue import Empty, SimpleQueue
+import base64
+import gc
+import hashlib
+import logging
+import mimetypes
 import os
-import tempfile
-import traceback
+import threading
+import uuid
+
+from app.config import config
+from app.models.farm_model import Farm
+from app.models.survey_model import Survey
+from app.services.analysis_recorder import AnalysisRecorder
+from app.utils.admission import AdmissionController, AdmissionRejected
+from app.utils.image_store import ImageStore, image_id
+from app.utils.job_store import JobStore
+from app.utils.result_cache import ResultCache, model_fingerprint
+from app.utils.service_registry import ServiceRegistry
+from app.utils.uploads import upload_buffer
+from app.scripts.timing import StageTimer, latency_histograms
 
 # Blueprint para las rutas de análisis
 analysis_bp = Blueprint('analysis', __name__)
 
-print("=" * 60)
-print("🔧 INICIALIZANDO MÓDULO DE ANÁLISIS")
-print("=" * 60)
+logger = logging.getLogger(__name__)
 
 # Intentar importar el servicio de análisis
 try:
     from app.scripts.analyze_service import create_analysis_service
+    from app.scripts.thread_budget import configure_threads
     ANALYSIS_AVAILABLE = True
-    print("✅ Módulo analyze_service importado correctamente")
 except ImportError as e:
-    print(f"❌ Error importando analyze_service: {e}")
-    traceback.print_exc()
+    logger.exception("Error importando analyze_service: %s", e)
     ANALYSIS_AVAILABLE = False
     create_analysis_service = None
+    configure_threads = None
 
-# Inicializar servicio (singleton)
-analysis_service = None
+ALLOWED_IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp'}
 
-def get_analysis_service():
-    global analysis_service
-    print(f"🔄 get_analysis_service() llamado - analysis_service es None: {analysis_service is None}")
+# Imagen procesada en la respuesta: processedImage=none|thumbnail|full,
+# imageDelivery=inline (base64 en el JSON)|url (recurso aparte)|multipart
+PROCESSED_IMAGE_VARIANTS = ('none', 'thumbnail', 'full')
+IMAGE_DELIVERY_MODES = ('inline', 'url', 'multipart')
+IMAGE_FORMATS = ('jpeg', 'webp')
+
+# Resultados por (hash de imagen, huella de modelos): reintentos responden al instante
+result_cache = ResultCache(config.RESULT_CACHE_MAX_BYTES)
+
+# Imágenes procesadas servidas por id en /api/v1/classification/images/<id>
+image_store = ImageStore(config.PROCESSED_IMAGES['cache_max_bytes'])
+
+# Resultados guardados en analisis_imagen (escritura asíncrona por lotes)
+analysis_recorder = AnalysisRecorder(
+    config.ANALYSIS_PERSISTENCE['max_queue'],
+    config.ANALYSIS_PERSISTENCE['batch_size'],
+)
+
+# Análisis simultáneos del proceso: cola acotada con prioridad para subidas individuales
+admission = AdmissionController(**config.ANALYSIS_ADMISSION)
+
+# Cola de trabajos asíncronos (pool de procesos, se crea al primer envío)
+job_queue = None
+_job_queue_lock = threading.Lock()
+# Trabajos visibles desde cualquier proceso web (el pool lo ejecuta uno solo)
+job_store = JobStore(config.ANALYSIS_JOBS['dir'])
+
+def _create_service():
+    """Construye el servicio de análisis con el presupuesto de hilos del proceso web"""
+    logger.info("Inicializando el servicio de análisis")
     
-    if analysis_service is None and ANALYSIS_AVAILABLE:
-        try:
-            print("🚀 Intentando inicializar el servicio de análisis...")
-            
-            # Importar la configuración
-            from app.config import config
-            print(f"📋 Configuración cargada:")
-            print(f"   - YOLO: {config.MODELS['YOLO']['weights']}")
-            print(f"   - ResNet: {config.MODELS['RESNET']['weights']}")
-            print(f"   - SAM: {config.MODELS['SAM']['checkpoint']}")
-            
-            # Verificar que los archivos existan
-            yolo_exists = os.path.exists(config.MODELS['YOLO']['weights'])
-            resnet_exists = os.path.exists(config.MODELS['RESNET']['weights'])
-            sam_exists = os.path.exists(config.MODELS['SAM']['checkpoint'])
-            
-            print(f"📁 Verificación de archivos:")
-            print(f"   - YOLO existe: {yolo_exists}")
-            print(f"   - ResNet existe: {resnet_exists}")
-            print(f"   - SAM existe: {sam_exists}")
-            
-            if not all([yolo_exists, resnet_exists]):
-                print("❌ Faltan archivos de modelos esenciales")
-                return None
-            
-            print("🎯 Creando servicio de análisis...")
-            analysis_service = create_analysis_service(config.MODELS)
-            print("✅ Servicio de análisis creado exitosamente")
-            
-        except Exception as e:
-            print(f"💥 ERROR CRÍTICO inicializando el servicio: {e}")
-            print("🔍 Traceback completo:")
-            traceback.print_exc()
-            analysis_service = None
+    # Verificar que los archivos existan
+    yolo_exists = os.path.exists(config.MODELS['YOLO']['weights'])
+    resnet_exists = os.path.exists(config.MODELS['RESNET']['weights'])
+    sam_exists = os.path.exists(config.MODELS['SAM']['checkpoint'])
+    
+    logger.info(
+        "Modelos: YOLO=%s (existe: %s), ResNet=%s (existe: %s), SAM=%s (existe: %s)",
+        config.MODELS['YOLO']['weights'], yolo_exists,
+        config.MODELS['RESNET']['weights'], resnet_exists,
+        config.MODELS['SAM']['checkpoint'], sam_exists,
+    )
+    
+    if not all([yolo_exists, resnet_exists]):
+        raise FileNotFoundError("Faltan archivos de modelos esenciales")
+    
+    threads = config.ANALYSIS_THREADS
+    budget = configure_threads(threads, workers=threads['web_workers'])
+    service = create_analysis_service(config.MODELS, concurrency=budget['concurrency'])
+    # El perfil adaptativo de YOLO también cuenta la cola de admisión
+    service.load_probe = admission.queue_depth
+    logger.info("Servicio de análisis creado")
+    return service
+
+# Servicio (singleton): carga única bajo lock, calentamiento incluido
+service_registry = ServiceRegistry(
+    _create_service,
+    warmup=lambda service: service.warmup(config.ANALYSIS_WARMUP_RUNS),
+    name='analysis-service',
+    version=lambda: model_fingerprint(config.MODELS),
+)
+
+def _watch_models():
+    """Recarga en caliente al cambiar los pesos en MODELS_DIR (ver MODEL_RELOAD)"""
+    if config.MODEL_RELOAD['enabled']:
+        service_registry.watch(config.MODEL_RELOAD['interval'])
+
+def _model_version():
+    """Versión de los modelos activos (huella de configuración y pesos)"""
+    return service_registry.version or model_fingerprint(config.MODELS)
+
+def start_analysis_service(mode='lazy'):
+    """
+    Carga de modelos al arrancar la aplicación (ver ServiceRegistry.start)
+    'preload': carga en el proceso maestro antes de fork (gunicorn --preload);
+    los trabajadores comparten los pesos y se calientan en after_fork()
+    """
+    if not ANALYSIS_AVAILABLE:
+        return
+    if mode != 'preload':
+        service_registry.start(mode)
+        _watch_models()
+        return
+    
+    import torch
+    if torch.cuda.is_available():
+        logger.warning("Preload no disponible con CUDA, cada trabajador cargará sus modelos")
+        return
+    
+    _prepare_for_fork(service_registry.preload())
+
+def _prepare_for_fork(service):
+    """Deja los modelos del maestro listos para compartirse con los trabajadores"""
+    if service is not None:
+        service.prepare_for_fork()
     
-    return analysis_service
+    # Objetos del maestro fuera del GC: recolectar en los hijos no escribe sus
+    # cabeceras, así no se copian páginas compartidas. Tras una recarga se
+    # descongela antes para liberar la versión anterior
+    gc.unfreeze()
+    gc.collect()
+    gc.freeze()
+
+def watch_models_for_restart(restart):
+    """
+    Preload: el maestro vigila los pesos, carga la versión nueva sin calentar
+    y llama a restart() (SIGHUP a gunicorn). Los trabajadores nuevos nacen
+    compartiendo la versión nueva; los anteriores terminan sus solicitudes
+    """
+    if not ANALYSIS_AVAILABLE or not config.MODEL_RELOAD['enabled'] or service_registry.service is None:
+        return
+    
+    def _reloaded():
+        _prepare_for_fork(service_registry.service)
+        restart()
+    
+    service_registry.watch(config.MODEL_RELOAD['interval'], warm=False, on_reload=_reloaded)
+
+def after_fork():
+    """Hook post_fork: hilos propios del trabajador, backends no compartibles y calentamiento"""
+    service = service_registry.service
+    if service is None:
+        # Sin modelos del maestro (p. ej. CUDA): cada trabajador carga y vigila los suyos
+        _watch_models()
+        return
+    
+    threads = config.ANALYSIS_THREADS
+    configure_threads(threads, workers=threads['web_workers'])
+    service.after_fork()
+    service_registry.warm()
+    # Sin vigilante propio: una recarga por trabajador crearía copias privadas
+    # de todos los modelos; el maestro recarga y reinicia (watch_models_for_restart)
+
+def get_analysis_service():
+    """Servicio listo o None (mientras carga en segundo plano o si falló)"""
+    if not ANALYSIS_AVAILABLE:
+        return None
+    return service_registry.get()
+
+def _service_unavailable():
+    """Respuesta 503: indica si el servicio aún está cargando"""
+    loading = service_registry.loading
+    response = jsonify({
+        'success': False,
+        'error': 'Servicio de análisis no disponible',
+        'message': 'El servicio se está iniciando' if loading else 'El servicio no pudo inicializarse',
+        'state': service_registry.state,
+    })
+    response.status_code = 503
+    if loading:
+        response.headers['Retry-After'] = '5'
+    return response
 
 @analysis_bp.route('/api/v1/classification/health', methods=['GET'])
 def health():
-    """Health check del servicio de análisis"""
-    print("\n🏥 HEALTH CHECK solicitado")
-    service = get_analysis_service()
+    """
+    Health check del servicio de análisis
+    live: el proceso responde; ready: modelos cargados y calentados
+    """
+    # No dispara la carga: el health check debe responder al instante
+    ready = service_registry.ready
     
     response = {
-        'status': 'ok' if service else 'error',
-        'service_ready': service is not None,
+        'status': 'ok' if ready else ('starting' if service_registry.loading else 'error'),
+        'live': True,
+        'ready': ready,
+        'state': service_registry.state,
+        'model_version': service_registry.version,
+        'service_ready': ready,
         'analysis_available': ANALYSIS_AVAILABLE,
-        'message': 'Servicio listo' if service else 'Servicio no disponible'
+        'message': 'Servicio listo' if ready else 'Servicio no disponible'
     }
+    if service_registry.error:
+        response['error'] = service_registry.error
     
-    print(f"📊 Health response: {response}")
+    # ?probe=ready: 503 hasta que esté listo (para balanceadores/orquestadores)
+    if request.args.get('probe') == 'ready' and not ready:
+        return jsonify(response), 503
     return jsonify(response)
 
 @analysis_bp.route('/api/v1/classification/analyze', methods=['POST'])
@@ -87,11 +227,8 @@ def analyze():
     """
     Endpoint principal para clasificación de imágenes
     """
-    print("\n📨 SOLICITUD DE ANÁLISIS RECIBIDA")
-    
     # Verificar si el análisis está disponible
     if not ANALYSIS_AVAILABLE:
-        print("❌ ANALYSIS_AVAILABLE = False")
         return jsonify({
             'success': False,
             'error': 'Analysis service not available',
@@ -101,114 +238,805 @@ def analyze():
     try:
         # Verificar servicio
         service = get_analysis_service()
-        print(f"🔍 Servicio obtenido: {'✅ No es None' if service else '❌ Es None'}")
         
         if service is None:
-            print("❌ El servicio es None - retornando 503")
-            return jsonify({
-                'success': False,
-                'error': 'Servicio de análisis no disponible',
-                'message': 'El servicio no pudo inicializarse'
-            }), 503
+            logger.warning("Servicio de análisis no disponible (%s), respondiendo 503", service_registry.state)
+            return _service_unavailable()
 
-        # Verificar imagen
-        if 'image' not in request.files:
-            print("❌ No se envió imagen en request.files")
-            return jsonify({
-                'success': False,
-                'error': 'No image provided',
-                'message': 'Por favor proporciona una imagen'
-            }), 400
+        # Verificar imagen y opciones de la imagen procesada
+        image_file, file_ext, error = _get_uploaded_image()
+        if error is not None:
+            return error
+        error = _check_image_options()
+        if error is not None:
+            return error
+        target, error = _check_analysis_target()
+        if error is not None:
+            return error
 
-        image_file = request.files['image']
-        print(f"📸 Archivo recibido: {image_file.filename}")
+        # Resultado en caché para la misma imagen y los mismos modelos
+        timer = StageTimer()
+        image_bytes = upload_buffer(image_file)
+        image_hash = hashlib.sha256(image_bytes).hexdigest()
+        fingerprint = _model_version()
         
-        if image_file.filename == '':
-            print("❌ Nombre de archivo vacío")
-            return jsonify({
-                'success': False,
-                'error': 'Empty filename',
-                'message': 'El archivo está vacío'
-            }), 400
-
-        # Validar extensión
-        allowed_ext = {'.jpg', '.jpeg', '.png', '.webp', '.bmp'}
-        file_ext = os.path.splitext(image_file.filename)[1].lower()
-        print(f"📄 Extensión del archivo: {file_ext}")
+        # Las opciones de renderizado forman parte de la clave
+        result_key = _result_key(image_hash)
+        cached = _cached_result(result_key, fingerprint, timer)
+        if cached is not None:
+            logger.info("Resultado en caché para %s", image_hash[:12])
+            _record_analysis(cached, image_hash, fingerprint, target)
+            return _respond_result(cached, (result_key, fingerprint), cached=True)
+
+        # Analizar imagen directamente desde el buffer de la solicitud
+        # El préstamo mantiene la versión de modelos viva aunque haya una recarga
+        with admission.admit(_admission_user(), _admission_lane('interactive')), \
+                service_registry.lease() as (service, fingerprint):
+            results = service.analyze_bytes(
+                image_bytes, image_hash=image_hash, source=image_file.filename,
+                render=_render_options(), tiled=_tiled_requested(),
+            )
+        logger.info(
+            "Análisis de %s completado: %d hojas (%.0f ms)",
+            image_file.filename, results['total_leaves'], results['timings']['total'],
+        )
         
-        if file_ext not in allowed_ext:
-            print(f"❌ Extensión no permitida: {file_ext}")
-            return jsonify({
-                'success': False,
-                'error': 'Invalid file format',
-                'message': f'Formato no soportado. Usa: {", ".join(allowed_ext)}'
-            }), 400
+        _cache_result(result_key, fingerprint, results)
+        _record_analysis(results, image_hash, fingerprint, target)
+        
+        return _respond_result(results, (result_key, fingerprint))
 
-        # Guardar temporalmente
-        with tempfile.NamedTemporaryFile(suffix=file_ext, delete=False) as tmp:
-            image_file.save(tmp.name)
-            temp_path = tmp.name
+    except AdmissionRejected as e:
+        return _admission_rejected(e)
+    except Exception as e:
+        logger.exception("Error al procesar la imagen: %s", e)
+        
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Error al procesar la imagen'
+        }), 500
 
-        print(f"💾 Imagen guardada en: {temp_path}")
+@analysis_bp.route('/api/v1/classification/analyze/stream', methods=['POST'])
+def analyze_stream():
+    """
+    Variante SSE de /analyze: eventos de progreso por etapa y el resultado final
+    Eventos: queued, admitted, decoded, detected, segmented, classified,
+    rendered, result (mismo cuerpo que /analyze) y error
+    Comentarios ': ping' periódicos mantienen viva la conexión en proxies
+    """
+    if not ANALYSIS_AVAILABLE:
+        return jsonify({
+            'success': False,
+            'error': 'Analysis service not available',
+            'message': 'El servicio de análisis no está disponible'
+        }), 503
+    
+    if get_analysis_service() is None:
+        return _service_unavailable()
+    
+    image_file, _, error = _get_uploaded_image()
+    if error is not None:
+        return error
+    error = _check_image_options()
+    if error is not None:
+        return error
+    target, error = _check_analysis_target()
+    if error is not None:
+        return error
+    
+    timer = StageTimer()
+    image_bytes = upload_buffer(image_file)
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    fingerprint = _model_version()
+    result_key = _result_key(image_hash)
+    
+    events = SimpleQueue()
+    cached = _cached_result(result_key, fingerprint, timer)
+    if cached is not None:
+        _record_analysis(cached, image_hash, fingerprint, target)
+        events.put(('result', (cached, fingerprint, True)))
+        events.put(None)
+        return _event_stream(events, result_key)
+    
+    # El análisis sigue en un hilo aunque el cliente se desconecte: el
+    # resultado queda en caché y guardado para el reintento
+    threading.Thread(
+        target=_stream_analysis,
+        args=(events, current_app._get_current_object(), bytes(image_bytes), image_hash, result_key),
+        kwargs={
+            'source': image_file.filename,
+            'user': _admission_user(),
+            'lane': _admission_lane('interactive'),
+            'render': _render_options(),
+            'tiled': _tiled_requested(),
+            'target': target,
+        },
+        name='analysis-stream',
+        daemon=True,
+    ).start()
+    
+    # Rechazo inmediato de admisión (límite de usuario, cola llena): respuesta HTTP normal
+    try:
+        first = events.get(timeout=0.5)
+    except Empty:
+        first = ('queued', {'waiting': admission.queue_depth()})
+    if first is not None and first[0] == 'rejected':
+        return _admission_rejected(first[1])
+    return _event_stream(events, result_key, first)
 
-        try:
-            # Analizar imagen
-            print("🔄 Llamando a service.analyze_image()...")
-            results = service.analyze_image(temp_path)
-            print(f"✅ Análisis completado: {results['total_leaves']} hojas detectadas")
+def _stream_analysis(events, app, image_bytes, image_hash, result_key, source, user, lane, render, tiled, target):
+    """Hilo del análisis SSE: publica el progreso en 'events' y termina con None"""
+    def progress(event, data):
+        events.put((event, data))
+    
+    try:
+        with admission.admit(user, lane), service_registry.lease() as (service, fingerprint):
+            if service is None:
+                raise RuntimeError('El servicio de análisis no está disponible')
+            events.put(('admitted', {}))
+            results = service.analyze_bytes(
+                image_bytes, image_hash=image_hash, source=source,
+                render=render, tiled=tiled, progress=progress,
+            )
+        logger.info(
+            "Análisis SSE de %s completado: %d hojas (%.0f ms)",
+            source, results['total_leaves'], results['timings']['total'],
+        )
+        _cache_result(result_key, fingerprint, results)
+        if config.ANALYSIS_PERSISTENCE['enabled']:
+            analysis_recorder.record(app, results, image_hash, fingerprint, *target)
+        events.put(('result', (results, fingerprint, False)))
+    except AdmissionRejected as e:
+        events.put(('rejected', e))
+    except Exception as e:
+        logger.exception("Error al procesar la imagen (SSE): %s", e)
+        events.put(('error', {'error': str(e), 'message': 'Error al procesar la imagen'}))
+    finally:
+        events.put(None)
+
+def _event_stream(events, result_key, first=None):
+    """Respuesta text/event-stream con los eventos de la cola y latidos"""
+    heartbeat = config.ANALYSIS_STREAM['heartbeat']
+    
+    def generate():
+        pending = [first] if first is not None else []
+        while True:
+            if pending:
+                item = pending.pop()
+            else:
+                try:
+                    item = events.get(timeout=heartbeat)
+                except Empty:
+                    yield ': ping\n\n'
+                    continue
+            if item is None:
+                return
             
-            response = {
-                'success': True,
-                'message': 'Clasificación completada exitosamente',
-                'data': {
-                    'totalLeavesDetected': results['total_leaves'],
-                    'healthyLeaves': results['healthy_leaves'],
-                    'affectedLeaves': results['affected_leaves'],
-                    'processedImage': results['processed_image_base64'],
-                    'confidence': results['confidence'],
-                    'timestamp': results['timestamp']
+            event, data = item
+            if event == 'result':
+                results, fingerprint, cached = data
+                # Sin multipart en SSE: la imagen va inline o por URL
+                data = _build_response(results, cached, (result_key, fingerprint))
+            elif event == 'rejected':
+                event, data = 'error', {
+                    'status': data.status,
+                    'message': data.reason,
+                    'retryAfter': data.retry_after,
                 }
-            }
-            
-            return jsonify(response), 200
+            yield f"event: {event}\ndata: {current_app.json.dumps(data)}\n\n"
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # nginx: no acumular la respuesta en el buffer del proxy
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
-        except Exception as analyze_error:
-            print(f"💥 Error en analyze_image: {analyze_error}")
-            traceback.print_exc()
-            raise analyze_error
+def _request_identity():
+    """Identidad JWT de la solicitud o None (los endpoints de análisis no exigen token)"""
+    try:
+        verify_jwt_in_request(optional=True)
+        return get_jwt_identity()
+    except Exception:
+        return None
 
-        finally:
-            # Limpiar archivo temporal
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-                print(f"🧹 Archivo temporal eliminado: {temp_path}")
+def _admission_user():
+    """Usuario para el límite por usuario: identidad JWT si la hay, si no la IP"""
+    identity = _request_identity()
+    return f"user:{identity}" if identity is not None else f"ip:{request.remote_addr}"
 
-    except Exception as e:
-        print(f"💥 ERROR GENERAL: {str(e)}")
-        print("🔍 Traceback completo:")
-        traceback.print_exc()
+def _admission_lane(default):
+    """
+    Carril del endpoint; el cliente solo puede bajar la prioridad (?lane=bulk)
+    Los lotes siempre van por 'bulk' aunque pidan 'interactive'
+    """
+    if default == 'bulk' or request.values.get('lane') == 'bulk':
+        return 'bulk'
+    return 'interactive'
+
+def _admission_rejected(error):
+    """429/503 con Retry-After cuando no hay capacidad para analizar"""
+    logger.warning("Análisis rechazado (%d): %s", error.status, error.reason)
+    response = jsonify({
+        'success': False,
+        'error': 'Too many requests' if error.status == 429 else 'Service busy',
+        'message': error.reason,
+        'retryAfter': error.retry_after,
+    })
+    response.status_code = error.status
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def _get_uploaded_image():
+    """Valida la imagen de request.files; devuelve (archivo, extensión, error)"""
+    if 'image' not in request.files:
+        return None, None, (jsonify({
+            'success': False,
+            'error': 'No image provided',
+            'message': 'Por favor proporciona una imagen'
+        }), 400)
+
+    image_file = request.files['image']
+    
+    if image_file.filename == '':
+        return None, None, (jsonify({
+            'success': False,
+            'error': 'Empty filename',
+            'message': 'El archivo está vacío'
+        }), 400)
+
+    # Validar extensión
+    file_ext = os.path.splitext(image_file.filename)[1].lower()
+    
+    if file_ext not in ALLOWED_IMAGE_EXTENSIONS:
+        logger.info("Extensión no permitida: %s", file_ext)
+        return None, None, (jsonify({
+            'success': False,
+            'error': 'Invalid file format',
+            'message': f'Formato no soportado. Usa: {", ".join(ALLOWED_IMAGE_EXTENSIONS)}'
+        }), 400)
+
+    return image_file, file_ext, None
+
+def _check_image_options():
+    """Valida las opciones de la imagen procesada; devuelve la respuesta de error o None"""
+    variant, delivery = _image_options()
+    message = None
+    if variant not in PROCESSED_IMAGE_VARIANTS or delivery not in IMAGE_DELIVERY_MODES:
+        message = (
+            f'processedImage debe ser {"|".join(PROCESSED_IMAGE_VARIANTS)} '
+            f'e imageDelivery {"|".join(IMAGE_DELIVERY_MODES)}'
+        )
+    elif request.values.get('imageFormat', 'jpeg') not in IMAGE_FORMATS:
+        message = f'imageFormat debe ser {"|".join(IMAGE_FORMATS)}'
+    else:
+        try:
+            _render_options()
+        except ValueError:
+            message = 'imageQuality debe estar entre 1 y 100 e imageMaxDim ser un entero >= 0'
+    
+    if message is None:
+        return None
+    return jsonify({
+        'success': False,
+        'error': 'Invalid image options',
+        'message': message
+    }), 400
+
+def _image_options():
+    """(variante, entrega) de la imagen procesada pedidas por el cliente"""
+    return (
+        request.values.get('processedImage', 'full'),
+        request.values.get('imageDelivery', 'inline'),
+    )
+
+def _render_options():
+    """
+    Opciones de renderizado para el servicio (las omitidas usan MODELS['RENDER'])
+    processedImage, imageFormat=jpeg|webp, imageQuality=1-100, imageMaxDim=px
+    """
+    render = {'variant': request.values.get('processedImage', 'full')}
+    if request.values.get('imageFormat'):
+        render['format'] = request.values['imageFormat']
+    if request.values.get('imageQuality'):
+        render['quality'] = int(request.values['imageQuality'])
+        if not 1 <= render['quality'] <= 100:
+            raise ValueError(render['quality'])
+    if request.values.get('imageMaxDim'):
+        render['max_dim'] = int(request.values['imageMaxDim'])
+        if render['max_dim'] < 0:
+            raise ValueError(render['max_dim'])
+    return render
+
+def _target_error(status, error, message):
+    return None, (jsonify({'success': False, 'error': error, 'message': message}), status)
+
+def _check_analysis_target():
+    """
+    ((finca_id, encuesta_id), error) a los que se asocia el análisis
+    Solo se aceptan si el usuario autenticado es dueño de la finca y de la
+    encuesta; con solo encuesta_id la finca es la de la encuesta
+    """
+    if not config.ANALYSIS_PERSISTENCE['enabled']:
+        return (None, None), None
+    
+    finca_id = request.values.get('finca_id', type=int)
+    encuesta_id = request.values.get('encuesta_id', type=int)
+    for name, value in (('finca_id', finca_id), ('encuesta_id', encuesta_id)):
+        if value is None and request.values.get(name):
+            return _target_error(400, 'Invalid target', f'{name} debe ser un entero')
+    if finca_id is None and encuesta_id is None:
+        return (None, None), None
+    
+    user_id = _request_identity()
+    if user_id is None:
+        return _target_error(
+            401, 'Authentication required', 'Asociar un análisis a una finca o encuesta requiere autenticación'
+        )
+    
+    try:
+        if encuesta_id is not None:
+            survey = Survey.query.get(encuesta_id)
+            if not survey or survey.usuario_id != user_id:
+                return _target_error(404, 'Survey not found', 'Encuesta no encontrada o no autorizada')
+            if finca_id is None:
+                finca_id = survey.finca_id
+            elif finca_id != survey.finca_id:
+                return _target_error(400, 'Invalid target', 'La encuesta no pertenece a la finca indicada')
         
+        farm = Farm.query.get(finca_id)
+        if not farm or farm.usuario_id != user_id:
+            return _target_error(404, 'Farm not found', 'Finca no encontrada o no autorizada')
+    except SQLAlchemyError as e:
+        logger.warning("No se pudo validar la finca/encuesta del análisis: %s", e)
+        return _target_error(500, 'Database error', 'No se pudo validar la finca o encuesta')
+    
+    return (finca_id, encuesta_id), None
+
+def _record_analysis(results, image_hash, fingerprint, target, app=None):
+    """Encola el resultado para guardarlo en analisis_imagen (target ya validado)"""
+    if not config.ANALYSIS_PERSISTENCE['enabled']:
+        return
+    finca_id, encuesta_id = target
+    analysis_recorder.record(
+        app or current_app._get_current_object(), results, image_hash, fingerprint, finca_id, encuesta_id
+    )
+
+def _tiled_requested():
+    """Detección por teselas pedida con ?tiled=1"""
+    return request.values.get('tiled') in ('1', 'true')
+
+def _result_key(image_hash):
+    """Clave de caché: imagen + opciones de detección y renderizado de la solicitud"""
+    options = dict(_render_options(), tiled=int(_tiled_requested()))
+    return ':'.join([image_hash] + [f"{k}={options[k]}" for k in sorted(options)])
+
+def _respond_result(results, image_ref, cached=False):
+    """Respuesta del endpoint de análisis (JSON o multipart según imageDelivery)"""
+    parts = []
+    payload = _build_response(results, cached, image_ref, parts)
+    return _respond(payload, 200, parts)
+
+def _respond(payload, status=200, parts=None):
+    """
+    JSON, o multipart/mixed con el JSON como primera parte y las imágenes
+    como partes binarias referenciadas por processedImagePart
+    """
+    if not parts:
+        return jsonify(payload), status
+
+    boundary = uuid.uuid4().hex
+    body = [
+        f'--{boundary}\r\nContent-Type: application/json\r\n'
+        f'Content-Disposition: inline; name="result"\r\n\r\n'.encode('ascii'),
+        current_app.json.dumps(payload).encode('utf-8'),
+        b'\r\n',
+    ]
+    for name, data, mimetype in parts:
+        filename = name + (mimetypes.guess_extension(mimetype) or '')
+        body += [
+            f'--{boundary}\r\nContent-Type: {mimetype}\r\nContent-ID: <{name}>\r\n'
+            f'Content-Disposition: attachment; name="{name}"; filename="{filename}"\r\n\r\n'.encode('ascii'),
+            data,
+            b'\r\n',
+        ]
+    body.append(f'--{boundary}--\r\n'.encode('ascii'))
+    return Response(b''.join(body), status=status, mimetype=f'multipart/mixed; boundary={boundary}')
+
+def _build_response(results, cached=False, image_ref=None, parts=None):
+    """Respuesta JSON del endpoint de análisis"""
+    return {
+        'success': True,
+        'message': 'Clasificación completada exitosamente',
+        'data': _result_data(results, cached, image_ref, parts)
+    }
+
+def _result_data(results, cached=False, image_ref=None, parts=None):
+    """
+    Datos de un resultado de análisis en el formato de la API
+    image_ref: (clave del resultado, huella de modelos) para servir la imagen por id
+    parts: lista donde se agregan las imágenes si la entrega es multipart
+    """
+    data = {
+        'totalLeavesDetected': results['total_leaves'],
+        'healthyLeaves': results['healthy_leaves'],
+        'affectedLeaves': results['affected_leaves'],
+        'processedImage': None,
+        'confidence': results['confidence'],
+        'leaves': results['leaves'],
+        'timestamp': results['timestamp'],
+        'cached': cached
+    }
+    _attach_processed_image(data, results, image_ref, parts)
+    
+    # Perfil de inferencia usado (imgsz/conf de YOLO y carga al detectar)
+    if 'profile' in results:
+        data['profile'] = results['profile']
+    
+    # Tiempos por etapa solo si el cliente los pide (?timings=1)
+    if request.values.get('timings') in ('1', 'true') and 'timings' in results:
+        data['timings'] = results['timings']
+    return data
+
+def _attach_processed_image(data, results, image_ref, parts):
+    """Agrega la imagen procesada según processedImage e imageDelivery"""
+    variant, delivery = _image_options()
+    if variant == 'none':
+        return
+    
+    # La variante ya viene renderizada por el servicio
+    image = results['processed_image']
+    mimetype = results['processed_image_type']
+    if not image:
+        # Sin detecciones no hay imagen anotada
+        data['processedImage'] = ''
+        return
+    
+    if delivery == 'url' and image_ref is not None:
+        key = image_id(image_ref[0], image_ref[1])
+        image_store.put(key, image, mimetype)
+        data['processedImageUrl'] = url_for('analysis.processed_image', image_key=key)
+    elif delivery == 'multipart' and parts is not None:
+        name = f'image-{len(parts) + 1}'
+        parts.append((name, image, mimetype))
+        data['processedImagePart'] = name
+    else:
+        data['processedImage'] = f"data:{mimetype};base64,{base64.b64encode(image).decode('ascii')}"
+
+def _result_size(results):
+    """Tamaño aproximado en memoria de un resultado cacheado"""
+    return len(results['processed_image'] or b'') + 128 * len(results['leaves']) + 512
+
+def _cached_result(result_key, fingerprint, timer):
+    """
+    Resultado en caché con los tiempos de esta solicitud (lectura, hash y
+    búsqueda), no los del análisis original que lo generó
+    """
+    with timer.stage('cache'):
+        cached = result_cache.get(result_key, fingerprint)
+    if cached is None:
+        return None
+    return {**cached, 'timings': timer.as_dict()}
+
+def _cache_result(result_key, fingerprint, results):
+    """
+    Guarda el resultado si viene de la versión de modelos activa
+    Uno de otra versión (préstamo iniciado antes de una recarga o trabajador
+    de la cola aún sin recargar) vaciaría la caché de la versión vigente
+    Tampoco los calculados con el perfil degradado por carga: la clave no
+    incluye el perfil y se servirían después aunque el servidor esté libre
+    """
+    if fingerprint != _model_version():
+        return
+    if results.get('profile', {}).get('degraded'):
+        return
+    result_cache.put(result_key, fingerprint, results, _result_size(results))
+
+@analysis_bp.route('/api/v1/classification/images/<image_key>', methods=['GET'])
+def processed_image(image_key):
+    """Imagen procesada por id (processedImageUrl), cacheable por el cliente"""
+    entry = image_store.get(image_key)
+    if entry is None:
+        return jsonify({
+            'success': False,
+            'error': 'Image not found',
+            'message': 'Imagen no encontrada o expirada'
+        }), 404
+    
+    data, mimetype = entry
+    response = Response(data, mimetype=mimetype)
+    # El id depende del contenido y de los modelos: nunca cambia
+    response.headers['Cache-Control'] = f"private, max-age={config.PROCESSED_IMAGES['max_age']}, immutable"
+    response.set_etag(image_key)
+    return response.make_conditional(request)
+
+@analysis_bp.route('/api/v1/classification/analyze-batch', methods=['POST'])
+def analyze_batch():
+    """
+    Analiza varias imágenes de una visita en una sola solicitud
+    Devuelve resultados por imagen y un agregado de la parcela
+    """
+    if not ANALYSIS_AVAILABLE:
+        return jsonify({
+            'success': False,
+            'error': 'Analysis service not available',
+            'message': 'El servicio de análisis no está disponible'
+        }), 503
+
+    service = get_analysis_service()
+    if service is None:
+        return _service_unavailable()
+
+    image_files = request.files.getlist('images')
+    if not image_files:
+        return jsonify({
+            'success': False,
+            'error': 'No images provided',
+            'message': 'Por favor proporciona imágenes en el campo "images"'
+        }), 400
+
+    if len(image_files) > config.MAX_BATCH_IMAGES:
+        return jsonify({
+            'success': False,
+            'error': 'Too many images',
+            'message': f'Máximo {config.MAX_BATCH_IMAGES} imágenes por solicitud'
+        }), 400
+
+    error = _check_image_options()
+    if error is not None:
+        return error
+    target, error = _check_analysis_target()
+    if error is not None:
+        return error
+
+    fingerprint = _model_version()
+    entries = []
+    pending = []
+
+    try:
+        for image_file in image_files:
+            entry = {'filename': image_file.filename, 'results': None, 'cached': False, 'error': None}
+            entries.append(entry)
+
+            file_ext = os.path.splitext(image_file.filename or '')[1].lower()
+            if file_ext not in ALLOWED_IMAGE_EXTENSIONS:
+                entry['error'] = f'Formato no soportado: {file_ext or "sin extensión"}'
+                continue
+
+            timer = StageTimer()
+            image_bytes = upload_buffer(image_file)
+            entry['image_hash'] = hashlib.sha256(image_bytes).hexdigest()
+            entry['result_key'] = _result_key(entry['image_hash'])
+            cached = _cached_result(entry['result_key'], fingerprint, timer)
+            if cached is not None:
+                entry['results'] = cached
+                entry['cached'] = True
+                continue
+
+            pending.append((entry, image_bytes))
+
+        if pending:
+            # Las sincronizaciones por lotes van por el carril de baja prioridad
+            with admission.admit(_admission_user(), _admission_lane('bulk')), \
+                    service_registry.lease() as (service, fingerprint):
+                outputs = service.analyze_images_bytes(
+                    [image_bytes for _, image_bytes in pending],
+                    image_hashes=[entry['image_hash'] for entry, _ in pending],
+                    sources=[entry['filename'] for entry, _ in pending],
+                    render=_render_options(),
+                    tiled=_tiled_requested(),
+                )
+            for (entry, _), results in zip(pending, outputs):
+                if 'error' in results:
+                    entry['error'] = results['error']
+                    continue
+                entry['results'] = results
+                _cache_result(entry['result_key'], fingerprint, results)
+
+    except AdmissionRejected as e:
+        return _admission_rejected(e)
+    except Exception as e:
+        logger.exception("Error al procesar el lote: %s", e)
         return jsonify({
             'success': False,
             'error': str(e),
+            'message': 'Error al procesar las imágenes'
+        }), 500
+
+    images = []
+    parts = []
+    for entry in entries:
+        if entry['results'] is None:
+            images.append({'filename': entry['filename'], 'success': False, 'error': entry['error']})
+        else:
+            _record_analysis(entry['results'], entry['image_hash'], fingerprint, target)
+            images.append({
+                'filename': entry['filename'],
+                'success': True,
+                **_result_data(entry['results'], entry['cached'], (entry['result_key'], fingerprint), parts)
+            })
+
+    return _respond({
+        'success': True,
+        'message': 'Clasificación por lotes completada',
+        'data': {
+            'images': images,
+            'aggregate': _aggregate_results([e['results'] for e in entries if e['results'] is not None], len(entries))
+        }
+    }, 200, parts)
+
+def _aggregate_results(results_list, requested):
+    """Agregado a nivel de parcela de varios resultados"""
+    total = sum(r['total_leaves'] for r in results_list)
+    healthy = sum(r['healthy_leaves'] for r in results_list)
+    affected = sum(r['affected_leaves'] for r in results_list)
+    # Confianza media ponderada por número de hojas
+    confidence = sum(r['confidence'] * r['total_leaves'] for r in results_list) / total if total else 0.0
+
+    return {
+        'imagesRequested': requested,
+        'imagesAnalyzed': len(results_list),
+        'imagesFailed': requested - len(results_list),
+        'totalLeavesDetected': total,
+        'healthyLeaves': healthy,
+        'affectedLeaves': affected,
+        'affectedRatio': affected / total if total else 0.0,
+        'confidence': confidence,
+    }
+
+def get_job_queue():
+    """Cola de trabajos del proceso (el pool arranca solo en el proceso dueño)"""
+    global job_queue
+    with _job_queue_lock:
+        if job_queue is None and ANALYSIS_AVAILABLE:
+            from app.scripts.job_queue import AnalysisJobQueue
+            jobs_config = config.ANALYSIS_JOBS
+            app = current_app._get_current_object()
+            job_queue = AnalysisJobQueue(
+                config.MODELS,
+                job_store,
+                workers=jobs_config['workers'],
+                max_queue=jobs_config['max_queue'],
+                result_ttl=jobs_config['result_ttl'],
+                on_done=lambda job, results: _job_completed(app, job, results),
+            )
+    return job_queue
+
+def _job_completed(app, job, results):
+    """Caché y registro de un trabajo terminado, una sola vez (proceso dueño del pool)"""
+    meta = job['meta']
+    # Versión del trabajador que lo analizó, no la vigente al encolarlo
+    fingerprint = job['version'] or meta['fingerprint']
+    _cache_result(meta['result_key'], fingerprint, results)
+    _record_analysis(results, meta['image_hash'], fingerprint, tuple(meta['target']), app=app)
+
+def _job_info(job):
+    """Estado público de un trabajo"""
+    return {
+        'jobId': job['id'],
+        'status': job['status'],
+        'submittedAt': job['submitted_at'],
+        'startedAt': job['started_at'],
+        'finishedAt': job['finished_at'],
+        'error': job['error'],
+    }
+
+@analysis_bp.route('/api/v1/classification/jobs', methods=['POST'])
+def submit_job():
+    """Encola una imagen para análisis asíncrono"""
+    if not ANALYSIS_AVAILABLE:
+        return jsonify({
+            'success': False,
+            'error': 'Analysis service not available',
+            'message': 'El servicio de análisis no está disponible'
+        }), 503
+
+    image_file, _, error = _get_uploaded_image()
+    if error is not None:
+        return error
+    error = _check_image_options()
+    if error is not None:
+        return error
+    target, error = _check_analysis_target()
+    if error is not None:
+        return error
+
+    from app.scripts.job_queue import QueueFullError
+
+    timer = StageTimer()
+    image_bytes = upload_buffer(image_file)
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    fingerprint = _model_version()
+    meta = {
+        'image_hash': image_hash,
+        'result_key': _result_key(image_hash),
+        'fingerprint': fingerprint,
+        'target': target,
+    }
+
+    cached = _cached_result(meta['result_key'], fingerprint, timer)
+    if cached is not None:
+        # Sin pasar por el pool: se registra ahora, una vez
+        _record_analysis(cached, image_hash, fingerprint, target)
+        job_id = job_store.add_completed(cached, meta=meta, version=fingerprint)['id']
+    else:
+        try:
+            job_id = get_job_queue().submit(
+                bytes(image_bytes), image_hash=image_hash, meta=meta,
+                render=_render_options(), tiled=_tiled_requested(),
+            )
+        except QueueFullError as e:
+            return jsonify({
+                'success': False,
+                'error': 'Queue full',
+                'message': str(e)
+            }), 503, {'Retry-After': '30'}
+
+    return jsonify({
+        'success': True,
+        'message': 'Trabajo encolado',
+        'data': _job_info(job_store.get(job_id))
+    }), 202
+
+@analysis_bp.route('/api/v1/classification/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Estado de un trabajo de análisis"""
+    # Solo lectura del almacén: consultar no arranca el pool
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': 'Job not found',
+            'message': 'Trabajo no encontrado o expirado'
+        }), 404
+
+    return jsonify({'success': True, 'data': _job_info(job)}), 200
+
+@analysis_bp.route('/api/v1/classification/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """Resultado de un trabajo terminado"""
+    job = job_store.get(job_id)
+    results = job_store.load_result(job_id) if job and job['status'] == 'done' else None
+    if job is None or (job['status'] == 'done' and results is None):
+        return jsonify({
+            'success': False,
+            'error': 'Job not found',
+            'message': 'Trabajo no encontrado o expirado'
+        }), 404
+
+    if job['status'] == 'error':
+        return jsonify({
+            'success': False,
+            'error': job['error'],
             'message': 'Error al procesar la imagen'
         }), 500
 
+    if job['status'] != 'done':
+        return jsonify({'success': True, 'data': _job_info(job)}), 202
+
+    error = _check_image_options()
+    if error is not None:
+        return error
+
+    # Caché y registro ya hechos al terminar el trabajo (_job_completed)
+    meta = job['meta']
+    image_ref = (meta['result_key'], job['version'] or meta['fingerprint'])
+    return _respond_result(results, image_ref)
+
 @analysis_bp.route('/api/v1/classification/status', methods=['GET'])
 def status():
     """Estado del servicio y modelos"""
-    print("\n📊 STATUS solicitado")
     service = get_analysis_service()
     
     status_info = {
         'status': 'running',
         'service_ready': service is not None,
+        'state': service_registry.state,
         'analysis_available': ANALYSIS_AVAILABLE,
         'models_loaded': False
     }
     
     if service:
-        from config import config
         status_info.update({
             'device': str(service.device),
             'models_loaded': True,
@@ -216,12 +1044,25 @@ def status():
                 'yolo': os.path.exists(config.MODELS['YOLO']['weights']),
                 'classifier': os.path.exists(config.MODELS['RESNET']['weights']),
                 'sam': os.path.exists(config.MODELS['SAM']['checkpoint']),
-            }
+            },
+            'caches': {
+                'sam_embeddings': service.embedding_cache.stats() if service.embedding_cache else None,
+                'results': result_cache.stats(),
+                'images': image_store.stats(),
+            },
+            'persistence': analysis_recorder.stats(),
         })
     
-    print(f"📈 Status response: {status_info}")
+    # Versión de modelos activa, recargas y versiones anteriores drenando
+    status_info['model_version'] = service_registry.versions()
+    
+    # Control de admisión: en curso, en espera y rechazos por carril
+    status_info['admission'] = admission.stats()
+    
+    if job_queue is not None:
+        status_info['jobs'] = job_queue.stats()
+    
+    # Histogramas de latencia por etapa de este proceso
+    status_info['latency'] = latency_histograms.snapshot()
+    
     return jsonify(status_info)
-
-print("=" * 60)
-print("✅ MÓDULO DE ANÁLISIS CARGADO")
-print("=" * 60)
\ No newline at end of file
@@ -3,13 +3,18 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from sqlalchemy.exc import SQLAlchemyError
+from datetime import date, datetime, timedelta
 from app.extensions import db
 from app.models.farm_model import Farm
+from app.models.image_analysis_model import ImageAnalysis
 from app.models.user_model import User
 
 # Crear Blueprint para las rutas de fincas
 farm_bp = Blueprint('farm', __name__)
 
+# Agrupaciones de la tendencia de análisis por finca
+TREND_PERIODS = ('dia', 'semana', 'mes')
+
 # Endpoint para crear una nueva finca
 @farm_bp.route('/api/fincas', methods=['POST'])
 @jwt_required()
@@ -225,4 +230,137 @@ def list_farms():
         return jsonify({
             "error": True,
             "message": f"Error al listar las fincas: {str(e)}"
-        }), 500
\ No newline at end of file
+        }), 500
+
+
+def _trend_period(day, periodo):
+    """Etiqueta del periodo al que pertenece un día"""
+    if periodo == 'dia':
+        return day.isoformat()
+    if periodo == 'semana':
+        iso = day.isocalendar()
+        return f"{iso[0]}-W{iso[1]:02d}"
+    return day.strftime('%Y-%m')
+
+
+# Endpoint para obtener la tendencia de hojas afectadas de una finca
+# Parámetros: periodo=dia|semana|mes, fecha_inicio y fecha_fin (YYYY-MM-DD)
+@farm_bp.route('/api/fincas/<int:farm_id>/tendencia', methods=['GET'])
+@jwt_required()
+def farm_trend(farm_id):
+    try:
+        # Obtener el ID del usuario autenticado
+        user_id = get_jwt_identity()
+
+        # Buscar la finca
+        farm = Farm.query.get(farm_id)
+        if not farm or farm.usuario_id != user_id:
+            return jsonify({
+                "error": True,
+                "message": "Finca no encontrada o no autorizada"
+            }), 404
+
+        periodo = request.args.get('periodo', 'semana')
+        if periodo not in TREND_PERIODS:
+            return jsonify({
+                "error": True,
+                "message": f"periodo debe ser {'|'.join(TREND_PERIODS)}"
+            }), 400
+
+        # Agregado diario en la base de datos; semanas y meses se agrupan aquí
+        day = db.func.date(ImageAnalysis.created_at)
+        query = db.session.query(
+            day,
+            db.func.count(ImageAnalysis.id),
+            db.func.sum(ImageAnalysis.total_hojas),
+            db.func.sum(ImageAnalysis.hojas_sanas),
+            db.func.sum(ImageAnalysis.hojas_afectadas),
+        ).filter(ImageAnalysis.finca_id == farm_id)
+
+        if request.args.get('fecha_inicio'):
+            fecha_inicio = datetime.strptime(request.args['fecha_inicio'], '%Y-%m-%d')
+            query = query.filter(ImageAnalysis.created_at >= fecha_inicio)
+        if request.args.get('fecha_fin'):
+            fecha_fin = datetime.strptime(request.args['fecha_fin'], '%Y-%m-%d') + timedelta(days=1)
+            query = query.filter(ImageAnalysis.created_at < fecha_fin)
+
+        buckets = {}
+        for dia, analisis, total, sanas, afectadas in query.group_by(day).order_by(day).all():
+            if isinstance(dia, str):
+                dia = date.fromisoformat(dia)
+            key = _trend_period(dia, periodo)
+            bucket = buckets.setdefault(key, {
+                'periodo': key, 'analisis': 0, 'total_hojas': 0, 'hojas_sanas': 0, 'hojas_afectadas': 0,
+            })
+            bucket['analisis'] += int(analisis)
+            bucket['total_hojas'] += int(total or 0)
+            bucket['hojas_sanas'] += int(sanas or 0)
+            bucket['hojas_afectadas'] += int(afectadas or 0)
+
+        tendencia = list(buckets.values())
+        for bucket in tendencia:
+            total = bucket['total_hojas']
+            bucket['porcentaje_afectadas'] = round(bucket['hojas_afectadas'] / total * 100, 2) if total else 0
+
+        # Retornar la respuesta JSON
+        return jsonify({
+            "success": True,
+            "data": {
+                "finca_id": farm_id,
+                "periodo": periodo,
+                "tendencia": tendencia
+            },
+            "message": "Tendencia generada exitosamente"
+        }), 200
+
+    except ValueError as e:
+        return jsonify({
+            "error": True,
+            "message": f"Formato de fecha inválido: {str(e)}"
+        }), 400
+    except SQLAlchemyError as e:
+        return jsonify({
+            "error": True,
+            "message": f"Error al generar la tendencia: {str(e)}"
+        }), 500
+
+
+# Endpoint para listar los análisis de imágenes de una finca (?limit, ?hojas=1)
+@farm_bp.route('/api/fincas/<int:farm_id>/analisis', methods=['GET'])
+@jwt_required()
+def farm_analyses(farm_id):
+    try:
+        # Obtener el ID del usuario autenticado
+        user_id = get_jwt_identity()
+
+        # Buscar la finca
+        farm = Farm.query.get(farm_id)
+        if not farm or farm.usuario_id != user_id:
+            return jsonify({
+                "error": True,
+                "message": "Finca no encontrada o no autorizada"
+            }), 404
+
+        # Más recientes primero
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+        include_leaves = request.args.get('hojas') in ('1', 'true')
+        analyses = (
+            ImageAnalysis.query
+            .filter_by(finca_id=farm_id)
+            .order_by(ImageAnalysis.created_at.desc())
+            .limit(limit)
+            .all()
+        )
+
+        # Retornar la respuesta JSON
+        return jsonify({
+            "success": True,
+            "data": [a.to_dict(include_leaves) for a in analyses],
+            "message": "Análisis obtenidos exitosamente"
+        }), 200
+
+    except SQLAlchemyError as e:
+        return jsonify({
+            "error": True,
+            "message": f"Error al obtener los análisis: {str(e)}"
+        }), 500
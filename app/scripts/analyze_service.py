@@ -6,32 +6,119 @@ YOLO (detección) → SAM (segmentación) → ResNet (clasificación)
 """
 
 import os
+import logging
+import threading
+import time
 import cv2
 import numpy as np
 import torch
 import torch.nn as nn
-from PIL import Image
+from collections import Counter
+from contextlib import contextmanager
 from datetime import datetime
-from torchvision import transforms, models
+from torchvision import models
 from ultralytics import YOLO
-import base64
+import hashlib
 import urllib.request
 from pathlib import Path
 
+from .classifier_backends import (
+    EagerBackend,
+    check_parity,
+    load_exported_backend,
+    load_quantized_backend,
+)
+from .embedding_cache import EmbeddingCache
+from .timing import StageTimer, latency_histograms
+
+
+logger = logging.getLogger(__name__)
+
+
+# Factores de reducción DCT de libjpeg disponibles en OpenCV
+REDUCED_JPEG_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+}
+
+# Marcadores SOF (inicio de frame) que contienen las dimensiones
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _jpeg_size(data):
+    """(ancho, alto) leídos de la cabecera de un JPEG sin decodificarlo"""
+    view = memoryview(data).cast('B')
+    n = len(view)
+    if n < 4 or view[0] != 0xFF or view[1] != 0xD8:
+        return None
+    
+    i = 2
+    while i + 9 < n:
+        if view[i] != 0xFF:
+            return None
+        marker = view[i + 1]
+        if marker == 0xFF:  # Bytes de relleno
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:  # Marcadores sin longitud
+            i += 2
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            height = (view[i + 5] << 8) | view[i + 6]
+            width = (view[i + 7] << 8) | view[i + 8]
+            return width, height
+        i += 2 + ((view[i + 2] << 8) | view[i + 3])
+    
+    return None
+
+
+def _notify(progress, event, **data):
+    """Evento de progreso para el llamador; un fallo del callback no detiene el análisis"""
+    if progress is None:
+        return
+    try:
+        progress(event, data)
+    except Exception as e:
+        logger.debug("[ANALYZE] Callback de progreso falló en '%s': %s", event, e)
+
+
+def _tile_starts(length, tile, overlap):
+    """Inicios de las teselas en un eje; la última queda alineada al borde"""
+    if length <= tile:
+        return [0]
+    stride = max(1, int(tile * (1 - overlap)))
+    starts = list(range(0, length - tile, stride))
+    starts.append(length - tile)
+    return starts
+
 
 class AnalysisService:
     """Servicio para analizar imágenes con pipeline optimizado"""
     
-    def __init__(self, config):
+    def __init__(self, config, concurrency=1):
         self.config = config
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         
+        # Inferencias simultáneas: cada una usa el presupuesto de hilos intra-op,
+        # más solicitudes en paralelo solo sobresuscribirían los núcleos
+        self._concurrency = max(1, int(concurrency))
+        self._inference_slots = threading.BoundedSemaphore(self._concurrency)
+        # Análisis esperando un cupo: mide la carga para el perfil adaptativo
+        self._waiting = 0
+        self._waiting_lock = threading.Lock()
+        # Un solo YOLO para todos los cupos: predict() reescribe predictor.args
+        # (imgsz/conf) en cada llamada, dos perfiles a la vez se pisarían
+        self._yolo_lock = threading.Lock()
+        # Cola externa opcional (p. ej. control de admisión de la API): callable -> int
+        self.load_probe = None
+        
         # Cargar modelos
         self._load_yolo()
         self._load_classifier()
         self._load_sam()
         
-        print(f"[INFO] Modelos cargados. Device: {self.device}")
+        logger.info("Modelos cargados. Device: %s", self.device)
     
     def _load_yolo(self):
         """Carga YOLO exacto como el original"""
@@ -39,8 +126,17 @@ class AnalysisService:
         if not os.path.exists(yolo_path):
             raise FileNotFoundError(f"Modelo YOLO no encontrado: {yolo_path}")
         
+        # Variante INT8 (ONNX) generada por app/scripts/quantization.py
+        if self.config['YOLO'].get('quantized', False):
+            int8_path = os.path.splitext(yolo_path)[0] + '.int8.onnx'
+            if os.path.exists(int8_path) and os.path.getmtime(int8_path) >= os.path.getmtime(yolo_path):
+                self.yolo = YOLO(int8_path, task='detect')
+                logger.info("[YOLO] Cargado INT8 desde %s", int8_path)
+                return
+            logger.warning("[YOLO] No hay variante INT8 al día en %s, usando float", int8_path)
+        
         self.yolo = YOLO(yolo_path)
-        print(f"[YOLO] Cargado desde {yolo_path}")
+        logger.info("[YOLO] Cargado desde %s", yolo_path)
     
     def _load_classifier(self):
         """Carga ResNet exacto como el original"""
@@ -67,29 +163,62 @@ class AnalysisService:
         # Cargar pesos - IGUAL AL ORIGINAL
         state = ckpt.get("state_dict", ckpt)
         model.load_state_dict(state)
-        model.to(self.device).eval()
+        model.to(self.device, memory_format=torch.channels_last).eval()
         self.classifier = model
         
-        # Transform - IGUAL AL ORIGINAL
-        img_size = int(args.get("img_size", 384))
-        mean = [0.485, 0.456, 0.406]
-        std = [0.229, 0.224, 0.225]
-        self.clf_transform = transforms.Compose([
-            transforms.Resize((img_size, img_size)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean, std),
-        ])
+        # Preprocesado - mismos parámetros que Resize/ToTensor/Normalize del original
+        self.clf_img_size = int(args.get("img_size", 384))
+        mean = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+        std = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+        # (x / 255 - mean) / std == x * scale - shift
+        self.clf_scale = 1.0 / (255.0 * std)
+        self.clf_shift = mean / std
+        
+        self.classifier_backend = self._load_classifier_backend(clf_path)
         
-        print(f"[CLASSIFIER] ResNet cargado. Clases: {self.class_names}")
+        logger.info(
+            "[CLASSIFIER] ResNet cargado. Clases: %s. Backend: %s",
+            self.class_names, self.classifier_backend.name,
+        )
+    
+    def _load_classifier_backend(self, clf_path):
+        """Backend de inferencia configurado, validado contra el modelo eager"""
+        
+        eager = EagerBackend(self.classifier)
+        backend_name = self.config['RESNET'].get('backend', 'eager')
+        if backend_name == 'eager':
+            return eager
+        
+        try:
+            if backend_name == 'int8':
+                # La cuantización cambia las salidas: la precisión se valida
+                # con el informe de quantization.py, aquí solo se compara
+                backend = load_quantized_backend(clf_path, self.device)
+                atol = self.config['RESNET'].get('int8_parity_atol')
+            else:
+                backend = load_exported_backend(
+                    backend_name, self.classifier, clf_path, self.clf_img_size, self.device
+                )
+                atol = self.config['RESNET'].get('parity_atol', 1e-3)
+            max_diff = check_parity(eager, backend, self.clf_img_size, self.device, atol=atol)
+            logger.info("[CLASSIFIER] Paridad %s vs eager: %.2e", backend_name, max_diff)
+            return backend
+        except Exception as e:
+            logger.warning("[CLASSIFIER] Backend %s descartado, usando eager: %s", backend_name, e)
+            return eager
     
     def _load_sam(self):
         """Carga SAM como el original"""
         # CAMBIO IMPORTANTE: Eliminar la importación problemática
-        sam_mode = self.config.get('SAM_MODE', 'off')
+        # Modos: 'off', 'classify' (generador automático por recorte),
+        # 'prompt' (una codificación por imagen + cajas YOLO como prompt)
+        sam_mode = self.config['SAM'].get('mode', 'off')
+        self.sam_mode = sam_mode
+        self.embedding_cache = None
         if sam_mode == 'off':
             self.sam = None
             self.mask_generator = None
-            print("[SAM] Deshabilitado")
+            logger.info("[SAM] Deshabilitado")
             return
         
         try:
@@ -104,6 +233,18 @@ class AnalysisService:
             model_type = self.config['SAM']['model']
             self.sam = sam_model_registry[model_type](checkpoint=sam_path).to(self.device)
             
+            if sam_mode == 'prompt':
+                # El predictor se crea por imagen en _segment_boxes
+                self.mask_generator = None
+                cache_config = self.config['SAM'].get('embedding_cache', {})
+                if cache_config.get('enabled', False):
+                    self.embedding_cache = EmbeddingCache(
+                        cache_config['dir'],
+                        cache_config.get('max_bytes', 512 * 1024 * 1024),
+                    )
+                logger.info("[SAM] %s cargado desde %s (modo prompt)", model_type, sam_path)
+                return
+            
             # Build mask generator - COMO EL ORIGINAL
             sam_config = self.config['SAM']
             H, W = 960, 960  # Dimensión típica
@@ -119,9 +260,9 @@ class AnalysisService:
                 min_mask_region_area=min_area,
             )
             
-            print(f"[SAM] {model_type} cargado desde {sam_path}")
+            logger.info("[SAM] %s cargado desde %s", model_type, sam_path)
         except Exception as e:
-            print(f"[SAM] Error cargando: {e}")
+            logger.exception("[SAM] Error cargando: %s", e)
             self.sam = None
             self.mask_generator = None
     
@@ -140,97 +281,531 @@ class AnalysisService:
             raise ValueError(f"No hay URL para SAM '{model_type}'")
         
         os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
-        print(f"[SAM] Descargando {model_type}...")
+        logger.info("[SAM] Descargando %s...", model_type)
         urllib.request.urlretrieve(url, checkpoint_path)
-        print(f"[SAM] Descargado en {checkpoint_path}")
+        logger.info("[SAM] Descargado en %s", checkpoint_path)
     
-    def analyze_image(self, image_path: str) -> dict:
-        """Analiza 1 imagen - PIPELINE OPTIMIZADO"""
+    def prepare_for_fork(self):
+        """
+        Deja los pesos en memoria compartida de solo lectura antes de fork
+        (modo preload) para que los procesos web compartan sus páginas
+        """
+        if self.device.type != 'cpu':
+            raise RuntimeError("El modo preload solo admite CPU (CUDA no sobrevive a fork)")
         
-        # Leer imagen
-        img = cv2.imread(image_path)
-        if img is None:
-            raise ValueError(f"No se pudo leer: {image_path}")
+        # YOLO fusiona Conv+BN en su primera predicción: hacerlo aquí evita que
+        # cada proceso cree su propia copia de los pesos fusionados
+        if isinstance(getattr(self.yolo, 'model', None), nn.Module):
+            self.yolo.fuse()
+            self.yolo.model.share_memory()
+        self.classifier.share_memory()
+        if self.sam is not None:
+            self.sam.share_memory()
         
-        img_h, img_w = img.shape[:2]
-        print(f"[ANALYZE] Imagen: {img_w}x{img_h}")
+        # Las sesiones de ONNX Runtime y sus hilos no sobreviven a fork:
+        # el backend exportado se vuelve a cargar en cada proceso (after_fork)
+        self._fork_backend = self.classifier_backend.name != 'eager'
+        if self._fork_backend:
+            self.classifier_backend = EagerBackend(self.classifier)
+    
+    def after_fork(self):
+        """Restaura en el proceso hijo lo que no se comparte tras fork"""
+        if getattr(self, '_fork_backend', False):
+            self.classifier_backend = self._load_classifier_backend(self.config['RESNET']['weights'])
+            self._fork_backend = False
+    
+    def warmup(self, runs=2):
+        """
+        Inferencias con imágenes sintéticas para inicializar kernels,
+        reservas de memoria y compilaciones perezosas antes del primer usuario
+        """
+
+        imgsz = int(self.config['YOLO']['imgsz'])
+        dummy = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+        crop = dummy[:self.clf_img_size, :self.clf_img_size]
+        max_batch = max(1, int(self.config['RESNET'].get('batch_size', 32)))
+        box = {'xyxy': (0, 0, self.clf_img_size, self.clf_img_size), 'conf': 1.0}
+
+        # Con perfil adaptativo, también los extremos de imgsz_range
+        profiles = [None]
+        if self.config['YOLO'].get('adaptive', {}).get('enabled', False):
+            conf = self.config['YOLO']['conf']
+            profiles += [{'imgsz': int(size), 'conf': conf} for size in self.config['YOLO']['imgsz_range']]
+
+        t0 = time.perf_counter()
+        for _ in range(max(0, int(runs))):
+            for profile in profiles:
+                self._detect_yolo_batch([dummy], profile)
+            # Lote completo y lote unitario: las dos formas más frecuentes
+            self._classify_crops([crop] * max_batch)
+            self._classify_crops([crop])
+            if self.sam is not None and self.sam_mode == 'prompt':
+                self._segment_boxes(dummy, [box])
+
+        logger.info(
+            "Calentamiento completado (%d pasadas, %.0f ms)",
+            runs, (time.perf_counter() - t0) * 1000.0,
+        )
+
+    def analyze_image(self, image_path: str, image_hash: str = None, render: dict = None, tiled: bool = False,
+                      progress=None) -> dict:
+        """Analiza 1 imagen desde disco (API para scripts)"""
         
-        # PASO 1: Detección YOLO
-        print("[ANALYZE] Detectando con YOLO...")
-        detections = self._detect_yolo(img)
+        with open(image_path, 'rb') as f:
+            image_bytes = f.read()
+        return self.analyze_bytes(
+            image_bytes, image_hash=image_hash, source=image_path, render=render, tiled=tiled, progress=progress
+        )
+    
+    def analyze_bytes(self, image_bytes, image_hash: str = None, source: str = 'buffer',
+                      render: dict = None, tiled: bool = False, progress=None) -> dict:
+        """
+        Analiza 1 imagen en memoria (bytes, bytearray o memoryview) - PIPELINE OPTIMIZADO
+        render: opciones de la imagen procesada (ver _render_options)
+        tiled: detección por teselas solapadas (fotos de dosel de alta resolución)
+        progress: callable(evento, datos) llamado al terminar cada etapa
+        (decoded, detected, segmented, classified, rendered)
+        """
         
-        if not detections:
-            return self._empty_result()
+        timer = StageTimer()
         
-        print(f"[ANALYZE] {len(detections)} hojas detectadas")
+        # Decodificar imagen (reducida si es un JPEG grande)
+        with timer.stage('decode'):
+            img, scale = self._decode_image(image_bytes, tiled)
+            if img is None:
+                raise ValueError(f"No se pudo leer: {source}")
+            
+            # Hash del contenido solo si hay caché de embeddings que lo use
+            if image_hash is None and self.embedding_cache:
+                image_hash = hashlib.sha256(image_bytes).hexdigest()
         
-        # PASO 2: Clasificación (con SAM opcional)
-        print("[ANALYZE] Clasificando hojas...")
-        results = self._classify_all(img, detections)
+        img_h, img_w = img.shape[:2]
+        logger.debug("[ANALYZE] Imagen: %dx%d (reducción 1/%d)", img_w, img_h, scale)
+        _notify(progress, 'decoded', width=img_w * scale, height=img_h * scale, scale=scale)
+        
+        with self._inference_slot(timer):
+            # PASO 1: Detección YOLO (perfil según resolución y carga actual)
+            profile = self._inference_profile(img.shape[:2], tiled)
+            with timer.stage('yolo'):
+                detections = self._detect_yolo(img, tiled, profile)
+            _notify(progress, 'detected', leaves=len(detections), profile=profile)
+            
+            if not detections:
+                result = self._empty_result()
+                result['profile'] = profile
+                return self._with_timings(result, timer)
+            
+            logger.debug("[ANALYZE] %d hojas detectadas", len(detections))
+            
+            # PASO 2: Clasificación (con SAM opcional)
+            results = self._classify_all(img, detections, image_hash, timer, progress)
         
         # PASO 3: Dibujar y procesar
-        processed_img = self._draw_results(img.copy(), results)
-        img_base64 = self._image_to_base64(processed_img)
+        result = self._build_result(img, results, scale, timer, render)
+        result['profile'] = profile
+        if result['processed_image'] is not None:
+            _notify(progress, 'rendered', type=result['processed_image_type'], bytes=len(result['processed_image']))
+        return self._with_timings(result, timer)
+    
+    def analyze_images(self, image_paths, image_hashes=None, render=None, tiled=False):
+        """Analiza varias imágenes desde disco (API para scripts)"""
+        
+        images = []
+        for path in image_paths:
+            with open(path, 'rb') as f:
+                images.append(f.read())
+        return self.analyze_images_bytes(
+            images, image_hashes=image_hashes, sources=image_paths, render=render, tiled=tiled
+        )
+    
+    def analyze_images_bytes(self, images, image_hashes=None, sources=None, render=None, tiled=False):
+        """Analiza varias imágenes en memoria compartiendo lotes de YOLO y ResNet"""
+        
+        image_hashes = list(image_hashes) if image_hashes is not None else [None] * len(images)
+        sources = sources or [f"imagen {i + 1}" for i in range(len(images))]
+        
+        outputs = [None] * len(images)
+        group_size = max(1, int(self.config['YOLO'].get('batch_size', 8)))
+        
+        # Por grupos para acotar la memoria de imágenes decodificadas
+        for start in range(0, len(images), group_size):
+            # Los tiempos son del grupo completo: las etapas son compartidas
+            timer = StageTimer()
+            imgs = []
+            scales = []
+            indices = []
+            with timer.stage('decode'):
+                for i in range(start, min(start + group_size, len(images))):
+                    img, scale = self._decode_image(images[i], tiled)
+                    if img is None:
+                        outputs[i] = {'error': f"No se pudo leer: {sources[i]}"}
+                        continue
+                    if image_hashes[i] is None and self.embedding_cache:
+                        image_hashes[i] = hashlib.sha256(images[i]).hexdigest()
+                    imgs.append(img)
+                    scales.append(scale)
+                    indices.append(i)
+            
+            if not imgs:
+                continue
+            
+            with self._inference_slot(timer):
+                # PASO 1: YOLO sobre todo el grupo en una llamada (un perfil por grupo)
+                profile = self._inference_profile(max(imgs, key=lambda im: max(im.shape[:2])).shape[:2], tiled)
+                with timer.stage('yolo'):
+                    if tiled:
+                        all_detections = self._detect_yolo_tiled(imgs, profile)
+                    else:
+                        all_detections = self._detect_yolo_batch(imgs, profile)
+                
+                # PASO 2: recortes de todas las imágenes en los mismos lotes de ResNet
+                pooled_crops = []
+                spans = []
+                for img, i, detections in zip(imgs, indices, all_detections):
+                    crops, kept = self._prepare_crops(img, detections, image_hashes[i], timer) if detections else ([], [])
+                    spans.append((len(pooled_crops), kept))
+                    pooled_crops.extend(crops)
+                
+                predictions = self._classify_crops(pooled_crops, timer)
+            
+            # PASO 3: resultado por imagen
+            for img, scale, i, detections, (offset, kept) in zip(imgs, scales, indices, all_detections, spans):
+                if not detections:
+                    outputs[i] = self._empty_result()
+                    continue
+                results = self._results_from_predictions(
+                    kept, predictions[offset:offset + len(kept)], len(detections)
+                )
+                outputs[i] = self._build_result(img, results, scale, timer, render)
+            
+            timings = timer.as_dict()
+            latency_histograms.record(timings)
+            for i in indices:
+                outputs[i]['timings'] = timings
+                outputs[i]['profile'] = profile
+            
+            logger.info("[BATCH] %d/%d imágenes procesadas", min(start + group_size, len(images)), len(images))
+        
+        return outputs
+    
+    @contextmanager
+    def _inference_slot(self, timer):
+        """Espera un cupo de inferencia (el tiempo de espera se mide como 'wait')"""
+        with self._waiting_lock:
+            self._waiting += 1
+        try:
+            with timer.stage('wait'):
+                self._inference_slots.acquire()
+        finally:
+            with self._waiting_lock:
+                self._waiting -= 1
+        try:
+            yield
+        finally:
+            self._inference_slots.release()
+    
+    def _build_result(self, img, results, scale=1, timer=None, render=None):
+        """Dibuja, codifica y cuenta los resultados de una imagen"""
+        
+        timer = timer or StageTimer()
+        options = self._render_options(render)
+        
+        # Solo se dibuja y codifica si el cliente quiere la imagen
+        processed_image = None
+        processed_type = None
+        if options['variant'] != 'none':
+            with timer.stage('draw'):
+                canvas = self._render(img, results, options['max_dim'])
+            with timer.stage('encode'):
+                processed_image, processed_type = self._encode_image(canvas, options)
         
         # Contar
         healthy = sum(1 for r in results if r['class'] == 'healthy')
         affected = sum(1 for r in results if r['class'] == 'affected')
         confidence = np.mean([r['score'] for r in results]) * 100 if results else 0.0
         
-        print(f"[ANALYZE] ✓ Resultado: {healthy} sanas, {affected} afectadas")
+        logger.debug("[ANALYZE] Resultado: %d sanas, %d afectadas", healthy, affected)
         
         return {
             'total_leaves': len(results),
             'healthy_leaves': healthy,
             'affected_leaves': affected,
             'confidence': float(confidence),
-            'processed_image_base64': img_base64,
+            'leaves': self._leaves_summary(results, scale),
+            'processed_image': processed_image,
+            'processed_image_type': processed_type,
             'timestamp': datetime.utcnow().isoformat() + 'Z'
         }
     
-    def _detect_yolo(self, img):
-        """Detección YOLO - COMO EL ORIGINAL"""
+    def _with_timings(self, result, timer):
+        """Adjunta los tiempos por etapa y los acumula en los histogramas"""
+        result['timings'] = timer.as_dict()
+        latency_histograms.record(result['timings'])
+        return result
+    
+    def _leaves_summary(self, results, scale=1):
+        """Caja (en coordenadas de la imagen original), clase y puntajes de cada hoja"""
+        return [
+            {
+                'box': [round(float(v) * scale, 1) for v in res['xyxy']],
+                'class': res['class'],
+                'score': round(res['score'], 4),
+                'conf': round(res['conf'], 4),
+            }
+            for res in results
+        ]
+    
+    def _decode_image(self, image_bytes, tiled=False):
+        """
+        Decodifica la imagen directamente desde el buffer, sin archivo temporal
+        Devuelve (imagen, factor) donde factor es la reducción aplicada (1, 2, 4 u 8)
+        """
+        buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+        if buffer.size == 0:
+            return None, 1
         
-        conf = self.config['YOLO']['conf']
-        imgsz = self.config['YOLO']['imgsz']
-        iou = self.config['YOLO'].get('iou', 0.45)
+        scale = self._jpeg_decode_scale(image_bytes, tiled)
+        if scale > 1:
+            img = cv2.imdecode(buffer, REDUCED_JPEG_FLAGS[scale])
+            if img is not None:
+                return img, scale
+        
+        return cv2.imdecode(buffer, cv2.IMREAD_COLOR), 1
+    
+    def _jpeg_decode_scale(self, image_bytes, tiled=False):
+        """Mayor reducción DCT que mantiene la resolución mínima necesaria"""
         
-        # Inferencia - EXACTO AL ORIGINAL
-        results = self.yolo(
-            img,
-            conf=conf,
-            imgsz=imgsz,
-            iou=iou,
-            device=self.device,
-            verbose=False
+        decode_config = self.config.get('DECODE', {})
+        if not decode_config.get('reduced_jpeg', False):
+            return 1
+        
+        size = _jpeg_size(image_bytes)
+        if size is None:
+            return 1
+        
+        # Lado largo mínimo: entrada de YOLO, clasificador y resolución de recortes
+        min_long_side = max(
+            int(self.config['YOLO']['imgsz']),
+            self.clf_img_size,
+            int(decode_config.get('min_long_side', 1280)),
         )
+        # Por teselas: la resolución extra es justamente lo que se busca
+        if tiled:
+            tiling = self.config['YOLO'].get('tiling', {})
+            min_long_side = max(min_long_side, int(tiling.get('min_long_side', 2560)))
+        long_side = max(size)
+        for scale in sorted(REDUCED_JPEG_FLAGS, reverse=True):
+            if long_side // scale >= min_long_side:
+                return scale
+        return 1
+    
+    def _inference_profile(self, shape, tiled=False):
+        """
+        Perfil de inferencia de YOLO (imgsz, conf)
+        Fijo: los de MODELS['YOLO']. Adaptativo: imgsz dentro de imgsz_range
+        según la resolución (nunca mayor que la imagen) y conf dentro de
+        conf_range; con análisis en espera ambos se degradan hacia el perfil
+        más barato (imgsz mínimo, conf máximo) para sostener el rendimiento;
+        degraded indica que la carga lo alejó del perfil en reposo
+        """
+        yolo_config = self.config['YOLO']
+        imgsz = int(yolo_config['imgsz'])
+        conf = float(yolo_config['conf'])
+        adaptive = yolo_config.get('adaptive', {})
+        
+        waiting = self._waiting + (self.load_probe() if self.load_probe else 0)
+        load = waiting / self._concurrency
+        if not adaptive.get('enabled', False):
+            return {'mode': 'fixed', 'imgsz': imgsz, 'conf': conf, 'load': round(load, 2), 'degraded': False}
         
-        detections = []
-        if results and results[0].boxes is not None:
-            for box in results[0].boxes:
-                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                conf_score = float(box.conf[0])
-                detections.append({
-                    'xyxy': (x1, y1, x2, y2),
-                    'conf': conf_score,
-                })
+        min_size, max_size = (int(v) for v in yolo_config.get('imgsz_range', (imgsz, imgsz)))
+        conf_min, conf_max = (float(v) for v in yolo_config.get('conf_range', (conf, conf)))
+        stride = max(1, int(adaptive.get('stride', 32)))
+        levels = max(2, int(adaptive.get('levels', 4)))
+        max_load = float(adaptive.get('max_load', 4))
         
-        return detections
+        # Carga cuantizada en niveles: pocos tamaños de entrada distintos
+        pressure = min(1.0, load / max_load) if max_load > 0 else 0.0
+        pressure = round(pressure * (levels - 1)) / (levels - 1)
+        
+        # Con teselas YOLO ve cada tesela, no la imagen completa
+        long_side = max(shape)
+        if tiled:
+            long_side = min(long_side, int(yolo_config.get('tiling', {}).get('tile_size', 640)))
+        ceiling = max(min_size, min(max_size, long_side))
+        size = ceiling - (ceiling - min_size) * pressure
+        size = max(min_size, int(size) // stride * stride)
+        
+        # En reposo la confianza configurada; bajo carga sube hacia conf_max (menos recortes)
+        conf = min(max(conf, conf_min), conf_max)
+        conf = conf + (conf_max - conf) * pressure
+        
+        return {
+            'mode': 'adaptive',
+            'imgsz': size,
+            'conf': round(conf, 3),
+            'load': round(load, 2),
+            'degraded': pressure > 0,
+        }
+    
+    def _detect_yolo(self, img, tiled=False, profile=None):
+        """Detección YOLO - COMO EL ORIGINAL (o por teselas si tiled)"""
+        if tiled:
+            return self._detect_yolo_tiled([img], profile)[0]
+        return self._detect_yolo_batch([img], profile)[0]
+    
+    def _detect_yolo_tiled(self, imgs, profile=None):
+        """
+        Detección por teselas solapadas: las teselas de todas las imágenes
+        (y cada imagen completa, para hojas grandes) van en un solo lote de
+        YOLO; las cajas se llevan a coordenadas de la imagen y se fusionan con NMS
+        """
+        tiling = self.config['YOLO'].get('tiling', {})
+        include_full = tiling.get('include_full', True)
+        
+        tiles = []
+        origins = []
+        owners = []
+        for n, img in enumerate(imgs):
+            grid = self._tile_grid(*img.shape[:2])
+            for x0, y0, x1, y1 in grid:
+                tiles.append(img[y0:y1, x0:x1])
+                origins.append((x0, y0))
+                owners.append(n)
+            if include_full and len(grid) > 1:
+                tiles.append(img)
+                origins.append((0, 0))
+                owners.append(n)
+        
+        merged = [[] for _ in imgs]
+        for n, (ox, oy), detections in zip(owners, origins, self._detect_yolo_batch(tiles, profile)):
+            for det in detections:
+                x1, y1, x2, y2 = det['xyxy']
+                merged[n].append({'xyxy': (x1 + ox, y1 + oy, x2 + ox, y2 + oy), 'conf': det['conf']})
+        
+        logger.debug("[YOLO] %d teselas para %d imágenes", len(tiles), len(imgs))
+        return [self._merge_tile_detections(detections) for detections in merged]
+    
+    def _tile_grid(self, height, width):
+        """Rectángulos (x0, y0, x1, y1) de teselas solapadas que cubren la imagen"""
+        
+        tiling = self.config['YOLO'].get('tiling', {})
+        tile = int(tiling.get('tile_size', 640))
+        overlap = float(tiling.get('overlap', 0.2))
+        max_tiles = max(1, int(tiling.get('max_tiles', 16)))
+        
+        # Teselas más grandes si la rejilla supera el máximo por imagen
+        while True:
+            xs = _tile_starts(width, tile, overlap)
+            ys = _tile_starts(height, tile, overlap)
+            if len(xs) * len(ys) <= max_tiles:
+                break
+            tile = int(tile * 1.25) + 1
+        
+        return [(x, y, min(x + tile, width), min(y + tile, height)) for y in ys for x in xs]
     
-    def _classify_all(self, img, detections):
-        """Clasifica todas las detecciones"""
+    def _merge_tile_detections(self, detections):
+        """NMS entre teselas: una caja por hoja aunque aparezca en varias teselas"""
+        if len(detections) < 2:
+            return detections
+        
+        from torchvision.ops import nms
+        
+        iou = float(self.config['YOLO'].get('tiling', {}).get('nms_iou', 0.5))
+        boxes = torch.tensor([[float(v) for v in det['xyxy']] for det in detections], dtype=torch.float32)
+        scores = torch.tensor([det['conf'] for det in detections], dtype=torch.float32)
+        keep = nms(boxes, scores, iou)
+        return [detections[i] for i in keep.tolist()]
+    
+    def _detect_yolo_batch(self, imgs, profile=None):
+        """Detección YOLO de varias imágenes en una sola llamada (perfil opcional)"""
+        
+        conf = profile['conf'] if profile else self.config['YOLO']['conf']
+        imgsz = profile['imgsz'] if profile else self.config['YOLO']['imgsz']
+        iou = self.config['YOLO'].get('iou', 0.45)
+        max_det = self.config['YOLO'].get('max_det', 300)
+        
+        # Inferencia - EXACTO AL ORIGINAL (ultralytics acepta listas)
+        with self._yolo_lock:
+            results = self.yolo(
+                imgs,
+                conf=conf,
+                imgsz=imgsz,
+                iou=iou,
+                max_det=max_det,
+                device=self.device,
+                verbose=False
+            )
+        
+        all_detections = []
+        for result in results:
+            detections = []
+            if result.boxes is not None:
+                for box in result.boxes:
+                    x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
+                    conf_score = float(box.conf[0])
+                    detections.append({
+                        'xyxy': (x1, y1, x2, y2),
+                        'conf': conf_score,
+                    })
+            all_detections.append(detections)
+        
+        return all_detections
+    
+    def _classify_all(self, img, detections, image_hash=None, timer=None, progress=None):
+        """Clasifica todas las detecciones en lotes"""
+        
+        timer = timer or StageTimer()
+        crops, kept = self._prepare_crops(img, detections, image_hash, timer, progress)
+        
+        # Una sola pasada de ResNet por lote
+        predictions = self._classify_crops(crops, timer, progress)
+        
+        return self._results_from_predictions(kept, predictions, len(detections))
+    
+    def _prepare_crops(self, img, detections, image_hash=None, timer=None, progress=None):
+        """Recorta (y segmenta) todas las detecciones de una imagen"""
+        
+        timer = timer or StageTimer()
+        total = len(detections)
+        with timer.stage('sam' if self.sam is not None else 'preprocess'):
+            # SAM en modo prompt: una sola codificación para todas las cajas
+            masks = [None] * total
+            if self.sam is not None and self.sam_mode == 'prompt':
+                masks = self._segment_boxes(img, detections, image_hash)
+                _notify(progress, 'segmented', done=total, total=total)
+            
+            # SAM automático segmenta recorte por recorte: progreso por hoja
+            per_crop = self.sam is not None and self.mask_generator is not None
+            crops = []
+            kept = []
+            for i, (det, mask) in enumerate(zip(detections, masks)):
+                crop = self._extract_crop(img, det, mask)
+                if crop is not None:
+                    crops.append(crop)
+                    kept.append(det)
+                if per_crop:
+                    _notify(progress, 'segmented', done=i + 1, total=total)
+        
+        return crops, kept
+    
+    def _results_from_predictions(self, kept, predictions, total):
+        """Combina detecciones y predicciones del clasificador"""
         
         results = []
-        for i, det in enumerate(detections):
-            result = self._classify_one(img, det)
-            if result:
-                results.append(result)
-                print(f"  [{i+1}/{len(detections)}] {result['class'].upper()} ({result['score']:.3f})")
+        for i, (det, (pred_class, pred_score)) in enumerate(zip(kept, predictions)):
+            results.append({
+                'xyxy': det['xyxy'],
+                'class': pred_class,
+                'score': pred_score,
+                'conf': det['conf'],
+            })
+            logger.debug("[%d/%d] %s (%.3f)", i + 1, total, pred_class.upper(), pred_score)
         
         return results
     
-    def _classify_one(self, img, det):
-        """Clasifica UNA detección - CORE LOGIC"""
+    def _extract_crop(self, img, det, mask=None):
+        """Recorta UNA detección y aplica SAM si está habilitado"""
         
         x1, y1, x2, y2 = det['xyxy']
         
@@ -239,6 +814,10 @@ class AnalysisService:
         if crop.size == 0:
             return None
         
+        # SAM prompt: máscara ya calculada para esta caja
+        if mask is not None:
+            return self._apply_mask_to_crop(crop, mask)
+        
         # SAM: Segmentar si está habilitado
         if self.sam and self.mask_generator:
             try:
@@ -249,27 +828,113 @@ class AnalysisService:
                     mask_bool = best_mask['segmentation']
                     crop = self._apply_mask_to_crop(crop, mask_bool)
             except Exception as e:
-                print(f"    [SAM Error] {e}")
+                logger.warning("[SAM] Error segmentando: %s", e)
+        
+        return crop
+    
+    def _segment_boxes(self, img, detections, image_hash=None):
+        """Codifica la imagen con SAM una vez y segmenta cada caja YOLO"""
         
-        # Clasificar con ResNet - EXACTO AL ORIGINAL
-        crop_rgb = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
-        pil_img = Image.fromarray(crop_rgb)
+        masks = [None] * len(detections)
+        try:
+            from segment_anything import SamPredictor
+            
+            # Predictor por imagen: guarda el embedding, no se comparte entre hilos
+            predictor = SamPredictor(self.sam)
+            self._set_sam_image(predictor, img, image_hash)
+            
+            xyxy = np.array([det['xyxy'] for det in detections], dtype=np.float32)
+            boxes = torch.as_tensor(xyxy, device=predictor.device)
+            boxes = predictor.transform.apply_boxes_torch(boxes, img.shape[:2])
+            
+            prompt_batch = max(1, int(self.config['SAM'].get('prompt_batch_size', 64)))
+            for start in range(0, len(detections), prompt_batch):
+                batch_masks, _, _ = predictor.predict_torch(
+                    point_coords=None,
+                    point_labels=None,
+                    boxes=boxes[start:start + prompt_batch],
+                    multimask_output=False,
+                )
+                # Guardar solo la región de cada recorte, no la máscara completa
+                for j, mask in enumerate(batch_masks[:, 0]):
+                    x1, y1, x2, y2 = detections[start + j]['xyxy']
+                    masks[start + j] = mask[int(y1):int(y2), int(x1):int(x2)].cpu().numpy()
+        except Exception as e:
+            logger.warning("[SAM] Error segmentando: %s", e)
         
-        x = self.clf_transform(pil_img).unsqueeze(0).to(self.device)
-        with torch.inference_mode():
-            logits = self.classifier(x)
-            probs = torch.softmax(logits, dim=1)[0]
+        return masks
+    
+    def _set_sam_image(self, predictor, img, image_hash=None):
+        """Fija la imagen del predictor reutilizando el embedding en caché si existe"""
         
-        pred_idx = torch.argmax(probs)
-        pred_score = float(probs[pred_idx])
-        pred_class = self.class_names[pred_idx]
+        if self.embedding_cache is None or image_hash is None:
+            predictor.set_image(img, image_format='BGR')
+            return
         
-        return {
-            'xyxy': det['xyxy'],
-            'class': pred_class,
-            'score': pred_score,
-            'conf': det['conf'],
-        }
+        h, w = img.shape[:2]
+        key = f"{image_hash}_{self.config['SAM']['model']}_{h}x{w}"
+        embedding = self.embedding_cache.get(key)
+        
+        if embedding is None:
+            predictor.set_image(img, image_format='BGR')
+            self.embedding_cache.put(key, predictor.get_image_embedding().cpu().numpy())
+            return
+        
+        # Restaurar el estado que deja set_image sin ejecutar el codificador
+        predictor.reset_image()
+        predictor.original_size = (h, w)
+        predictor.input_size = predictor.transform.get_preprocess_shape(
+            h, w, predictor.transform.target_length
+        )
+        predictor.features = torch.from_numpy(np.array(embedding)).to(predictor.device)
+        predictor.is_image_set = True
+    
+    def _classify_crops(self, crops, timer=None, progress=None):
+        """Clasifica recortes con ResNet en lotes de tamaño máximo configurable"""
+        
+        timer = timer or StageTimer()
+        max_batch = max(1, int(self.config['RESNET'].get('batch_size', 32)))
+        predictions = []
+        counts = Counter()
+        
+        for start in range(0, len(crops), max_batch):
+            chunk = crops[start:start + max_batch]
+            with timer.stage('preprocess'):
+                x = self._preprocess_crops(chunk).to(self.device)
+            
+            with timer.stage('classify'):
+                probs = self.classifier_backend(x)
+                scores, indices = probs.max(dim=1)
+                for idx, score in zip(indices.tolist(), scores.tolist()):
+                    predictions.append((self.class_names[idx], float(score)))
+                    counts[self.class_names[idx]] += 1
+            
+            # Conteos parciales por clase tras cada lote
+            _notify(progress, 'classified', done=len(predictions), total=len(crops), counts=dict(counts))
+        
+        return predictions
+    
+    def _preprocess_crops(self, crops):
+        """Construye el lote del clasificador directamente desde los recortes BGR"""
+        
+        size = self.clf_img_size
+        batch = np.empty((len(crops), size, size, 3), dtype=np.float32)
+        resized = np.empty((size, size, 3), dtype=np.uint8)
+        
+        for i, crop in enumerate(crops):
+            # INTER_AREA al reducir se aproxima al Resize con antialias de PIL
+            h, w = crop.shape[:2]
+            interp = cv2.INTER_AREA if h > size or w > size else cv2.INTER_LINEAR
+            cv2.resize(crop, (size, size), dst=resized, interpolation=interp)
+            # BGR -> RGB con una vista invertida; la conversión a float32 se hace al copiar
+            batch[i] = resized[:, :, ::-1]
+        
+        # Normalización en el mismo buffer
+        batch *= self.clf_scale
+        batch -= self.clf_shift
+        
+        # NHWC -> NCHW sin copiar (queda en formato channels_last)
+        return torch.from_numpy(batch).permute(0, 3, 1, 2)
     
     def _apply_mask_to_crop(self, crop, mask_bool):
         """Aplica máscara SAM"""
@@ -294,12 +959,52 @@ class AnalysisService:
         
         return crop[y1:y2, x1:x2]
     
-    def _draw_results(self, img, results):
-        """Dibuja cajas y etiquetas"""
+    def _render_options(self, render=None):
+        """
+        Opciones de la imagen procesada: las de la solicitud sobre MODELS['RENDER']
+        variant: 'none' | 'thumbnail' | 'full'; format: 'jpeg' | 'webp';
+        max_dim: lado largo máximo (0 = sin reducir); quality: 1-100
+        """
+        defaults = self.config.get('RENDER', {})
+        render = render or {}
+        
+        variant = render.get('variant') or 'full'
+        image_format = render.get('format') or defaults.get('format', 'jpeg')
+        if variant == 'thumbnail':
+            max_dim = int(defaults.get('thumbnail_max_side', 320))
+        else:
+            max_dim = int(render.get('max_dim') or defaults.get('max_dim', 0))
+        quality = int(render.get('quality') or defaults.get(f'{image_format}_quality', 85))
+        
+        return {
+            'variant': variant,
+            'format': image_format,
+            'max_dim': max_dim,
+            'quality': max(1, min(100, quality)),
+        }
+    
+    def _render(self, img, results, max_dim=0):
+        """Copia (reducida si supera max_dim) con las detecciones dibujadas"""
+        
+        h, w = img.shape[:2]
+        ratio = 1.0
+        if max_dim and max(h, w) > max_dim:
+            # Reducir antes de dibujar: menos píxeles que copiar, dibujar y codificar
+            ratio = max_dim / max(h, w)
+            canvas = cv2.resize(
+                img, (max(1, round(w * ratio)), max(1, round(h * ratio))), interpolation=cv2.INTER_AREA
+            )
+        else:
+            canvas = img.copy()
+        
+        return self._draw_results(canvas, results, ratio)
+    
+    def _draw_results(self, img, results, ratio=1.0):
+        """Dibuja cajas y etiquetas (coordenadas multiplicadas por ratio)"""
         
         for res in results:
             x1, y1, x2, y2 = res['xyxy']
-            x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
+            x1, y1, x2, y2 = int(x1 * ratio), int(y1 * ratio), int(x2 * ratio), int(y2 * ratio)
             
             # Color y etiqueta
             if res['class'] == 'healthy':
@@ -328,11 +1033,13 @@ class AnalysisService:
         
         return img
     
-    def _image_to_base64(self, img):
-        """Convierte a base64"""
-        _, buffer = cv2.imencode('.jpg', img)
-        img_base64 = base64.b64encode(buffer.tobytes()).decode('utf-8')
-        return f"data:image/jpeg;base64,{img_base64}"
+    def _encode_image(self, img, options):
+        """Codifica a JPEG o WebP; devuelve (bytes, tipo MIME)"""
+        if options['format'] == 'webp':
+            _, buffer = cv2.imencode('.webp', img, [cv2.IMWRITE_WEBP_QUALITY, options['quality']])
+            return buffer.tobytes(), 'image/webp'
+        _, buffer = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, options['quality']])
+        return buffer.tobytes(), 'image/jpeg'
     
     def _empty_result(self):
         """Resultado vacío"""
@@ -341,10 +1048,12 @@ class AnalysisService:
             'healthy_leaves': 0,
             'affected_leaves': 0,
             'confidence': 0.0,
-            'processed_image_base64': '',
+            'leaves': [],
+            'processed_image': None,
+            'processed_image_type': None,
             'timestamp': datetime.utcnow().isoformat() + 'Z'
         }
 
 
-def create_analysis_service(config):
-    return AnalysisService(config)
\ No newline at end of file
+def create_analysis_service(config, concurrency=1):
+    return AnalysisService(config, concurrency=concurrency)
\ No newline at end of file
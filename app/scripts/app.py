@@ -8,8 +8,8 @@ Endpoint: POST /api/v1/classification/analyze
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from datetime import datetime
+import base64
 import os
-import tempfile
 from config.config import config
 from scripts.analyze_service import create_analysis_service
 
@@ -88,37 +88,30 @@ def analyze():
                 'message': f'Formato no soportado. Usa: {", ".join(allowed_ext)}'
             }), 400
         
-        # Guardar temporalmente
-        with tempfile.NamedTemporaryFile(suffix=file_ext, delete=False) as tmp:
-            image_file.save(tmp.name)
-            temp_path = tmp.name
+        # Analizar imagen directamente desde memoria
+        print(f"[ANALYZE] Procesando: {image_file.filename}")
+        results = analysis_service.analyze_bytes(image_file.read(), source=image_file.filename)
         
-        try:
-            # Analizar imagen
-            print(f"[ANALYZE] Procesando: {image_file.filename}")
-            results = analysis_service.analyze_image(temp_path)
-            
-            # Respuesta exitosa
-            response = {
-                'success': True,
-                'message': 'Clasificación completada exitosamente',
-                'data': {
-                    'totalLeavesDetected': results['total_leaves'],
-                    'healthyLeaves': results['healthy_leaves'],
-                    'affectedLeaves': results['affected_leaves'],
-                    'processedImage': results['processed_image_base64'],
-                    'confidence': results['confidence'],
-                    'timestamp': results['timestamp']
-                }
+        # Respuesta exitosa
+        response = {
+            'success': True,
+            'message': 'Clasificación completada exitosamente',
+            'data': {
+                'totalLeavesDetected': results['total_leaves'],
+                'healthyLeaves': results['healthy_leaves'],
+                'affectedLeaves': results['affected_leaves'],
+                'processedImage': (
+                    f"data:{results['processed_image_type']};base64,"
+                    + base64.b64encode(results['processed_image']).decode('ascii')
+                    if results['processed_image'] else ''
+                ),
+                'confidence': results['confidence'],
+                'timestamp': results['timestamp']
             }
-            
-            print(f"[ANALYZE] ✓ Éxito: {results['total_leaves']} hojas detectadas")
-            return jsonify(response), 200
+        }
         
-        finally:
-            # Limpiar archivo temporal
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+        print(f"[ANALYZE] ✓ Éxito: {results['total_leaves']} hojas detectadas")
+        return jsonify(response), 200
     
     except Exception as e:
         print(f"[ERROR] {str(e)}")
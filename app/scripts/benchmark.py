@@ -0,0 +1,347 @@
+# app/scripts/benchmark.py
+"""
+Benchmark reproducible del pipeline YOLO → SAM → ResNet
+Mide imágenes/s, hojas/s, percentiles p50/p95/p99 por etapa y memoria
+máxima (RSS) de AnalysisService, y guarda un JSON para comparar commits
+
+Sin --real-weights usa pesos sustitutos inicializados al azar (yolov8n,
+resnet18 y SAM vit_b si se activa) generados en --weights-dir: funciona sin
+red ni checkpoints de producción. El detector sustituto produce siempre
+--leaves-per-image detecciones para que la carga de ResNet sea estable.
+
+Uso:
+    python -m app.scripts.benchmark --synthetic 32
+    python -m app.scripts.benchmark --images-dir datos/muestras --imgsz 640 --batch-size 4
+    python -m app.scripts.benchmark --synthetic 32 --baseline resultados/anterior.json
+"""
+
+import argparse
+import copy
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import cv2
+import numpy as np
+import torch
+
+from .analyze_service import create_analysis_service
+from .quantization import list_images
+from .thread_budget import configure_threads
+from .timing import STAGES
+
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (50, 95, 99)
+STANDIN_CLASSES = ['healthy', 'affected']
+
+
+def create_standin_weights(weights_dir, clf_img_size=384, sam_model=None, seed=0):
+    """
+    Pesos aleatorios con el mismo formato que los de producción
+    Devuelve las rutas {'yolo', 'resnet', 'sam'}; se reutilizan si ya existen
+    """
+    from torchvision import models
+    from ultralytics import YOLO
+
+    os.makedirs(weights_dir, exist_ok=True)
+    torch.manual_seed(seed)
+    paths = {
+        'yolo': os.path.join(weights_dir, 'yolo_standin.pt'),
+        'resnet': os.path.join(weights_dir, 'resnet18_standin.pt'),
+        'sam': os.path.join(weights_dir, f'sam_{sam_model}_standin.pth') if sam_model else None,
+    }
+
+    if not os.path.exists(paths['yolo']):
+        detector = YOLO('yolov8n.yaml').model
+        # Sesgo de clase neutro: con pesos aleatorios casi todas las anclas
+        # superan el umbral y max_det fija el número de hojas por imagen
+        for conv in detector.model[-1].cv3:
+            torch.nn.init.zeros_(conv[-1].bias)
+        torch.save({'model': detector, 'train_args': {}}, paths['yolo'])
+        logger.info("[BENCH] YOLO sustituto guardado en %s", paths['yolo'])
+
+    if not os.path.exists(paths['resnet']):
+        classifier = models.resnet18(weights=None)
+        classifier.fc = torch.nn.Linear(classifier.fc.in_features, len(STANDIN_CLASSES))
+        torch.save({
+            'state_dict': classifier.state_dict(),
+            'classes': STANDIN_CLASSES,
+            'args': {'model': 'resnet18', 'img_size': clf_img_size},
+        }, paths['resnet'])
+        logger.info("[BENCH] ResNet sustituto guardado en %s", paths['resnet'])
+
+    if paths['sam'] and not os.path.exists(paths['sam']):
+        from segment_anything import sam_model_registry
+        torch.save(sam_model_registry[sam_model](checkpoint=None).state_dict(), paths['sam'])
+        logger.info("[BENCH] SAM sustituto guardado en %s", paths['sam'])
+
+    return paths
+
+
+def synthetic_images(count, width, height, quality=90, seed=0):
+    """JPEG sintéticos (fondo con ruido y elipses verdes), deterministas por semilla"""
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        img = rng.integers(40, 120, size=(height, width, 3), dtype=np.uint8)
+        for _ in range(int(rng.integers(10, 30))):
+            center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+            axes = (int(rng.integers(width // 40, width // 10)), int(rng.integers(height // 40, height // 10)))
+            color = (int(rng.integers(20, 80)), int(rng.integers(120, 220)), int(rng.integers(20, 80)))
+            cv2.ellipse(img, center, axes, float(rng.integers(0, 180)), 0, 360, color, -1)
+        ok, buffer = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if ok:
+            images.append(buffer.tobytes())
+    return images
+
+
+def _load_images(args):
+    if args.images_dir:
+        images = []
+        for path in list_images(args.images_dir, args.max_images):
+            with open(path, 'rb') as f:
+                images.append(f.read())
+        return images
+    width, height = (int(v) for v in args.synthetic_size.lower().split('x'))
+    return synthetic_images(args.synthetic, width, height, seed=args.seed)
+
+
+def _peak_rss_mb():
+    # ru_maxrss: KB en Linux, bytes en macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if platform.system() == 'Darwin' else 1024), 1)
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def stage_percentiles(timings):
+    """p50/p95/p99 (ms) por etapa a partir de los dicts 'timings' de cada llamada"""
+    names = [s for s in STAGES if any(s in t for t in timings)] + ['total']
+    report = {}
+    for name in names:
+        values = np.array([t.get(name, 0.0) for t in timings], dtype=np.float64)
+        if not values.size:
+            continue
+        report[name] = {f'p{q}': round(float(np.percentile(values, q)), 2) for q in PERCENTILES}
+        report[name]['mean'] = round(float(values.mean()), 2)
+    return report
+
+
+def run_benchmark(service, images, batch_size=1, concurrency=1, repeat=1, render=None, tiled=False):
+    """Analiza todas las imágenes 'repeat' veces; devuelve métricas agregadas"""
+    render = render or {'variant': 'none'}
+    batches = [images[i:i + batch_size] for i in range(0, len(images), batch_size)] * max(1, repeat)
+
+    def analyze(batch):
+        if batch_size == 1:
+            return [service.analyze_bytes(batch[0], render=render, tiled=tiled)]
+        return service.analyze_images_bytes(batch, render=render, tiled=tiled)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        outputs = list(pool.map(analyze, batches))
+    elapsed = time.perf_counter() - t0
+
+    timings = []
+    profiles = Counter()
+    analyzed = 0
+    leaves = 0
+    errors = 0
+    for results in outputs:
+        seen = set()
+        for result in results:
+            if 'error' in result:
+                errors += 1
+                continue
+            analyzed += 1
+            leaves += result['total_leaves']
+            if 'profile' in result:
+                profiles[f"imgsz={result['profile']['imgsz']} conf={result['profile']['conf']}"] += 1
+            # En lotes todas las imágenes de un grupo comparten el mismo dict
+            if id(result['timings']) not in seen:
+                seen.add(id(result['timings']))
+                timings.append(result['timings'])
+
+    return {
+        'images': analyzed,
+        'errors': errors,
+        'leaves': leaves,
+        'seconds': round(elapsed, 3),
+        'images_per_s': round(analyzed / elapsed, 3) if elapsed else None,
+        'leaves_per_s': round(leaves / elapsed, 3) if elapsed else None,
+        'leaves_per_image': round(leaves / analyzed, 2) if analyzed else 0,
+        'stages_ms': stage_percentiles(timings),
+        'profiles': dict(profiles),
+    }
+
+
+def compare(report, baseline):
+    """Relación con un informe anterior (>1 = más rápido / más lento según la métrica)"""
+    def ratio(new, old):
+        return round(new / old, 3) if new and old else None
+
+    current, previous = report['results'], baseline['results']
+    return {
+        'baseline_commit': baseline.get('commit'),
+        'images_per_s': ratio(current['images_per_s'], previous['images_per_s']),
+        'leaves_per_s': ratio(current['leaves_per_s'], previous['leaves_per_s']),
+        'peak_rss_mb': ratio(report['peak_rss_mb'], baseline.get('peak_rss_mb')),
+        'p50_ms': {
+            stage: ratio(values['p50'], previous['stages_ms'].get(stage, {}).get('p50'))
+            for stage, values in current['stages_ms'].items()
+        },
+    }
+
+
+def main(argv=None):
+    from app.config import config
+
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline de análisis")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--images-dir', help='Carpeta con imágenes de muestra')
+    source.add_argument('--synthetic', type=int, default=16, help='Imágenes sintéticas a generar')
+    parser.add_argument('--synthetic-size', default='1920x1440')
+    parser.add_argument('--max-images', type=int, default=None)
+    parser.add_argument('--imgsz', type=int, default=config.MODELS['YOLO']['imgsz'])
+    parser.add_argument('--sam-mode', choices=['off', 'classify', 'prompt'], default='off')
+    parser.add_argument('--batch-size', type=int, default=1, help='Imágenes por llamada (1 = analyze_bytes)')
+    parser.add_argument('--clf-batch-size', type=int, default=config.MODELS['RESNET']['batch_size'])
+    parser.add_argument('--backend', default='eager', help="Backend de ResNet ('eager', 'torchscript', 'onnx')")
+    parser.add_argument('--concurrency', type=int, default=1, help='Análisis simultáneos')
+    parser.add_argument('--intra-op', type=int, default=0, help='Hilos intra-op de torch (0 = automático)')
+    parser.add_argument('--inter-op', type=int, default=0)
+    parser.add_argument('--opencv-threads', type=int, default=0)
+    parser.add_argument('--tiled', action='store_true', help='Detección por teselas')
+    parser.add_argument('--adaptive', action='store_true', help='Perfil adaptativo de YOLO (imgsz/conf según carga)')
+    parser.add_argument('--render', choices=['none', 'thumbnail', 'full'], default='none')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--real-weights', action='store_true', help='Usar los checkpoints de config.MODELS')
+    parser.add_argument('--weights-dir', default=os.path.join(tempfile.gettempdir(), 'benchmark_weights'))
+    parser.add_argument('--leaves-per-image', type=int, default=20, help='Detecciones del YOLO sustituto')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='Ruta del JSON de resultados')
+    parser.add_argument('--baseline', default=None, help='JSON anterior con el que comparar')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    budget = configure_threads(
+        {
+            'concurrency': args.concurrency,
+            'intra_op': args.intra_op,
+            'inter_op': args.inter_op,
+            'opencv': args.opencv_threads,
+        },
+        workers=1,
+    )
+
+    models_config = copy.deepcopy(config.MODELS)
+    models_config['SAM']['mode'] = args.sam_mode
+    models_config['YOLO']['imgsz'] = args.imgsz
+    models_config['YOLO'].setdefault('adaptive', {})['enabled'] = args.adaptive
+    models_config['YOLO']['batch_size'] = args.batch_size
+    models_config['RESNET']['batch_size'] = args.clf_batch_size
+    models_config['RESNET']['backend'] = args.backend
+    # Sin caché de embeddings: cada pasada debe medir el codificador de SAM
+    models_config['SAM']['embedding_cache'] = {'enabled': False}
+
+    if not args.real_weights:
+        models_config['YOLO']['quantized'] = False
+        models_config['YOLO']['max_det'] = args.leaves_per_image
+        models_config['YOLO']['conf'] = 0.01
+        weights = create_standin_weights(
+            args.weights_dir,
+            sam_model=models_config['SAM']['model'] if args.sam_mode != 'off' else None,
+            seed=args.seed,
+        )
+        models_config['YOLO']['weights'] = weights['yolo']
+        models_config['RESNET']['weights'] = weights['resnet']
+        if weights['sam']:
+            models_config['SAM']['checkpoint'] = weights['sam']
+
+    images = _load_images(args)
+    if not images:
+        parser.error("No hay imágenes para el benchmark")
+
+    t0 = time.perf_counter()
+    service = create_analysis_service(models_config, concurrency=budget['concurrency'])
+    load_seconds = time.perf_counter() - t0
+    service.warmup(args.warmup)
+
+    results = run_benchmark(
+        service, images,
+        batch_size=max(1, args.batch_size),
+        concurrency=budget['concurrency'],
+        repeat=args.repeat,
+        render={'variant': args.render},
+        tiled=args.tiled,
+    )
+
+    report = {
+        'commit': _git_commit(),
+        'timestamp': datetime.utcnow().isoformat() + 'Z',
+        'weights': 'real' if args.real_weights else 'standin',
+        'params': {
+            'images': len(images),
+            'source': args.images_dir or f'synthetic {args.synthetic_size}',
+            'imgsz': args.imgsz,
+            'sam_mode': args.sam_mode,
+            'batch_size': args.batch_size,
+            'clf_batch_size': args.clf_batch_size,
+            'backend': service.classifier_backend.name,
+            'tiled': args.tiled,
+            'adaptive': args.adaptive,
+            'render': args.render,
+            'repeat': args.repeat,
+            'leaves_per_image': None if args.real_weights else args.leaves_per_image,
+            'threads': budget,
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'opencv': cv2.__version__,
+            'machine': platform.machine(),
+            'device': str(service.device),
+        },
+        'load_seconds': round(load_seconds, 2),
+        'results': results,
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['comparison'] = compare(report, json.load(f))
+
+    output = args.output or os.path.join(
+        config.UPLOADS_DIR, 'benchmarks',
+        f"{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}_{report['commit'] or 'local'}.json",
+    )
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info("[BENCH] Resultados guardados en %s", output)
+
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == '__main__':
+    main()
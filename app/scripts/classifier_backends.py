@@ -0,0 +1,172 @@
+# app/scripts/classifier_backends.py
+"""
+Backends de inferencia para el clasificador de hojas
+- eager: PyTorch normal (referencia)
+- torchscript: grafo congelado y optimizado, exportado una vez
+- onnx: ONNX Runtime, exportado una vez
+- int8: modelo cuantizado con calibración (ver app/scripts/quantization.py)
+Los artefactos exportados se guardan junto al checkpoint y se regeneran
+si el checkpoint es más reciente
+"""
+
+import logging
+import os
+
+import torch
+
+
+logger = logging.getLogger(__name__)
+
+
+class ParityError(Exception):
+    """El backend no reproduce las salidas del modelo eager"""
+
+
+class EagerBackend:
+    """Modelo PyTorch sin transformar"""
+
+    name = 'eager'
+
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, x):
+        with torch.inference_mode():
+            return torch.softmax(self.model(x), dim=1)
+
+
+class TorchScriptBackend:
+    """Modelo trazado, congelado y optimizado para inferencia"""
+
+    name = 'torchscript'
+    suffix = '.torchscript.pt'
+
+    def __init__(self, path, device):
+        module = torch.jit.load(path, map_location=device)
+        self.module = torch.jit.optimize_for_inference(module)
+
+    @staticmethod
+    def export(model, path, img_size, device):
+        example = torch.zeros(1, 3, img_size, img_size, device=device)
+        with torch.inference_mode():
+            traced = torch.jit.trace(model, example)
+        frozen = torch.jit.freeze(traced.eval())
+        torch.jit.save(frozen, path)
+
+    def __call__(self, x):
+        with torch.inference_mode():
+            return torch.softmax(self.module(x), dim=1)
+
+
+class OnnxBackend:
+    """Modelo exportado a ONNX y ejecutado con ONNX Runtime"""
+
+    name = 'onnx'
+    suffix = '.onnx'
+
+    def __init__(self, path, device):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = torch.get_num_threads()
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    @staticmethod
+    def export(model, path, img_size, device):
+        example = torch.zeros(1, 3, img_size, img_size, device=device)
+        torch.onnx.export(
+            model,
+            example,
+            path,
+            input_names=['input'],
+            output_names=['logits'],
+            dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}},
+            opset_version=18,
+            # Pesos dentro del .onnx: con datos externos el grafo apuntaría al
+            # nombre temporal y os.replace solo movería el grafo
+            external_data=False,
+        )
+
+    def __call__(self, x):
+        # ONNX Runtime necesita NCHW contiguo en CPU
+        batch = x.detach().cpu().contiguous().numpy()
+        logits = self.session.run(None, {self.input_name: batch})[0]
+        return torch.softmax(torch.from_numpy(logits), dim=1)
+
+
+class Int8Backend:
+    """Modelo cuantizado INT8 (FX estático) guardado como TorchScript"""
+
+    name = 'int8'
+    suffix = '.int8.pt'
+
+    def __init__(self, path, device):
+        # Los kernels cuantizados solo existen en CPU
+        self.module = torch.jit.load(path, map_location='cpu')
+
+    def __call__(self, x):
+        with torch.inference_mode():
+            return torch.softmax(self.module(x.cpu()), dim=1)
+
+
+EXPORTED_BACKENDS = {
+    'torchscript': TorchScriptBackend,
+    'onnx': OnnxBackend,
+}
+
+
+def exported_path(weights_path, backend_cls):
+    """Ruta del artefacto exportado junto al checkpoint"""
+    return os.path.splitext(weights_path)[0] + backend_cls.suffix
+
+
+def load_quantized_backend(weights_path, device):
+    """Carga el clasificador INT8 generado por quantization.py si está al día"""
+    path = exported_path(weights_path, Int8Backend)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No existe {path}; ejecuta python -m app.scripts.quantization")
+    if os.path.getmtime(path) < os.path.getmtime(weights_path):
+        raise ValueError(f"{path} es anterior al checkpoint; vuelve a cuantizar")
+    return Int8Backend(path, device)
+
+
+def load_exported_backend(name, model, weights_path, img_size, device):
+    """Carga (exportando si hace falta) un backend torchscript u onnx"""
+    backend_cls = EXPORTED_BACKENDS[name]
+    path = exported_path(weights_path, backend_cls)
+
+    stale = not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(weights_path)
+    if not stale:
+        try:
+            return backend_cls(path, device)
+        except Exception as e:
+            # Artefacto dañado (p. ej. un ONNX con datos externos ya borrados)
+            logger.warning("[CLASSIFIER] %s no se pudo cargar, exportando de nuevo: %s", path, e)
+
+    logger.info("[CLASSIFIER] Exportando backend %s en %s", name, path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    backend_cls.export(model, tmp_path, img_size, device)
+    os.replace(tmp_path, path)
+
+    return backend_cls(path, device)
+
+
+def check_parity(reference, backend, img_size, device, atol=1e-3, batch_size=4):
+    """
+    Compara probabilidades del backend con las del modelo eager
+    Con atol=None solo se verifica la forma y se devuelve la diferencia
+    """
+    generator = torch.Generator().manual_seed(0)
+    x = torch.randn(batch_size, 3, img_size, img_size, generator=generator).to(device)
+    expected = reference(x)
+    actual = backend(x).to(expected.device)
+
+    if actual.shape != expected.shape:
+        raise ParityError(f"Forma {tuple(actual.shape)} != {tuple(expected.shape)} ({backend.name})")
+
+    max_diff = float((expected - actual).abs().max())
+    if atol is not None and max_diff > atol:
+        raise ParityError(f"Diferencia máxima {max_diff:.2e} > {atol:.0e} ({backend.name})")
+    return max_diff
@@ -0,0 +1,131 @@
+# app/scripts/embedding_cache.py
+"""
+Caché LRU en disco de embeddings de imagen SAM
+Cada embedding se guarda como .npy y se lee mapeado en memoria,
+limitado por tamaño total en bytes
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """Caché LRU de embeddings SAM acotada por bytes en disco"""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> tamaño en bytes
+        self._total_bytes = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        """Reconstruye el índice desde disco (más antiguo primero)"""
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npy'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, name[:-4], st.st_size))
+
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.npy")
+
+    def get(self, key):
+        """Devuelve el embedding mapeado en memoria o None"""
+        path = self._path(key)
+        with self._lock:
+            if key not in self._entries:
+                # Puede haberlo escrito otro proceso que comparte el directorio
+                if not os.path.exists(path):
+                    self.misses += 1
+                    return None
+                size = os.path.getsize(path)
+                self._entries[key] = size
+                self._total_bytes += size
+            self._entries.move_to_end(key)
+
+        try:
+            embedding = np.load(path, mmap_mode='r')
+            os.utime(path)  # Mantener el orden LRU entre reinicios
+        except (OSError, ValueError):
+            with self._lock:
+                self._drop(key)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return embedding
+
+    def put(self, key, embedding):
+        """Guarda un embedding de forma atómica y aplica el límite de bytes"""
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.save(f, np.ascontiguousarray(embedding))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("[SAM CACHE] No se pudo guardar %s: %s", key, e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        size = os.path.getsize(path)
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries[key]
+            self._entries[key] = size
+            self._entries.move_to_end(key)
+            self._total_bytes += size
+            self._evict()
+
+    def _evict(self):
+        """Elimina los embeddings menos usados hasta respetar max_bytes"""
+        while self._entries and self._total_bytes > self.max_bytes:
+            key = next(iter(self._entries))
+            self._drop(key)
+            self.evictions += 1
+
+    def _drop(self, key):
+        size = self._entries.pop(key, 0)
+        self._total_bytes -= size
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def stats(self):
+        """Contadores para el endpoint de estado"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+            }
@@ -0,0 +1,277 @@
+# app/scripts/job_queue.py
+"""
+Cola de trabajos de análisis asíncronos
+Pool local de procesos: cada trabajador carga AnalysisService una vez
+y consume trabajos de una cola compartida
+Los trabajos se guardan en un JobStore (archivos): cualquier proceso web
+encola y consulta, y un único proceso, el que toma el lock del directorio,
+es dueño del pool y los ejecuta
+"""
+
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin lock entre procesos (servidor de desarrollo, un proceso)
+    fcntl = None
+
+from app.utils.result_cache import model_fingerprint
+
+from .analyze_service import create_analysis_service
+from .thread_budget import configure_threads
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """La cola de trabajos alcanzó su capacidad máxima"""
+
+
+def _worker_main(worker_index, models_config, task_queue, result_queue):
+    """Bucle de un proceso trabajador"""
+    from app.config import config
+    from app.utils.log import setup_logging
+    setup_logging(config.LOG_LEVEL, config.LOG_DEBUG_SAMPLE_RATE)
+    
+    # Núcleos repartidos entre los trabajadores de la cola
+    configure_threads(config.ANALYSIS_THREADS, workers=config.ANALYSIS_JOBS['workers'])
+    
+    failed_version = None
+    try:
+        version = model_fingerprint(models_config)
+        service = create_analysis_service(models_config)
+        service.warmup(config.ANALYSIS_WARMUP_RUNS)
+        load_error = None
+    except Exception as e:
+        logger.exception("[JOBS] Trabajador %d no pudo cargar el servicio", worker_index)
+        service = None
+        version = None
+        load_error = f"No se pudo cargar el servicio: {e}"
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+
+        job_id, image_bytes, image_hash, render, tiled = task
+        result_queue.put((job_id, 'running', worker_index))
+
+        # Pesos nuevos en disco: recargar entre trabajos (no hay análisis en curso)
+        if config.MODEL_RELOAD['enabled'] and service is not None:
+            service, version, failed_version = _reload_if_changed(
+                worker_index, models_config, service, version, failed_version
+            )
+
+        if service is None:
+            result_queue.put((job_id, 'error', load_error))
+            continue
+
+        try:
+            results = service.analyze_bytes(
+                image_bytes, image_hash=image_hash, source=job_id, render=render, tiled=tiled
+            )
+            # Con la versión de modelos que produjo el resultado (puede ser más
+            # nueva o más vieja que la del proceso web)
+            result_queue.put((job_id, 'done', (results, version)))
+        except Exception as e:
+            logger.exception("[JOBS] Error en el trabajo %s", job_id)
+            result_queue.put((job_id, 'error', str(e)))
+
+
+def _reload_if_changed(worker_index, models_config, service, version, failed=None):
+    """
+    (servicio, versión, versión fallida) vigentes tras comprobar los pesos en disco
+    Si la carga falla se sigue con la versión actual y no se reintenta la misma
+    """
+    from app.config import config
+
+    current = model_fingerprint(models_config)
+    if current in (version, failed):
+        return service, version, failed
+    try:
+        new_service = create_analysis_service(models_config)
+        new_service.warmup(config.ANALYSIS_WARMUP_RUNS)
+    except Exception as e:
+        logger.warning("[JOBS] Trabajador %d: versión %s descartada: %s", worker_index, current, e)
+        return service, version, current
+    logger.info("[JOBS] Trabajador %d: modelos %s -> %s", worker_index, version, current)
+    return new_service, current, None
+
+
+class AnalysisJobQueue:
+    """Cola acotada de trabajos atendida por un pool de procesos"""
+
+    def __init__(self, models_config, store, workers=2, max_queue=32, result_ttl=600,
+                 on_done=None, claim_interval=5.0):
+        """
+        store: JobStore compartido entre procesos web
+        on_done(job, results): se llama una vez por trabajo terminado, en el
+        proceso dueño del pool
+        """
+        self.models_config = models_config
+        self.store = store
+        self.num_workers = max(1, int(workers))
+        self.max_queue = max(1, int(max_queue))
+        self.result_ttl = result_ttl
+        self.on_done = on_done
+
+        # 'spawn': los hilos internos de torch no sobreviven bien a fork
+        self._ctx = multiprocessing.get_context('spawn')
+        self._tasks = None
+        self._results = None
+        self._workers = []
+        self._dispatched = set()
+        self._running_by_worker = {}
+        self._lock_file = None
+        self._owner = False
+        self._closed = threading.Event()
+
+        self._thread = threading.Thread(
+            target=self._run, args=(claim_interval,), name='analysis-jobs', daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def owner(self):
+        """Este proceso ejecuta el pool"""
+        return self._owner
+
+    def _try_lock(self):
+        """Toma el lock del directorio sin esperar; solo un proceso lo obtiene"""
+        if fcntl is None:
+            return True
+        os.makedirs(self.store.directory, exist_ok=True)
+        lock_file = open(os.path.join(self.store.directory, 'pool.lock'), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _run(self, claim_interval):
+        # Reintentar el lock: si el dueño termina, otro proceso toma el pool
+        while not self._try_lock():
+            if self._closed.wait(claim_interval):
+                return
+
+        self._tasks = self._ctx.Queue()
+        self._results = self._ctx.Queue()
+        self._workers = [self._start_worker(i) for i in range(self.num_workers)]
+        self._owner = True
+        logger.info(
+            "[JOBS] Proceso %d dueño del pool: %d trabajadores, cola máxima %d",
+            os.getpid(), self.num_workers, self.max_queue,
+        )
+        self._serve()
+
+    def _start_worker(self, index):
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(index, self.models_config, self._tasks, self._results),
+            name=f'analysis-worker-{index}',
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    def submit(self, image_bytes, image_hash=None, meta=None, render=None, tiled=False):
+        """Encola una imagen y devuelve el id del trabajo"""
+        if len(self.store.pending()) >= self.max_queue:
+            raise QueueFullError(f"Cola llena ({self.max_queue} trabajos)")
+        return self.store.create((image_bytes, image_hash, render, tiled), meta=meta)['id']
+
+    def get(self, job_id):
+        """Estado de un trabajo o None si no existe/expiró"""
+        return self.store.get(job_id)
+
+    def stats(self):
+        counts = {'queued': 0, 'running': 0, 'done': 0, 'error': 0}
+        for job in self.store.jobs():
+            counts[job['status']] += 1
+        return {
+            'owner': self._owner,
+            'workers': self.num_workers,
+            'workers_alive': sum(1 for p in self._workers if p.is_alive()),
+            'max_queue': self.max_queue,
+            'pending': len(self.store.pending()),
+            'jobs': counts,
+        }
+
+    def shutdown(self):
+        """Detiene los trabajadores y libera el pool"""
+        self._closed.set()
+        for _ in self._workers:
+            self._tasks.put(None)
+        for process in self._workers:
+            process.join(timeout=5)
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _serve(self):
+        """Despacha tareas del almacén, recibe estados, reinicia caídos y expira resultados"""
+        last_expire = 0.0
+        while not self._closed.is_set():
+            self._dispatch()
+            try:
+                job_id, status, payload = self._results.get(timeout=0.5)
+            except queue.Empty:
+                self._check_workers()
+                if time.time() - last_expire > 30:
+                    self.store.expire(self.result_ttl)
+                    last_expire = time.time()
+                continue
+            self._handle(job_id, status, payload)
+
+    def _dispatch(self):
+        # Incluye los que quedaron pendientes de un dueño anterior
+        for job_id in self.store.pending():
+            if job_id in self._dispatched:
+                continue
+            task = self.store.load_task(job_id)
+            if task is None:
+                continue
+            self._dispatched.add(job_id)
+            self._tasks.put((job_id, *task))
+
+    def _handle(self, job_id, status, payload):
+        if status == 'running':
+            self.store.update(job_id, status='running', started_at=time.time())
+            self._running_by_worker[payload] = job_id
+            return
+
+        for index, running_id in list(self._running_by_worker.items()):
+            if running_id == job_id:
+                del self._running_by_worker[index]
+        self._dispatched.discard(job_id)
+
+        if status != 'done':
+            self.store.finish(job_id, status='error', error=payload)
+            return
+
+        results, version = payload
+        job = self.store.finish(job_id, results, status='done', version=version)
+        if job is not None and self.on_done is not None:
+            try:
+                self.on_done(job, results)
+            except Exception as e:
+                logger.exception("[JOBS] Error procesando el resultado de %s: %s", job_id, e)
+
+    def _check_workers(self):
+        for index, process in enumerate(self._workers):
+            if process.is_alive() or self._closed.is_set():
+                continue
+            logger.warning("[JOBS] Trabajador %d terminó (código %s), reiniciando", index, process.exitcode)
+            job_id = self._running_by_worker.pop(index, None)
+            if job_id is not None:
+                self._dispatched.discard(job_id)
+                self.store.finish(job_id, status='error', error='El proceso trabajador terminó inesperadamente')
+            self._workers[index] = self._start_worker(index)
@@ -0,0 +1,337 @@
+# app/scripts/quantization.py
+"""
+Cuantización INT8 de los modelos para CPU
+- ResNet: cuantización estática FX calibrada con recortes reales de hojas
+- YOLO: exportación a ONNX + cuantización estática de ONNX Runtime
+Los modelos INT8 se guardan junto a los pesos originales y se activan con
+MODELS['RESNET']['backend'] = 'int8' y MODELS['YOLO']['quantized'] = True
+
+Uso:
+    python -m app.scripts.quantization --holdout-dir datos/holdout
+    (calibración por defecto con las imágenes de UPLOADS_DIR)
+
+El informe compara el modelo float con el INT8 sobre una carpeta separada:
+si contiene subcarpetas con el nombre de cada clase (healthy/affected) con
+recortes etiquetados se calcula la precisión; si no, la concordancia.
+"""
+
+import argparse
+import copy
+import importlib
+import json
+import logging
+import os
+
+import cv2
+import numpy as np
+import torch
+
+from .analyze_service import create_analysis_service
+from .classifier_backends import EagerBackend, Int8Backend, exported_path
+
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+# Exportación y cuantización de YOLO (ver requirements.txt)
+YOLO_DEPENDENCIES = ('onnx', 'onnxruntime', 'onnxruntime.quantization')
+
+
+def missing_yolo_dependencies():
+    """Módulos necesarios para cuantizar YOLO que no se pueden importar"""
+    missing = []
+    for module in YOLO_DEPENDENCIES:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            missing.append(module)
+    return missing
+
+
+def list_images(directory, limit=None):
+    """Imágenes de una carpeta (recursivo, orden estable)"""
+    paths = []
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(root, name))
+    paths.sort()
+    return paths[:limit] if limit else paths
+
+
+def collect_crops(service, image_paths, max_crops):
+    """Recortes de hojas detectadas por YOLO, como los ve el clasificador"""
+    crops = []
+    for path in image_paths:
+        with open(path, 'rb') as f:
+            img, _ = service._decode_image(f.read())
+        if img is None:
+            continue
+        detections = service._detect_yolo(img)
+        image_crops, _ = service._prepare_crops(img, detections)
+        crops.extend(image_crops)
+        if len(crops) >= max_crops:
+            break
+    return crops[:max_crops]
+
+
+def _quantized_engine():
+    engines = torch.backends.quantized.supported_engines
+    return 'x86' if 'x86' in engines else ('fbgemm' if 'fbgemm' in engines else 'qnnpack')
+
+
+def quantize_classifier(service, calibration_crops, output_path, batch_size=16):
+    """Cuantización estática FX del clasificador; guarda TorchScript congelado"""
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    if not calibration_crops:
+        raise ValueError("No hay recortes de calibración")
+
+    engine = _quantized_engine()
+    torch.backends.quantized.engine = engine
+
+    size = service.clf_img_size
+    example = (torch.zeros(1, 3, size, size),)
+    model = copy.deepcopy(service.classifier).cpu().eval()
+    prepared = prepare_fx(model, get_default_qconfig_mapping(engine), example)
+
+    # Calibración: los observadores registran rangos de activación reales
+    with torch.no_grad():
+        for start in range(0, len(calibration_crops), batch_size):
+            prepared(service._preprocess_crops(calibration_crops[start:start + batch_size]))
+
+    quantized = convert_fx(prepared)
+    with torch.no_grad():
+        traced = torch.jit.trace(quantized, example)
+    frozen = torch.jit.freeze(traced.eval())
+
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    torch.jit.save(frozen, tmp_path)
+    os.replace(tmp_path, output_path)
+    logger.info("[QUANT] Clasificador INT8 (%s) guardado en %s", engine, output_path)
+    return output_path
+
+
+def _letterbox(img, imgsz):
+    """Preprocesado de entrada de YOLO (relleno gris 114, RGB, NCHW, [0, 1])"""
+    h, w = img.shape[:2]
+    ratio = imgsz / max(h, w)
+    new_h, new_w = round(h * ratio), round(w * ratio)
+    resized = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+
+    canvas = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    top = (imgsz - new_h) // 2
+    left = (imgsz - new_w) // 2
+    canvas[top:top + new_h, left:left + new_w] = resized
+
+    x = canvas[:, :, ::-1].transpose(2, 0, 1)[None].astype(np.float32) / 255.0
+    return np.ascontiguousarray(x)
+
+
+def quantize_yolo(weights_path, image_paths, imgsz, output_path):
+    """Exporta YOLO a ONNX y lo cuantiza (QDQ) calibrando con imágenes reales"""
+    import onnx
+    import onnxruntime as ort
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    from ultralytics import YOLO
+
+    onnx_path = YOLO(weights_path).export(format='onnx', imgsz=imgsz, dynamic=True, simplify=False)
+    input_name = ort.InferenceSession(onnx_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+
+    class _Reader(CalibrationDataReader):
+        def __init__(self):
+            self._paths = iter(image_paths)
+
+        def get_next(self):
+            for path in self._paths:
+                img = cv2.imread(path)
+                if img is not None:
+                    return {input_name: _letterbox(img, imgsz)}
+            return None
+
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    quantize_static(
+        onnx_path,
+        tmp_path,
+        _Reader(),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+    )
+
+    # Ultralytics lee clases, stride e imgsz de los metadatos del ONNX
+    source = onnx.load(onnx_path)
+    quantized = onnx.load(tmp_path)
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(source.metadata_props)
+    onnx.save(quantized, tmp_path)
+    os.replace(tmp_path, output_path)
+
+    logger.info("[QUANT] YOLO INT8 guardado en %s", output_path)
+    return output_path
+
+
+def _labeled_crops(holdout_dir, class_names):
+    """(ruta, índice de clase) de subcarpetas con el nombre de cada clase"""
+    samples = []
+    for idx, name in enumerate(class_names):
+        class_dir = os.path.join(holdout_dir, name)
+        if os.path.isdir(class_dir):
+            samples.extend((path, idx) for path in list_images(class_dir))
+    return samples
+
+
+def _predict(backend, service, crops, batch_size=32):
+    probs = []
+    for start in range(0, len(crops), batch_size):
+        probs.append(backend(service._preprocess_crops(crops[start:start + batch_size])).cpu())
+    return torch.cat(probs) if probs else torch.empty(0, len(service.class_names))
+
+
+def evaluate_classifier(service, int8_backend, holdout_dir, max_crops=1000):
+    """Precisión/concordancia float vs INT8 en la carpeta de validación"""
+    float_backend = EagerBackend(service.classifier)
+
+    samples = _labeled_crops(holdout_dir, service.class_names)
+    if samples:
+        crops, labels = [], []
+        for path, label in samples[:max_crops]:
+            img = cv2.imread(path)
+            if img is not None:
+                crops.append(img)
+                labels.append(label)
+        labels = torch.tensor(labels)
+    else:
+        crops = collect_crops(service, list_images(holdout_dir), max_crops)
+        labels = None
+
+    float_probs = _predict(float_backend, service, crops)
+    int8_probs = _predict(int8_backend, service, crops)
+    float_pred = float_probs.argmax(dim=1)
+    int8_pred = int8_probs.argmax(dim=1)
+
+    report = {
+        'samples': len(crops),
+        'labeled': labels is not None,
+        'agreement': float((float_pred == int8_pred).float().mean()) if crops else None,
+        'mean_abs_prob_delta': float((float_probs - int8_probs).abs().mean()) if crops else None,
+    }
+    if labels is not None and crops:
+        float_acc = float((float_pred == labels).float().mean())
+        int8_acc = float((int8_pred == labels).float().mean())
+        report.update({
+            'float_accuracy': float_acc,
+            'int8_accuracy': int8_acc,
+            'accuracy_delta': int8_acc - float_acc,
+        })
+    return report
+
+
+def evaluate_yolo(service, int8_path, holdout_dir, max_images=200):
+    """Diferencia en número de hojas detectadas float vs INT8"""
+    from ultralytics import YOLO
+
+    yolo_config = service.config['YOLO']
+    int8_model = YOLO(int8_path, task='detect')
+    float_counts, int8_counts = [], []
+    for path in list_images(holdout_dir, max_images):
+        img = cv2.imread(path)
+        if img is None:
+            continue
+        float_counts.append(len(service._detect_yolo(img)))
+        result = int8_model(
+            img,
+            conf=yolo_config['conf'],
+            imgsz=yolo_config['imgsz'],
+            iou=yolo_config.get('iou', 0.45),
+            verbose=False,
+        )[0]
+        int8_counts.append(0 if result.boxes is None else len(result.boxes))
+
+    if not float_counts:
+        return {'images': 0}
+    diffs = np.abs(np.array(float_counts) - np.array(int8_counts))
+    return {
+        'images': len(float_counts),
+        'float_detections': int(sum(float_counts)),
+        'int8_detections': int(sum(int8_counts)),
+        'mean_abs_count_delta': float(diffs.mean()),
+        'max_abs_count_delta': int(diffs.max()),
+    }
+
+
+def _size_mb(path):
+    return round(os.path.getsize(path) / (1024 * 1024), 2) if os.path.exists(path) else None
+
+
+def main(argv=None):
+    from app.config import config
+
+    parser = argparse.ArgumentParser(description="Genera y evalúa modelos INT8 para CPU")
+    parser.add_argument('--calibration-dir', default=config.UPLOADS_DIR)
+    parser.add_argument('--holdout-dir', required=True)
+    parser.add_argument('--max-calibration-images', type=int, default=64)
+    parser.add_argument('--max-calibration-crops', type=int, default=512)
+    parser.add_argument('--skip-yolo', action='store_true')
+    parser.add_argument('--report', default=None, help='Ruta del informe JSON')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    # Antes de calibrar el clasificador: la cuantización de YOLO va al final
+    if not args.skip_yolo:
+        missing = missing_yolo_dependencies()
+        if missing:
+            parser.error(
+                f"Cuantizar YOLO requiere {', '.join(missing)} "
+                "(pip install -r requirements.txt) o usa --skip-yolo"
+            )
+
+    # Servicio float de referencia (sin backends exportados ni YOLO cuantizado)
+    models_config = copy.deepcopy(config.MODELS)
+    models_config['RESNET']['backend'] = 'eager'
+    models_config['YOLO']['quantized'] = False
+    service = create_analysis_service(models_config)
+
+    calibration_images = list_images(args.calibration_dir, args.max_calibration_images)
+    if not calibration_images:
+        parser.error(f"No hay imágenes de calibración en {args.calibration_dir}")
+
+    clf_weights = models_config['RESNET']['weights']
+    clf_int8_path = exported_path(clf_weights, Int8Backend)
+    crops = collect_crops(service, calibration_images, args.max_calibration_crops)
+    quantize_classifier(service, crops, clf_int8_path)
+
+    report = {
+        'calibration': {'images': len(calibration_images), 'crops': len(crops)},
+        'classifier': {
+            'float_mb': _size_mb(clf_weights),
+            'int8_mb': _size_mb(clf_int8_path),
+            **evaluate_classifier(service, Int8Backend(clf_int8_path, 'cpu'), args.holdout_dir),
+        },
+    }
+
+    if not args.skip_yolo:
+        yolo_weights = models_config['YOLO']['weights']
+        yolo_int8_path = os.path.splitext(yolo_weights)[0] + '.int8.onnx'
+        quantize_yolo(yolo_weights, calibration_images, models_config['YOLO']['imgsz'], yolo_int8_path)
+        report['yolo'] = {
+            'float_mb': _size_mb(yolo_weights),
+            'int8_mb': _size_mb(yolo_int8_path),
+            **evaluate_yolo(service, yolo_int8_path, args.holdout_dir),
+        }
+
+    report_path = args.report or os.path.join(config.UPLOADS_DIR, 'quantization_report.json')
+    os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# app/scripts/thread_budget.py
+"""
+Presupuesto de hilos para la inferencia en CPU
+Reparte los núcleos disponibles (afinidad del proceso) entre los procesos
+que cargan modelos y los análisis concurrentes de cada proceso, y fija
+los hilos intra-op / inter-op de torch y los de OpenCV
+"""
+
+import logging
+import os
+
+import cv2
+import torch
+
+
+logger = logging.getLogger(__name__)
+
+
+def available_cpus():
+    """Núcleos que el proceso puede usar (respeta taskset/cgroups cpuset)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # No disponible fuera de Linux
+        return os.cpu_count() or 1
+
+
+def thread_budget(threads_config, workers=1):
+    """
+    Hilos por proceso: núcleos / procesos, divididos entre las inferencias
+    concurrentes del proceso. Los valores 0 en la configuración son automáticos
+    """
+    cpus = available_cpus()
+    workers = max(1, int(workers))
+    concurrency = max(1, int(threads_config.get('concurrency', 1)))
+    per_worker = max(1, cpus // workers)
+    per_inference = max(1, per_worker // concurrency)
+
+    return {
+        'cpus': cpus,
+        'workers': workers,
+        'concurrency': concurrency,
+        'intra_op': int(threads_config.get('intra_op') or per_inference),
+        'inter_op': int(threads_config.get('inter_op') or 1),
+        'opencv': int(threads_config.get('opencv') or per_inference),
+    }
+
+
+def configure_threads(threads_config, workers=1):
+    """Aplica el presupuesto al proceso actual; llamar antes de cargar modelos"""
+    budget = thread_budget(threads_config, workers)
+
+    torch.set_num_threads(budget['intra_op'])
+    try:
+        torch.set_num_interop_threads(budget['inter_op'])
+    except RuntimeError:
+        # Solo se puede fijar antes del primer trabajo paralelo inter-op
+        budget['inter_op'] = torch.get_num_interop_threads()
+        logger.debug("[THREADS] Hilos inter-op ya fijados (%d)", budget['inter_op'])
+    cv2.setNumThreads(budget['opencv'])
+
+    logger.info(
+        "[THREADS] %d núcleos / %d procesos: intra-op=%d, inter-op=%d, opencv=%d, concurrencia=%d",
+        budget['cpus'], budget['workers'], budget['intra_op'],
+        budget['inter_op'], budget['opencv'], budget['concurrency'],
+    )
+    return budget
@@ -0,0 +1,103 @@
+# app/scripts/timing.py
+"""
+Medición de latencia por etapa del pipeline de análisis
+StageTimer mide un análisis; LatencyHistograms acumula en el proceso
+"""
+
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Orden de presentación de las etapas
+STAGES = ('decode', 'wait', 'yolo', 'sam', 'preprocess', 'classify', 'draw', 'encode')
+
+
+class StageTimer:
+    """Duraciones (ms) de las etapas de un análisis"""
+
+    def __init__(self):
+        self.stages = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - t0) * 1000.0)
+
+    def add(self, name, elapsed_ms):
+        self.stages[name] = self.stages.get(name, 0.0) + elapsed_ms
+
+    def as_dict(self):
+        timings = {name: round(ms, 2) for name, ms in self.stages.items()}
+        timings['total'] = round((time.perf_counter() - self._start) * 1000.0, 2)
+        return timings
+
+
+class LatencyHistograms:
+    """Histogramas de latencia por etapa con buckets fijos en ms"""
+
+    BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000, math.inf)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._sums = {}
+        self._max = {}
+
+    def record(self, timings):
+        """Registra el dict devuelto por StageTimer.as_dict()"""
+        with self._lock:
+            for name, ms in timings.items():
+                counts = self._counts.setdefault(name, [0] * len(self.BUCKETS))
+                counts[bisect.bisect_left(self.BUCKETS, ms)] += 1
+                self._sums[name] = self._sums.get(name, 0.0) + ms
+                self._max[name] = max(self._max.get(name, 0.0), ms)
+
+    def _percentile(self, counts, total, q, maximum):
+        # Interpolación lineal dentro del bucket que contiene el percentil,
+        # nunca por encima del máximo observado; el bucket abierto (+Inf) va
+        # de su límite inferior al máximo
+        target = q * total
+        seen = 0
+        lower = 0.0
+        for upper, count in zip(self.BUCKETS, counts):
+            if count and seen + count >= target:
+                if math.isinf(upper):
+                    upper = maximum
+                return min(lower + (upper - lower) * (target - seen) / count, maximum)
+            seen += count
+            lower = upper
+        return min(lower, maximum)
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            names = [s for s in STAGES if s in self._counts]
+            names += sorted(n for n in self._counts if n not in STAGES)
+            for name in names:
+                counts = self._counts[name]
+                total = sum(counts)
+                maximum = self._max[name]
+                result[name] = {
+                    'count': total,
+                    'mean_ms': round(self._sums[name] / total, 2),
+                    'p50_ms': round(self._percentile(counts, total, 0.50, maximum), 2),
+                    'p95_ms': round(self._percentile(counts, total, 0.95, maximum), 2),
+                    'p99_ms': round(self._percentile(counts, total, 0.99, maximum), 2),
+                    'max_ms': round(maximum, 2),
+                    'buckets': {
+                        ('+Inf' if math.isinf(b) else str(b)): c
+                        for b, c in zip(self.BUCKETS, counts)
+                    },
+                }
+            return result
+
+
+# Histogramas del proceso (uno por trabajador web)
+latency_histograms = LatencyHistograms()
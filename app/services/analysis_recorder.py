@@ -0,0 +1,124 @@
+# app/services/analysis_recorder.py
+"""
+Registro asíncrono de análisis de imágenes en la base de datos
+Las solicitudes solo encolan; un hilo escribe por lotes dentro del
+contexto de la aplicación, sin retrasar la respuesta HTTP
+"""
+
+import logging
+import queue
+import threading
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.extensions import db
+from app.models.image_analysis_model import ImageAnalysis
+
+
+logger = logging.getLogger(__name__)
+
+
+class AnalysisRecorder:
+    """Cola acotada de análisis por guardar y un hilo escritor"""
+
+    def __init__(self, max_queue=1000, batch_size=50):
+        self.batch_size = max(1, int(batch_size))
+        self.recorded = 0
+        self.duplicates = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def record(self, app, results, image_hash, fingerprint, finca_id=None, encuesta_id=None):
+        """Encola un resultado; si la cola está llena se descarta (nunca bloquea)"""
+        record = {
+            'image_hash': image_hash,
+            'finca_id': finca_id,
+            'encuesta_id': encuesta_id,
+            'total_hojas': results['total_leaves'],
+            'hojas_sanas': results['healthy_leaves'],
+            'hojas_afectadas': results['affected_leaves'],
+            'confianza': results['confidence'],
+            'hojas': ImageAnalysis.encode_leaves(results['leaves']),
+            'huella_modelos': fingerprint,
+            'tiempos': results.get('timings'),
+        }
+        try:
+            self._queue.put_nowait((app, record))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            logger.warning("[RECORDER] Cola llena, análisis de %s no guardado", image_hash[:12])
+            return
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='analysis-recorder', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            app, record = self._queue.get()
+            batch = [record]
+            # Agrupar lo que ya esté en cola: un commit por lote
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait()[1])
+                except queue.Empty:
+                    break
+            with app.app_context():
+                self._write(batch)
+
+    def _write(self, batch):
+        added = 0
+        duplicates = 0
+        failed = 0
+        try:
+            for record in batch:
+                # Misma imagen, mismo destino y mismos modelos: ya registrada
+                exists = ImageAnalysis.query.filter_by(
+                    image_hash=record['image_hash'],
+                    finca_id=record['finca_id'],
+                    encuesta_id=record['encuesta_id'],
+                    huella_modelos=record['huella_modelos'],
+                ).first()
+                if exists:
+                    duplicates += 1
+                    continue
+                # Savepoint por registro: uno inválido (p. ej. finca borrada) no
+                # descarta el resto del lote
+                try:
+                    with db.session.begin_nested():
+                        db.session.add(ImageAnalysis(**record))
+                    added += 1
+                except SQLAlchemyError as e:
+                    failed += 1
+                    logger.warning("[RECORDER] Análisis de %s no guardado: %s", record['image_hash'][:12], e)
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            with self._lock:
+                self.failed += len(batch) - duplicates
+            logger.warning("[RECORDER] Error guardando %d análisis: %s", len(batch), e)
+            return
+        finally:
+            db.session.remove()
+
+        with self._lock:
+            self.recorded += added
+            self.duplicates += duplicates
+            self.failed += failed
+
+    def stats(self):
+        with self._lock:
+            return {
+                'recorded': self.recorded,
+                'duplicates': self.duplicates,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'pending': self._queue.qsize(),
+            }
@@ -0,0 +1,144 @@
+# app/utils/admission.py
+"""
+Control de admisión para los endpoints de análisis
+- Límite de análisis simultáneos por proceso y cola de espera acotada
+- Límite opcional por usuario (en curso + en espera)
+- Dos carriles: 'interactive' (subidas individuales) tiene prioridad y
+  cupos reservados frente a 'bulk' (sincronizaciones masivas)
+Lo que no cabe se rechaza de inmediato con un Retry-After estimado
+"""
+
+import math
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+
+LANES = ('interactive', 'bulk')
+
+
+class AdmissionRejected(Exception):
+    """Solicitud rechazada: status 429 (límite de usuario) o 503 (saturado)"""
+
+    def __init__(self, status, reason, retry_after):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Semáforo con cola acotada por carril, prioridad y límite por usuario"""
+
+    def __init__(self, max_in_flight=2, max_waiting=16, wait_timeout=30.0, per_user=0, reserved_interactive=1):
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.max_waiting = max(0, int(max_waiting))
+        self.wait_timeout = float(wait_timeout)
+        self.per_user = max(0, int(per_user))
+        # Nunca reservar todos los cupos: bulk debe poder avanzar
+        self.reserved_interactive = min(max(0, int(reserved_interactive)), self.max_in_flight - 1)
+
+        self._cond = threading.Condition()
+        self._in_flight = {lane: 0 for lane in LANES}
+        self._waiting = {lane: deque() for lane in LANES}
+        self._users = Counter()
+        self._avg_seconds = 1.0
+        self._counters = Counter()
+
+    @contextmanager
+    def admit(self, user=None, lane='interactive'):
+        """Espera un cupo (o lanza AdmissionRejected) y lo libera al salir"""
+        lane = lane if lane in LANES else 'interactive'
+        self._acquire(user, lane)
+        t0 = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(user, lane, time.monotonic() - t0)
+
+    def _can_run(self, lane, token):
+        running = sum(self._in_flight.values())
+        if running >= self.max_in_flight:
+            return False
+        if lane == 'interactive':
+            return self._waiting['interactive'][0] is token
+        # bulk: solo sin interactivas en espera y sin ocupar los cupos reservados
+        if self._waiting['interactive'] or running >= self.max_in_flight - self.reserved_interactive:
+            return False
+        return self._waiting['bulk'][0] is token
+
+    def _retry_after(self):
+        """Segundos estimados hasta que se libere la cola actual"""
+        pending = sum(self._in_flight.values()) + sum(len(w) for w in self._waiting.values())
+        return max(1, math.ceil(self._avg_seconds * pending / self.max_in_flight))
+
+    def _reject(self, status, reason, counter):
+        self._counters[counter] += 1
+        raise AdmissionRejected(status, reason, self._retry_after())
+
+    def _acquire(self, user, lane):
+        with self._cond:
+            if self.per_user and user is not None and self._users[user] >= self.per_user:
+                self._reject(429, f"Máximo {self.per_user} análisis simultáneos por usuario", 'rejected_user')
+            if len(self._waiting[lane]) >= self.max_waiting and sum(self._in_flight.values()) >= self.max_in_flight:
+                self._reject(503, "Cola de análisis llena", 'rejected_full')
+
+            token = object()
+            self._waiting[lane].append(token)
+            if user is not None:
+                self._users[user] += 1
+
+            if not self._can_run(lane, token):
+                self._counters[f'queued_{lane}'] += 1
+                deadline = time.monotonic() + self.wait_timeout
+                while not self._can_run(lane, token):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._waiting[lane].remove(token)
+                        self._forget_user(user)
+                        self._cond.notify_all()
+                        self._reject(503, "Tiempo de espera agotado en la cola de análisis", 'rejected_timeout')
+                    self._cond.wait(remaining)
+
+            self._waiting[lane].popleft()
+            self._in_flight[lane] += 1
+            self._counters[f'admitted_{lane}'] += 1
+            # El siguiente en la cola puede tener cupo también
+            self._cond.notify_all()
+
+    def _release(self, user, lane, elapsed):
+        with self._cond:
+            self._in_flight[lane] -= 1
+            self._forget_user(user)
+            # Media móvil del tiempo de servicio para estimar Retry-After
+            self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * elapsed
+            self._cond.notify_all()
+
+    def _forget_user(self, user):
+        if user is None:
+            return
+        self._users[user] -= 1
+        if self._users[user] <= 0:
+            del self._users[user]
+
+    def queue_depth(self):
+        """Solicitudes en espera de un cupo (todos los carriles)"""
+        with self._cond:
+            return sum(len(w) for w in self._waiting.values())
+
+    def stats(self):
+        with self._cond:
+            return {
+                'max_in_flight': self.max_in_flight,
+                'in_flight': dict(self._in_flight),
+                'waiting': {lane: len(w) for lane, w in self._waiting.items()},
+                'avg_service_seconds': round(self._avg_seconds, 3),
+                'admitted': {lane: self._counters[f'admitted_{lane}'] for lane in LANES},
+                'queued': {lane: self._counters[f'queued_{lane}'] for lane in LANES},
+                'rejected': {
+                    'queue_full': self._counters['rejected_full'],
+                    'user_limit': self._counters['rejected_user'],
+                    'timeout': self._counters['rejected_timeout'],
+                },
+            }
@@ -0,0 +1,66 @@
+# app/utils/image_store.py
+"""
+Imágenes procesadas servidas por id
+Caché LRU en memoria acotada por bytes; el id se deriva del contenido
+analizado, las opciones de renderizado y la huella de modelos, así que
+es estable entre reintentos
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def image_id(result_key, fingerprint):
+    """Id público de una imagen procesada (también sirve como ETag)"""
+    return hashlib.sha256(f"{result_key}|{fingerprint}".encode('utf-8')).hexdigest()[:32]
+
+
+class ImageStore:
+    """Caché LRU de imágenes (bytes + tipo MIME) acotada por bytes"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # id -> (bytes, mimetype)
+        self._total_bytes = 0
+
+    def put(self, key, data, mimetype):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= len(old[0])
+            self._entries[key] = (data, mimetype)
+            self._total_bytes += len(data)
+
+            while self._total_bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._total_bytes -= len(evicted)
+                self.evictions += 1
+
+    def get(self, key):
+        """(bytes, mimetype) o None si no existe o fue desalojada"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+            }
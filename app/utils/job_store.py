@@ -0,0 +1,148 @@
+# app/utils/job_store.py
+"""
+Estado de los trabajos de análisis en archivos compartidos entre procesos
+Cada trabajador web puede encolar y consultar cualquier trabajo; un solo
+proceso (el dueño del pool, ver job_queue.py) los ejecuta
+- <id>.json: estado (escritura atómica con os.replace)
+- <id>.task: imagen y opciones; existe mientras el trabajo está pendiente
+- <id>.result: resultado serializado
+"""
+
+import json
+import os
+import pickle
+import re
+import time
+import uuid
+
+
+_JOB_ID = re.compile(r'[0-9a-f]{32}')
+
+
+class JobStore:
+    """Trabajos guardados en un directorio (p. ej. UPLOADS_DIR/jobs)"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, job_id, ext):
+        return os.path.join(self.directory, f"{job_id}.{ext}")
+
+    def _write(self, path, data):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _save(self, job):
+        self._write(self._path(job['id'], 'json'), json.dumps(job).encode('utf-8'))
+
+    def _new_job(self, status, meta):
+        now = time.time()
+        return {
+            'id': uuid.uuid4().hex,
+            'status': status,
+            'submitted_at': now,
+            'started_at': None,
+            'finished_at': None,
+            'version': None,
+            'error': None,
+            'meta': meta or {},
+        }
+
+    def create(self, task, meta=None):
+        """Trabajo pendiente; task: (imagen, hash, render, tiled)"""
+        job = self._new_job('queued', meta)
+        # La tarea antes que el estado: quien vea el trabajo encuentra su imagen
+        self._write(self._path(job['id'], 'task'), pickle.dumps(task))
+        self._save(job)
+        return job
+
+    def add_completed(self, result, meta=None, version=None):
+        """Trabajo ya resuelto (p. ej. desde la caché de resultados)"""
+        job = self._new_job('done', meta)
+        job.update(started_at=job['submitted_at'], finished_at=job['submitted_at'], version=version)
+        self._write(self._path(job['id'], 'result'), pickle.dumps(result))
+        self._save(job)
+        return job
+
+    def get(self, job_id):
+        """Estado de un trabajo o None si no existe/expiró"""
+        if not _JOB_ID.fullmatch(job_id):
+            return None
+        try:
+            with open(self._path(job_id, 'json'), 'rb') as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def update(self, job_id, **fields):
+        """Actualiza el estado (solo lo llama el dueño del pool)"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.update(fields)
+        self._save(job)
+        return job
+
+    def load_task(self, job_id):
+        try:
+            with open(self._path(job_id, 'task'), 'rb') as f:
+                return pickle.load(f)
+        except OSError:
+            return None
+
+    def finish(self, job_id, result=None, **fields):
+        """Guarda el resultado, marca el trabajo terminado y borra su tarea"""
+        if result is not None:
+            self._write(self._path(job_id, 'result'), pickle.dumps(result))
+        job = self.update(job_id, finished_at=time.time(), **fields)
+        self._remove(job_id, 'task')
+        return job
+
+    def load_result(self, job_id):
+        if not _JOB_ID.fullmatch(job_id):
+            return None
+        try:
+            with open(self._path(job_id, 'result'), 'rb') as f:
+                return pickle.load(f)
+        except OSError:
+            return None
+
+    def pending(self):
+        """Ids con tarea pendiente, en orden de llegada"""
+        tasks = []
+        try:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.task'):
+                    try:
+                        tasks.append((entry.stat().st_mtime, entry.name[:-len('.task')]))
+                    except OSError:
+                        pass  # Terminado mientras se listaba
+        except OSError:
+            return []
+        return [job_id for _, job_id in sorted(tasks)]
+
+    def jobs(self):
+        """Estado de todos los trabajos guardados"""
+        try:
+            names = [n for n in os.listdir(self.directory) if n.endswith('.json')]
+        except OSError:
+            return []
+        jobs = (self.get(name[:-len('.json')]) for name in names)
+        return [job for job in jobs if job is not None]
+
+    def expire(self, ttl):
+        """Borra los trabajos terminados hace más de ttl segundos"""
+        cutoff = time.time() - ttl
+        for job in self.jobs():
+            if job['finished_at'] is not None and job['finished_at'] < cutoff:
+                for ext in ('result', 'task', 'json'):
+                    self._remove(job['id'], ext)
+
+    def _remove(self, job_id, ext):
+        try:
+            os.remove(self._path(job_id, ext))
+        except OSError:
+            pass
@@ -0,0 +1,116 @@
+# app/utils/log.py
+"""
+Logging del proyecto
+- Niveles configurables (LOG_LEVEL)
+- Escritura no bloqueante: los hilos de las solicitudes solo encolan,
+  un hilo aparte escribe en stdout
+- Id de correlación por solicitud (cabecera X-Request-ID)
+- Muestreo de mensajes DEBUG (LOG_DEBUG_SAMPLE_RATE)
+"""
+
+import atexit
+import contextvars
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import uuid
+
+from flask import g, request
+
+
+LOG_FORMAT = '%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s'
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+_request_id = contextvars.ContextVar('request_id', default='-')
+_listener = None
+
+
+class RequestIdFilter(logging.Filter):
+    """Añade el id de la solicitud actual a cada registro"""
+
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        return True
+
+
+class DebugSamplingFilter(logging.Filter):
+    """Deja pasar solo una fracción de los mensajes DEBUG"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = max(0.0, min(1.0, float(rate)))
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate >= 1.0:
+            return True
+        return random.random() < self.rate
+
+
+def setup_logging(level='INFO', debug_sample_rate=1.0):
+    """Configura el logger raíz con un QueueHandler; idempotente por proceso"""
+    global _listener
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    # Los filtros corren en el hilo que registra: ahí se lee el id de la solicitud
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+    queue_handler.addFilter(DebugSamplingFilter(debug_sample_rate))
+
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    # El hilo escritor no sobrevive a fork (gunicorn con preload): uno nuevo en el hijo
+    os.register_at_fork(after_in_child=_restart_listener)
+
+
+def _restart_listener():
+    if _listener is not None:
+        _listener._thread = None
+        _listener.start()
+
+
+def init_request_logging(app):
+    """Asigna un id de correlación a cada solicitud y lo devuelve en la respuesta"""
+
+    @app.before_request
+    def _bind_request_id():
+        request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex[:16]
+        g.request_id = request_id
+        g.request_id_token = _request_id.set(request_id)
+
+    @app.after_request
+    def _send_request_id(response):
+        request_id = g.get('request_id')
+        if request_id:
+            response.headers[REQUEST_ID_HEADER] = request_id
+        return response
+
+    @app.teardown_request
+    def _unbind_request_id(exc):
+        token = g.pop('request_id_token', None)
+        if token is not None:
+            try:
+                _request_id.reset(token)
+            except ValueError:
+                # Contexto distinto al de before_request
+                _request_id.set('-')
+
+
+def current_request_id():
+    """Id de correlación activo ('-' fuera de una solicitud)"""
+    return _request_id.get()
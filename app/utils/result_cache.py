@@ -0,0 +1,96 @@
+# app/utils/result_cache.py
+"""
+Caché en memoria de resultados de análisis
+Clave: (hash del contenido, huella de la configuración de modelos)
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+def model_fingerprint(models_config):
+    """Huella de la configuración de modelos y de los pesos en disco"""
+    weights = []
+    for path in (
+        models_config['YOLO']['weights'],
+        models_config['RESNET']['weights'],
+        models_config['SAM']['checkpoint'],
+    ):
+        try:
+            st = os.stat(path)
+            weights.append([path, st.st_mtime_ns, st.st_size])
+        except OSError:
+            weights.append([path, None, None])
+
+    payload = json.dumps(
+        {'models': models_config, 'weights': weights},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+class ResultCache:
+    """Caché LRU acotada por bytes; se vacía al cambiar la huella de modelos"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, tamaño)
+        self._total_bytes = 0
+        self._fingerprint = None
+
+    def _check_fingerprint(self, fingerprint):
+        # Pesos o configuración nuevos: nada de lo guardado es válido
+        if fingerprint != self._fingerprint:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._total_bytes = 0
+            self._fingerprint = fingerprint
+
+    def get(self, content_hash, fingerprint):
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            entry = self._entries.get(content_hash)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(content_hash)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, content_hash, fingerprint, value, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            old = self._entries.pop(content_hash, None)
+            if old is not None:
+                self._total_bytes -= old[1]
+            self._entries[content_hash] = (value, size)
+            self._total_bytes += size
+
+            while self._total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+            }
@@ -0,0 +1,289 @@
+# app/utils/service_registry.py
+"""
+Registro de un servicio costoso de construir (modelos cargados en memoria)
+- Inicialización bajo lock: solicitudes concurrentes no cargan dos veces
+- Carga en segundo plano opcional, con estado consultable
+- Recarga en caliente por versión: la nueva instancia se construye y calienta
+  en segundo plano, se intercambia de forma atómica y la anterior se libera
+  cuando terminan las solicitudes que la tenían prestada (lease)
+"""
+
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+# Estados de carga
+IDLE = 'idle'
+LOADING = 'loading'
+WARMING = 'warming'
+READY = 'ready'
+ERROR = 'error'
+
+
+class ServiceRegistry:
+    """Instancia única de un servicio con inicialización perezosa y segura entre hilos"""
+
+    def __init__(self, factory, warmup=None, name='servicio', version=None):
+        """version: callable con la versión en disco (p. ej. huella de los pesos)"""
+        self._factory = factory
+        self._warmup = warmup
+        self._version_fn = version
+        self.name = name
+        self.service = None
+        self.version = None
+        self.loaded_at = None
+        self.state = IDLE
+        self.error = None
+        self._lock = threading.Lock()
+        self._loader = None
+
+        # Recarga en caliente
+        self.reloads = 0
+        self.reload_error = None
+        self.pending_version = None
+        self._reload_lock = threading.Lock()
+        self._failed_version = None
+        self._watcher = None
+        self._stop_watch = threading.Event()
+
+        # Préstamos por instancia: id -> solicitudes en curso; retiradas -> (versión, servicio)
+        self._lease_lock = threading.Lock()
+        self._leases = Counter()
+        self._draining = {}
+
+    def _current_version(self):
+        return self._version_fn() if self._version_fn is not None else None
+
+    def _build(self, warm=True):
+        """(servicio, versión) nuevos; la versión se lee antes de cargar los pesos"""
+        version = self._current_version()
+        service = self._factory()
+        if warm and self._warmup is not None:
+            # En una recarga el estado sigue siendo READY: la versión actual atiende
+            if self.service is None:
+                self.state = WARMING
+            self._warmup(service)
+        return service, version
+
+    def _load(self, warm=True):
+        """Construye y calienta el servicio; se llama con el lock tomado"""
+        self.state = LOADING
+        self.error = None
+        try:
+            service, version = self._build(warm)
+        except Exception as e:
+            logger.exception("Error crítico inicializando %s: %s", self.name, e)
+            self.error = str(e)
+            self.state = ERROR
+            return None
+
+        self._install(service, version)
+        self.state = READY
+        return service
+
+    def _install(self, service, version):
+        """Intercambio atómico; la instancia anterior queda drenando si está prestada"""
+        with self._lease_lock:
+            old = self.service
+            if old is not None and self._leases[id(old)] > 0:
+                self._draining[id(old)] = (self.version, old)
+            self.service = service
+            self.version = version
+            self.loaded_at = time.time()
+
+    def get(self):
+        """
+        Servicio listo, cargándolo si hace falta (una sola carga a la vez)
+        Devuelve None mientras carga en segundo plano o si la carga falló
+        """
+        service = self.service
+        if service is not None:
+            return service
+
+        # No bloquear solicitudes mientras carga el hilo de arranque
+        loader = self._loader
+        if loader is not None and loader.is_alive():
+            return None
+
+        with self._lock:
+            if self.service is None:
+                self._load()
+            return self.service
+
+    def start(self, mode='lazy'):
+        """
+        'lazy': cargar en la primera solicitud; 'background': hilo en segundo
+        plano; 'eager': bloquear hasta que el servicio esté listo
+        """
+        if mode == 'eager':
+            self.get()
+        elif mode == 'background':
+            with self._lock:
+                if self.service is not None or self._loader is not None:
+                    return
+                self.state = LOADING
+                self._loader = threading.Thread(
+                    target=self._load_in_background, name=f'{self.name}-startup', daemon=True
+                )
+                self._loader.start()
+
+    def preload(self):
+        """Carga sin calentar, antes de fork: cada proceso hijo llama a warm()"""
+        with self._lock:
+            if self.service is None:
+                self._load(warm=False)
+            return self.service
+
+    def warm(self):
+        """Calienta el servicio ya cargado (en el proceso hijo tras fork)"""
+        with self._lock:
+            if self.service is None or self._warmup is None:
+                return
+            self.state = WARMING
+            try:
+                self._warmup(self.service)
+            except Exception as e:
+                logger.warning("Calentamiento de %s fallido: %s", self.name, e)
+            self.state = READY
+
+    def _load_in_background(self):
+        with self._lock:
+            if self.service is None:
+                self._load()
+
+    @contextmanager
+    def lease(self):
+        """
+        (servicio, versión) prestados durante la solicitud
+        Una recarga no libera la instancia hasta que terminen sus préstamos
+        """
+        service = self.get()
+        if service is None:
+            yield None, None
+            return
+
+        with self._lease_lock:
+            # Tomar la instancia vigente: pudo cambiar desde get()
+            service, version = self.service, self.version
+            self._leases[id(service)] += 1
+        try:
+            yield service, version
+        finally:
+            with self._lease_lock:
+                key = id(service)
+                self._leases[key] -= 1
+                if self._leases[key] <= 0:
+                    del self._leases[key]
+                    drained = self._draining.pop(key, None)
+                    if drained is not None:
+                        logger.info("[RELOAD] %s versión %s drenada", self.name, drained[0])
+
+    def reload(self, force=False, warm=True):
+        """
+        Construye y calienta la versión en disco sin bloquear solicitudes y la
+        intercambia; si falla se mantiene la versión actual. Devuelve True si cambió
+        warm=False: sin calentar (maestro de gunicorn con preload, como preload())
+        """
+        if not self._reload_lock.acquire(blocking=False):
+            return False  # Ya hay una recarga en curso
+        try:
+            version = self._current_version()
+            if self.service is None or (not force and version == self.version):
+                return False
+
+            self.pending_version = version
+            logger.info("[RELOAD] Cargando %s versión %s (activa: %s)", self.name, version, self.version)
+            t0 = time.perf_counter()
+            try:
+                service, version = self._build(warm)
+            except Exception as e:
+                # No reintentar la misma versión en cada sondeo
+                self._failed_version = version
+                self.reload_error = str(e)
+                logger.exception("[RELOAD] Versión %s de %s descartada: %s", version, self.name, e)
+                return False
+
+            previous = self.version
+            self._install(service, version)
+            self.reloads += 1
+            self.reload_error = None
+            self._failed_version = None
+            logger.info(
+                "[RELOAD] %s: versión %s activa (anterior %s, %.1f s)",
+                self.name, version, previous, time.perf_counter() - t0,
+            )
+            return True
+        finally:
+            self.pending_version = None
+            self._reload_lock.release()
+
+    def watch(self, interval=30.0, warm=True, on_reload=None):
+        """
+        Hilo que sondea la versión en disco y recarga cuando cambia
+        Solo recarga si la versión se repite en dos sondeos seguidos: un
+        archivo a medio copiar cambia entre sondeos y se ignora hasta terminar
+        on_reload(): se llama tras cada recarga exitosa
+        """
+        if self._version_fn is None:
+            return
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+
+        def _run():
+            seen = None
+            while not self._stop_watch.wait(interval):
+                try:
+                    version = self._current_version()
+                except Exception as e:
+                    logger.warning("[RELOAD] No se pudo leer la versión de %s: %s", self.name, e)
+                    continue
+                if self.service is None or version in (self.version, self._failed_version):
+                    seen = None
+                    continue
+                if version == seen:
+                    if self.reload(warm=warm) and on_reload is not None:
+                        on_reload()
+                    seen = None
+                else:
+                    seen = version
+
+        self._stop_watch.clear()
+        self._watcher = threading.Thread(target=_run, name=f'{self.name}-watcher', daemon=True)
+        self._watcher.start()
+        logger.info("[RELOAD] Vigilando versiones de %s cada %.0f s", self.name, interval)
+
+    def stop_watch(self):
+        self._stop_watch.set()
+
+    def versions(self):
+        """Versión activa, recargas y versiones anteriores aún prestadas"""
+        with self._lease_lock:
+            draining = [
+                {'version': version, 'leases': self._leases[key]}
+                for key, (version, _) in self._draining.items()
+            ]
+            active_leases = self._leases[id(self.service)] if self.service is not None else 0
+        return {
+            'version': self.version,
+            'loaded_at': self.loaded_at,
+            'leases': active_leases,
+            'reloads': self.reloads,
+            'reloading': self.pending_version is not None,
+            'pending_version': self.pending_version,
+            'last_reload_error': self.reload_error,
+            'draining': draining,
+            'watching': self._watcher is not None and self._watcher.is_alive(),
+        }
+
+    @property
+    def loading(self):
+        return self.state in (LOADING, WARMING)
+
+    @property
+    def ready(self):
+        return self.state == READY and self.service is not None
@@ -0,0 +1,31 @@
+# app/utils/uploads.py
+"""
+Manejo de archivos subidos en memoria
+Evita que Werkzeug vuelque a disco los archivos grandes para que el
+análisis pueda decodificar la imagen directamente desde el buffer
+"""
+
+import io
+
+from flask import Request
+
+
+class InMemoryUploadRequest(Request):
+    """Request que guarda los archivos subidos en BytesIO"""
+
+    # Por encima de este tamaño se usa el comportamiento por defecto (disco)
+    max_in_memory_upload = 64 * 1024 * 1024
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= self.max_in_memory_upload:
+            return io.BytesIO()
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+
+def upload_buffer(file_storage):
+    """Contenido de un archivo subido sin copias cuando está en memoria"""
+    stream = file_storage.stream
+    if isinstance(stream, io.BytesIO):
+        return stream.getbuffer()
+    stream.seek(0)
+    return stream.read()
@@ -0,0 +1,47 @@
+# gunicorn.conf.py
+"""
+Configuración de gunicorn
+    gunicorn -c gunicorn.conf.py run:app
+
+Con ANALYSIS_STARTUP=preload los modelos se cargan una vez en el maestro
+antes de fork; los trabajadores comparten los pesos (memoria compartida de
+solo lectura) en lugar de cargar cada uno su copia. Al cambiar los pesos
+el maestro carga la versión nueva y reinicia los trabajadores (SIGHUP)
+"""
+
+import os
+import signal
+
+from app.config import Config
+
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+# Mismo valor con el que la aplicación reparte los hilos de inferencia
+workers = Config.ANALYSIS_THREADS['web_workers']
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+
+preload_app = os.getenv("ANALYSIS_STARTUP", "background") == "preload"
+
+
+def post_fork(server, worker):
+    if not preload_app:
+        return
+
+    # Conexiones abiertas por el maestro (db.create_all): cada trabajador abre
+    # las suyas; close=False no cierra los sockets que siguen siendo del maestro
+    from app.extensions import db
+    with server.app.wsgi().app_context():
+        db.engine.dispose(close=False)
+
+    # Hilos de torch/OpenCV, backends exportados y calentamiento por trabajador
+    from app.routes.analysis import after_fork
+    after_fork()
+
+
+def when_ready(server):
+    # Pesos nuevos: el maestro carga la versión nueva y reinicia los trabajadores
+    # de forma ordenada (SIGHUP); así siguen compartiendo una sola copia
+    if preload_app:
+        from app.routes.analysis import watch_models_for_restart
+        watch_models_for_restart(lambda: os.kill(server.pid, signal.SIGHUP))
@@ -0,0 +1,146 @@
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+from app.routes import analysis
+from app.utils.admission import AdmissionController, AdmissionRejected
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condición no alcanzada"
+        time.sleep(0.005)
+
+
+class Holder:
+    """Hilo que ocupa un cupo hasta release()"""
+
+    def __init__(self, controller, user=None, lane='interactive', admitted=None):
+        self.controller = controller
+        self.error = None
+        self._release = threading.Event()
+        self._admitted = admitted
+        self._thread = threading.Thread(target=self._run, args=(user, lane), daemon=True)
+        self._thread.start()
+
+    def _run(self, user, lane):
+        try:
+            with self.controller.admit(user, lane):
+                if self._admitted is not None:
+                    self._admitted.append(lane)
+                self._release.wait(5)
+        except AdmissionRejected as e:
+            self.error = e
+
+    def release(self):
+        self._release.set()
+        self._thread.join(5)
+
+
+def in_flight(controller):
+    return sum(controller.stats()['in_flight'].values())
+
+
+# ========== Carriles ==========
+
+def test_interactive_admitted_before_earlier_bulk():
+    controller = AdmissionController(max_in_flight=1, reserved_interactive=0)
+    admitted = []
+    first = Holder(controller, admitted=admitted)
+    wait_until(lambda: in_flight(controller) == 1)
+
+    bulk = Holder(controller, lane='bulk', admitted=admitted)
+    wait_until(lambda: controller.stats()['waiting']['bulk'] == 1)
+    interactive = Holder(controller, admitted=admitted)
+    wait_until(lambda: controller.stats()['waiting']['interactive'] == 1)
+
+    first.release()
+    wait_until(lambda: len(admitted) == 2)
+    interactive.release()
+    bulk.release()
+
+    assert admitted == ['interactive', 'interactive', 'bulk']
+
+
+def test_bulk_cannot_take_reserved_slot():
+    controller = AdmissionController(max_in_flight=2, wait_timeout=0.05, reserved_interactive=1)
+    bulk = Holder(controller, lane='bulk')
+    wait_until(lambda: in_flight(controller) == 1)
+
+    with pytest.raises(AdmissionRejected) as excinfo:
+        with controller.admit(lane='bulk'):
+            pass
+    assert excinfo.value.status == 503
+
+    # El cupo reservado sigue libre para las subidas individuales
+    with controller.admit(lane='interactive'):
+        assert controller.stats()['in_flight'] == {'interactive': 1, 'bulk': 1}
+    bulk.release()
+
+
+def test_reserved_slots_never_block_bulk_entirely():
+    controller = AdmissionController(max_in_flight=2, reserved_interactive=5)
+    assert controller.reserved_interactive == 1
+    with controller.admit(lane='bulk'):
+        pass
+
+
+# ========== Rechazos ==========
+
+def test_wait_timeout_rejects_and_leaves_queue_empty():
+    controller = AdmissionController(max_in_flight=1, wait_timeout=0.05)
+    with controller.admit():
+        with pytest.raises(AdmissionRejected) as excinfo:
+            with controller.admit():
+                pass
+        assert controller.queue_depth() == 0
+
+    assert excinfo.value.status == 503
+    assert excinfo.value.retry_after >= 1
+    assert controller.stats()['rejected']['timeout'] == 1
+
+
+def test_full_queue_rejects_immediately():
+    controller = AdmissionController(max_in_flight=1, max_waiting=0, wait_timeout=5)
+    with controller.admit():
+        started = time.monotonic()
+        with pytest.raises(AdmissionRejected) as excinfo:
+            with controller.admit():
+                pass
+    assert time.monotonic() - started < 1
+    assert excinfo.value.status == 503
+    assert controller.stats()['rejected']['queue_full'] == 1
+
+
+def test_per_user_limit():
+    controller = AdmissionController(max_in_flight=4, per_user=1)
+    with controller.admit('user:1'):
+        with pytest.raises(AdmissionRejected) as excinfo:
+            with controller.admit('user:1'):
+                pass
+        # Otros usuarios no se ven afectados
+        with controller.admit('user:2'):
+            pass
+    assert excinfo.value.status == 429
+
+    # Al salir se libera el cupo del usuario
+    with controller.admit('user:1'):
+        pass
+    assert controller.stats()['rejected']['user_limit'] == 1
+
+
+# ========== Carril pedido por el cliente ==========
+
+@pytest.mark.parametrize('requested, default, expected', [
+    (None, 'interactive', 'interactive'),
+    ('bulk', 'interactive', 'bulk'),
+    ('interactive', 'bulk', 'bulk'),
+    ('otro', 'interactive', 'interactive'),
+])
+def test_client_can_only_lower_priority(requested, default, expected):
+    query = {'lane': requested} if requested else {}
+    with Flask(__name__).test_request_context(query_string=query):
+        assert analysis._admission_lane(default) == expected
@@ -0,0 +1,152 @@
+from datetime import date
+
+import pytest
+from flask import Flask
+from sqlalchemy import BigInteger, event
+from sqlalchemy.ext.compiler import compiles
+
+from app.extensions import db
+from app.models import Farm, ImageAnalysis, Role, Survey, SurveyType, User
+from app.routes import analysis
+from app.services.analysis_recorder import AnalysisRecorder
+
+
+@compiles(BigInteger, 'sqlite')
+def _sqlite_bigint(type_, compiler, **kw):
+    # SQLite solo autoincrementa claves primarias INTEGER
+    return 'INTEGER'
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    with app.app_context():
+        # SQLite solo valida claves foráneas con el pragma activo
+        event.listen(db.engine, 'connect', lambda conn, _: conn.execute('PRAGMA foreign_keys=ON'))
+        db.engine.dispose()
+        db.create_all()
+        db.session.add(Role(id=1, nombre='agricultor'))
+        db.session.add(SurveyType(id=1, nombre='TTH'))
+        for user_id in (1, 2):
+            db.session.add(User(
+                id=user_id, nombre='N', apellido='A', correo=f'u{user_id}@test', contrasena_hash='x', rol_id=1,
+            ))
+            db.session.add(Farm(id=user_id * 10, nombre=f'Finca {user_id}', usuario_id=user_id))
+        db.session.add(Survey(id=100, fecha_aplicacion=date(2024, 1, 1), usuario_id=1, finca_id=10, tipo_encuesta_id=1))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def leaves_record(image_hash, finca_id=None):
+    return {
+        'image_hash': image_hash,
+        'finca_id': finca_id,
+        'encuesta_id': None,
+        'total_hojas': 1,
+        'hojas_sanas': 1,
+        'hojas_afectadas': 0,
+        'confianza': 0.9,
+        'hojas': ImageAnalysis.encode_leaves([]),
+        'huella_modelos': 'v1',
+        'tiempos': None,
+    }
+
+
+# ========== Hojas empaquetadas ==========
+
+def test_encode_decode_leaves_roundtrip():
+    leaves = [
+        {'box': [1.4, 2, 30, 40], 'class': 'healthy', 'score': 0.875, 'conf': 0.61},
+        {'box': [5, 6, 70, 80], 'class': 'affected', 'score': 0.5, 'conf': 1.0},
+    ]
+    record = ImageAnalysis(hojas=ImageAnalysis.encode_leaves(leaves))
+
+    decoded = record.decode_leaves()
+    assert [leaf['box'] for leaf in decoded] == [[1, 2, 30, 40], [5, 6, 70, 80]]
+    assert [leaf['class'] for leaf in decoded] == ['healthy', 'affected']
+    assert [leaf['score'] for leaf in decoded] == pytest.approx([0.875, 0.5], abs=1e-4)
+    assert [leaf['conf'] for leaf in decoded] == pytest.approx([0.61, 1.0], abs=1e-4)
+
+
+def test_encode_leaves_clamps_boxes_and_unknown_class():
+    leaves = [{'box': [-5, 0, 70000, 10], 'class': 'otra', 'score': 0.0, 'conf': 0.0}]
+    decoded = ImageAnalysis(hojas=ImageAnalysis.encode_leaves(leaves)).decode_leaves()
+
+    assert decoded[0]['box'] == [0, 0, 65535, 10]
+    assert decoded[0]['class'] == 'unknown'
+
+
+def test_encode_leaves_empty():
+    assert ImageAnalysis(hojas=ImageAnalysis.encode_leaves([])).decode_leaves() == []
+
+
+# ========== Escritor por lotes ==========
+
+def test_write_isolates_invalid_record(app):
+    recorder = AnalysisRecorder()
+    with app.app_context():
+        # La finca 99 no existe: solo ese registro se pierde
+        recorder._write([leaves_record('a' * 64, 10), leaves_record('b' * 64, 99), leaves_record('c' * 64)])
+        saved = sorted(r.image_hash[0] for r in ImageAnalysis.query.all())
+
+    assert saved == ['a', 'c']
+    stats = recorder.stats()
+    assert (stats['recorded'], stats['failed']) == (2, 1)
+
+
+def test_write_skips_duplicates(app):
+    recorder = AnalysisRecorder()
+    with app.app_context():
+        recorder._write([leaves_record('a' * 64, 10)])
+        recorder._write([leaves_record('a' * 64, 10)])
+        assert ImageAnalysis.query.count() == 1
+    assert recorder.stats()['duplicates'] == 1
+
+
+# ========== Finca y encuesta del análisis ==========
+
+@pytest.fixture
+def check_target(app, monkeypatch):
+    """Ejecuta _check_analysis_target con la identidad y los campos dados"""
+    monkeypatch.setitem(analysis.config.ANALYSIS_PERSISTENCE, 'enabled', True)
+
+    def check(identity, **fields):
+        monkeypatch.setattr(analysis, '_request_identity', lambda: identity)
+        with app.test_request_context(method='POST', data=fields):
+            target, error = analysis._check_analysis_target()
+            return target, (error[1] if error else None)
+    return check
+
+
+def test_target_without_ids_needs_no_identity(check_target):
+    assert check_target(None) == ((None, None), None)
+
+
+def test_target_requires_authentication(check_target):
+    assert check_target(None, finca_id='10') == (None, 401)
+
+
+def test_target_owned_farm(check_target):
+    assert check_target(1, finca_id='10') == ((10, None), None)
+
+
+def test_target_foreign_farm_rejected(check_target):
+    assert check_target(2, finca_id='10') == (None, 404)
+    assert check_target(1, finca_id='99') == (None, 404)
+
+
+def test_target_survey_infers_farm(check_target):
+    assert check_target(1, encuesta_id='100') == ((10, 100), None)
+    assert check_target(2, encuesta_id='100') == (None, 404)
+
+
+def test_target_survey_farm_mismatch(check_target):
+    assert check_target(1, finca_id='20', encuesta_id='100') == (None, 400)
+
+
+def test_target_non_integer_id(check_target):
+    assert check_target(1, finca_id='diez') == (None, 400)
@@ -0,0 +1,307 @@
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("ultralytics")
+
+from app.scripts.analyze_service import AnalysisService, _jpeg_size
+from app.scripts.embedding_cache import EmbeddingCache
+
+
+def make_service(sam_config=None, **attrs):
+    """Servicio sin cargar modelos: solo la configuración y los atributos indicados"""
+    service = AnalysisService.__new__(AnalysisService)
+    service.config = {
+        'YOLO': {'imgsz': 320, 'conf': 0.15},
+        'SAM': {'checkpoint': '/no/existe/sam.pth', 'model': 'vit_b', **(sam_config or {})},
+        'RESNET': {'batch_size': 4},
+    }
+    service.device = torch.device('cpu')
+    service.sam = None
+    service.mask_generator = None
+    service.sam_mode = 'off'
+    service.embedding_cache = None
+    service._yolo_lock = threading.Lock()
+    for name, value in attrs.items():
+        setattr(service, name, value)
+    return service
+
+
+@pytest.fixture
+def fake_segment_anything(monkeypatch, tmp_path):
+    """segment_anything mínimo: el registro devuelve un modelo vacío"""
+    module = types.ModuleType('segment_anything')
+    module.sam_model_registry = {'vit_b': lambda checkpoint=None: torch.nn.Identity()}
+    module.SamAutomaticMaskGenerator = lambda **kwargs: object()
+    monkeypatch.setitem(sys.modules, 'segment_anything', module)
+    checkpoint = tmp_path / 'sam.pth'
+    checkpoint.write_bytes(b'')
+    return str(checkpoint)
+
+
+# ========== Modo de SAM ==========
+
+def test_sam_mode_read_from_sam_config(fake_segment_anything, tmp_path):
+    service = make_service(sam_config={
+        'checkpoint': fake_segment_anything,
+        'mode': 'prompt',
+        'embedding_cache': {'enabled': True, 'dir': str(tmp_path / 'emb'), 'max_bytes': 1 << 20},
+    })
+    service._load_sam()
+
+    assert service.sam_mode == 'prompt'
+    assert service.sam is not None
+    assert service.mask_generator is None
+    assert isinstance(service.embedding_cache, EmbeddingCache)
+
+
+def test_sam_off_by_default():
+    service = make_service()
+    service._load_sam()
+
+    assert service.sam_mode == 'off'
+    assert service.sam is None
+    assert service.embedding_cache is None
+
+
+def test_prompt_mode_segments_all_boxes_once():
+    service = make_service(sam=object(), sam_mode='prompt')
+    img = np.zeros((100, 100, 3), dtype=np.uint8)
+    detections = [
+        {'xyxy': (0, 0, 10, 10), 'conf': 0.9},
+        {'xyxy': (20, 20, 40, 40), 'conf': 0.8},
+    ]
+    calls = []
+
+    def segment_boxes(image, dets, image_hash=None):
+        calls.append((len(dets), image_hash))
+        return [np.ones((10, 10), dtype=bool), np.ones((20, 20), dtype=bool)]
+
+    service._segment_boxes = segment_boxes
+    crops, kept = service._prepare_crops(img, detections, image_hash='abc')
+
+    assert calls == [(2, 'abc')]
+    assert len(crops) == len(kept) == 2
+
+
+def test_classify_mode_does_not_use_prompt_segmentation():
+    service = make_service(sam=object(), sam_mode='classify')
+    service._segment_boxes = lambda *args, **kwargs: pytest.fail("_segment_boxes en modo classify")
+    img = np.zeros((50, 50, 3), dtype=np.uint8)
+
+    crops, _ = service._prepare_crops(img, [{'xyxy': (0, 0, 10, 10), 'conf': 0.9}])
+    assert len(crops) == 1
+
+
+# ========== Caché de embeddings SAM ==========
+
+class FakePredictor:
+    """Lo que _set_sam_image usa de SamPredictor"""
+
+    def __init__(self):
+        self.device = torch.device('cpu')
+        self.encoded = 0
+        self.features = None
+        self.is_image_set = False
+        self.transform = types.SimpleNamespace(
+            target_length=1024,
+            get_preprocess_shape=lambda h, w, length: (length * h // max(h, w), length * w // max(h, w)),
+        )
+
+    def set_image(self, img, image_format='RGB'):
+        self.encoded += 1
+        self.features = torch.full((1, 4, 2, 2), float(img.mean()))
+        self.original_size = img.shape[:2]
+        self.is_image_set = True
+
+    def get_image_embedding(self):
+        return self.features
+
+    def reset_image(self):
+        self.features = None
+        self.is_image_set = False
+
+
+def test_set_sam_image_miss_then_hit(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), max_bytes=1 << 20)
+    service = make_service(embedding_cache=cache)
+    img = np.full((60, 80, 3), 7, dtype=np.uint8)
+
+    first = FakePredictor()
+    service._set_sam_image(first, img, image_hash='abc')
+    assert first.encoded == 1
+    assert cache.stats()['misses'] == 1
+    assert cache.stats()['entries'] == 1
+
+    # Otro predictor con la misma imagen: sin ejecutar el codificador
+    second = FakePredictor()
+    service._set_sam_image(second, img, image_hash='abc')
+    assert second.encoded == 0
+    assert second.is_image_set
+    assert second.original_size == (60, 80)
+    assert second.input_size == (768, 1024)
+    assert torch.equal(second.features, first.features)
+    assert cache.stats()['hits'] == 1
+
+
+def test_set_sam_image_without_hash_skips_cache(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), max_bytes=1 << 20)
+    service = make_service(embedding_cache=cache)
+    predictor = FakePredictor()
+
+    service._set_sam_image(predictor, np.zeros((10, 10, 3), dtype=np.uint8))
+    assert predictor.encoded == 1
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (0, 0, 0)
+
+
+# ========== Decodificación JPEG reducida ==========
+
+def encode(width, height, ext='.jpg'):
+    ok, buffer = cv2.imencode(ext, np.zeros((height, width, 3), dtype=np.uint8))
+    assert ok
+    return buffer.tobytes()
+
+
+def test_jpeg_size_from_header():
+    assert _jpeg_size(encode(1000, 600)) == (1000, 600)
+    assert _jpeg_size(memoryview(encode(33, 17))) == (33, 17)
+
+
+def test_jpeg_size_skips_extra_segments():
+    data = encode(640, 480)
+    # Segmento APP1 adicional antes del SOF
+    app1 = b'\xff\xe1\x00\x08' + b'Exif\x00\x00'
+    assert _jpeg_size(data[:2] + app1 + data[2:]) == (640, 480)
+
+
+def test_jpeg_size_rejects_other_formats():
+    assert _jpeg_size(encode(64, 64, '.png')) is None
+    assert _jpeg_size(encode(64, 64)[:20]) is None
+    assert _jpeg_size(b'') is None
+
+
+def make_decode_service(reduced_jpeg=True, **decode):
+    service = make_service(clf_img_size=224)
+    service.config['DECODE'] = {'reduced_jpeg': reduced_jpeg, 'min_long_side': 1280, **decode}
+    return service
+
+
+def test_decode_scale_keeps_min_long_side():
+    service = make_decode_service()
+    assert service._jpeg_decode_scale(encode(4000, 3000)) == 2
+    assert service._jpeg_decode_scale(encode(10240, 16)) == 8
+    assert service._jpeg_decode_scale(encode(1280, 960)) == 1
+
+
+def test_decode_scale_tiled_needs_more_resolution():
+    service = make_decode_service()
+    assert service._jpeg_decode_scale(encode(10240, 16), tiled=True) == 4
+
+
+def test_decode_scale_full_size_when_disabled_or_not_jpeg():
+    assert make_decode_service(reduced_jpeg=False)._jpeg_decode_scale(encode(10240, 16)) == 1
+    assert make_decode_service()._jpeg_decode_scale(encode(10240, 16, '.png')) == 1
+
+
+# ========== Detección por teselas ==========
+
+def test_tile_starts_align_last_tile_to_edge():
+    from app.scripts.analyze_service import _tile_starts
+
+    assert _tile_starts(500, 640, 0.2) == [0]
+    assert _tile_starts(1000, 640, 0.2) == [0, 360]
+    assert _tile_starts(1500, 640, 0.2) == [0, 512, 860]
+
+
+def test_tile_grid_covers_image_with_overlap():
+    service = make_service()
+    service.config['YOLO']['tiling'] = {'tile_size': 640, 'overlap': 0.2, 'max_tiles': 16}
+    tiles = service._tile_grid(1000, 1500)
+
+    assert len(tiles) == 6
+    assert all(x1 - x0 == 640 and y1 - y0 == 640 for x0, y0, x1, y1 in tiles)
+    assert max(t[2] for t in tiles) == 1500 and max(t[3] for t in tiles) == 1000
+    covered = np.zeros((1000, 1500), dtype=bool)
+    for x0, y0, x1, y1 in tiles:
+        covered[y0:y1, x0:x1] = True
+    assert covered.all()
+
+
+def test_tile_grid_grows_tiles_to_respect_max():
+    service = make_service()
+    service.config['YOLO']['tiling'] = {'tile_size': 640, 'overlap': 0.2, 'max_tiles': 2}
+    tiles = service._tile_grid(1000, 1500)
+
+    assert len(tiles) <= 2
+    assert max(t[2] for t in tiles) == 1500 and max(t[3] for t in tiles) == 1000
+
+
+def test_merge_tile_detections_keeps_best_overlapping_box():
+    pytest.importorskip("torchvision")
+    service = make_service()
+    service.config['YOLO']['tiling'] = {'nms_iou': 0.5}
+    detections = [
+        {'xyxy': (100, 100, 200, 200), 'conf': 0.8},
+        {'xyxy': (105, 102, 203, 198), 'conf': 0.9},
+        {'xyxy': (400, 400, 450, 450), 'conf': 0.3},
+    ]
+
+    merged = service._merge_tile_detections(detections)
+    assert sorted(det['conf'] for det in merged) == [0.3, 0.9]
+    assert service._merge_tile_detections(detections[:1]) == detections[:1]
+
+
+# ========== YOLO compartido entre cupos ==========
+
+class RecordingYOLO:
+    """YOLO falso que detecta llamadas solapadas (predictor.args compartido)"""
+
+    def __init__(self):
+        self.active = 0
+        self.overlaps = 0
+        self.calls = []
+
+    def __call__(self, imgs, **kwargs):
+        self.active += 1
+        if self.active > 1:
+            self.overlaps += 1
+        time.sleep(0.02)
+        self.calls.append(kwargs['imgsz'])
+        self.active -= 1
+        return [types.SimpleNamespace(boxes=None) for _ in imgs]
+
+
+def test_concurrent_profiles_do_not_overlap_yolo_calls():
+    yolo = RecordingYOLO()
+    service = make_service(yolo=yolo)
+    profiles = [{'imgsz': 320, 'conf': 0.15}, {'imgsz': 224, 'conf': 0.25}] * 3
+    threads = [threading.Thread(target=service._detect_yolo_batch, args=([None], p)) for p in profiles]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert yolo.overlaps == 0
+    assert sorted(yolo.calls) == sorted(p['imgsz'] for p in profiles)
+
+
+def test_profile_degraded_only_under_load():
+    service = make_service(_concurrency=1, _waiting=0, load_probe=None)
+    service.config['YOLO'].update(
+        imgsz=640, imgsz_range=(320, 960), conf_range=(0.15, 0.4),
+        adaptive={'enabled': True, 'max_load': 4, 'levels': 4},
+    )
+
+    idle = service._inference_profile((1000, 1500))
+    assert (idle['imgsz'], idle['degraded']) == (960, False)
+
+    service.load_probe = lambda: 4
+    loaded = service._inference_profile((1000, 1500))
+    assert (loaded['imgsz'], loaded['degraded']) == (320, True)
@@ -0,0 +1,45 @@
+import multiprocessing
+
+import app as app_package
+
+
+def _create_app_in_child(calls):
+    """Proceso 'spawn' como los de la cola de trabajos: registra lo que create_app arranca"""
+    app_package.start_analysis_service = lambda mode: calls.put('start_analysis_service')
+    app_package.db.create_all = lambda *args, **kwargs: calls.put('create_all')
+    app_package.create_app()
+    calls.put('done')
+
+
+def test_spawned_worker_skips_startup():
+    ctx = multiprocessing.get_context('spawn')
+    calls = ctx.Queue()
+    process = ctx.Process(target=_create_app_in_child, args=(calls,))
+    process.start()
+    process.join(timeout=120)
+
+    assert process.exitcode == 0
+    assert calls.get(timeout=5) == 'done'
+
+
+def test_preload_workers_do_not_watch(monkeypatch):
+    from app.routes import analysis
+
+    watched = []
+    service = type('Service', (), {'after_fork': lambda self: None, 'prepare_for_fork': lambda self: None})()
+    monkeypatch.setattr(analysis.service_registry, 'service', service)
+    monkeypatch.setattr(analysis.service_registry, 'warm', lambda: None)
+    monkeypatch.setattr(analysis.service_registry, 'watch', lambda *args, **kwargs: watched.append(kwargs))
+    monkeypatch.setattr(analysis, 'configure_threads', lambda *args, **kwargs: None)
+    monkeypatch.setattr(analysis.gc, 'freeze', lambda: None)
+
+    analysis.after_fork()
+    assert watched == []
+
+    # El maestro sí vigila, sin calentar y reiniciando a los trabajadores
+    restarts = []
+    monkeypatch.setitem(analysis.config.MODEL_RELOAD, 'enabled', True)
+    analysis.watch_models_for_restart(lambda: restarts.append(True))
+    assert len(watched) == 1 and watched[0]['warm'] is False
+    watched[0]['on_reload']()
+    assert restarts == [True]
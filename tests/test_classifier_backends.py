@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("onnxruntime")
+pytest.importorskip("onnxscript")
+
+from app.scripts.classifier_backends import (
+    EagerBackend, OnnxBackend, check_parity, exported_path, load_exported_backend,
+)
+
+
+def tiny_classifier():
+    torch.manual_seed(0)
+    return torch.nn.Sequential(
+        torch.nn.Conv2d(3, 8, 3, stride=2),
+        torch.nn.ReLU(),
+        torch.nn.AdaptiveAvgPool2d(1),
+        torch.nn.Flatten(),
+        torch.nn.Linear(8, 2),
+    ).eval()
+
+
+def test_onnx_export_is_self_contained(tmp_path):
+    model = tiny_classifier()
+    weights = tmp_path / 'clasificador.pth'
+    torch.save(model.state_dict(), weights)
+    device = torch.device('cpu')
+
+    load_exported_backend('onnx', model, str(weights), 32, device)
+    path = exported_path(str(weights), OnnxBackend)
+
+    # Limpieza de temporales: el artefacto exportado no debe depender de ellos
+    for name in os.listdir(tmp_path):
+        if '.tmp' in name:
+            os.remove(tmp_path / name)
+    assert sorted(os.listdir(tmp_path)) == ['clasificador.onnx', 'clasificador.pth']
+
+    backend = load_exported_backend('onnx', model, str(weights), 32, device)
+    assert os.path.getsize(path) > 0
+    assert check_parity(EagerBackend(model), backend, 32, device) < 1e-4
+
+
+def test_broken_export_is_regenerated(tmp_path):
+    model = tiny_classifier()
+    weights = tmp_path / 'clasificador.pth'
+    torch.save(model.state_dict(), weights)
+    # Más reciente que el checkpoint pero inservible
+    (tmp_path / 'clasificador.onnx').write_bytes(b'no es un modelo')
+
+    backend = load_exported_backend('onnx', model, str(weights), 32, torch.device('cpu'))
+    assert check_parity(EagerBackend(model), backend, 32, torch.device('cpu')) < 1e-4
@@ -0,0 +1,49 @@
+from app.utils.image_store import ImageStore, image_id
+
+
+def test_image_id_stable_and_versioned():
+    assert image_id('abc:w=800', 'v1') == image_id('abc:w=800', 'v1')
+    assert image_id('abc:w=800', 'v1') != image_id('abc:w=800', 'v2')
+    assert image_id('abc:w=800', 'v1') != image_id('abc:w=400', 'v1')
+    assert len(image_id('abc', 'v1')) == 32
+
+
+def test_get_returns_bytes_and_mimetype():
+    store = ImageStore(max_bytes=100)
+    store.put('a', b'jpeg', 'image/jpeg')
+
+    assert store.get('a') == (b'jpeg', 'image/jpeg')
+    assert store.get('b') is None
+    stats = store.stats()
+    assert (stats['hits'], stats['misses'], stats['bytes']) == (1, 1, 4)
+
+
+def test_evicts_least_recently_used_by_bytes():
+    store = ImageStore(max_bytes=20)
+    store.put('a', b'x' * 10, 'image/jpeg')
+    store.put('b', b'x' * 10, 'image/jpeg')
+    store.get('a')
+    store.put('c', b'x' * 10, 'image/webp')
+
+    assert store.get('b') is None
+    assert store.get('a') is not None
+    assert store.get('c') == (b'x' * 10, 'image/webp')
+    assert store.stats()['evictions'] == 1
+
+
+def test_replacing_image_updates_size():
+    store = ImageStore(max_bytes=100)
+    store.put('a', b'x' * 50, 'image/jpeg')
+    store.put('a', b'x' * 10, 'image/webp')
+
+    assert store.get('a') == (b'x' * 10, 'image/webp')
+    assert store.stats()['bytes'] == 10
+
+
+def test_oversized_image_not_stored():
+    store = ImageStore(max_bytes=10)
+    store.put('a', b'x' * 5, 'image/jpeg')
+    store.put('b', b'x' * 11, 'image/jpeg')
+
+    assert store.get('b') is None
+    assert store.get('a') is not None
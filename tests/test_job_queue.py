@@ -0,0 +1,152 @@
+import time
+
+import pytest
+from flask import Flask
+
+pytest.importorskip("torch")
+pytest.importorskip("cv2")
+pytest.importorskip("ultralytics")
+
+from app.routes import analysis
+from app.scripts import job_queue as job_queue_module
+from app.scripts.job_queue import AnalysisJobQueue, QueueFullError
+from app.utils.job_store import JobStore
+
+
+def wait_until(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condición no alcanzada"
+        time.sleep(0.01)
+
+
+class FakeProcess:
+    """Trabajador sin modelos: la prueba hace de proceso hijo"""
+
+    def is_alive(self):
+        return True
+
+    def join(self, timeout=None):
+        pass
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / 'jobs'))
+
+
+@pytest.fixture
+def make_queue(monkeypatch, store):
+    monkeypatch.setattr(AnalysisJobQueue, '_start_worker', lambda self, index: FakeProcess())
+    queues = []
+
+    def make(**kwargs):
+        queue = AnalysisJobQueue({}, store, workers=1, claim_interval=0.05, **kwargs)
+        queues.append(queue)
+        return queue
+    yield make
+    for queue in queues:
+        queue.shutdown()
+
+
+# ========== Almacén de trabajos ==========
+
+def test_store_roundtrip(store):
+    job = store.create((b'imagen', 'hash', None, False), meta={'result_key': 'k'})
+
+    assert store.get(job['id'])['status'] == 'queued'
+    assert store.pending() == [job['id']]
+    assert store.load_task(job['id']) == (b'imagen', 'hash', None, False)
+
+    store.finish(job['id'], {'total_leaves': 3}, status='done', version='v1')
+    assert store.get(job['id'])['version'] == 'v1'
+    assert store.load_result(job['id']) == {'total_leaves': 3}
+    assert store.pending() == []
+
+
+def test_store_rejects_foreign_ids(store):
+    assert store.get('../../etc/passwd') is None
+    assert store.load_result('a' * 32) is None
+
+
+def test_store_expires_finished_jobs(store):
+    job = store.add_completed({'total_leaves': 1})
+    store.update(job['id'], finished_at=time.time() - 100)
+    store.expire(ttl=10)
+
+    assert store.get(job['id']) is None
+    assert store.load_result(job['id']) is None
+
+
+# ========== Un solo pool entre procesos ==========
+
+@pytest.mark.skipif(job_queue_module.fcntl is None, reason="requiere flock")
+def test_single_owner_runs_jobs_submitted_anywhere(make_queue, store):
+    done = []
+    owner = make_queue(on_done=lambda job, results: done.append((job['id'], results)))
+    wait_until(lambda: owner.owner)
+    other = make_queue()
+    time.sleep(0.2)
+    assert not other.owner
+
+    # Encolado desde otro proceso web: lo ejecuta el dueño
+    job_id = other.submit(b'imagen', image_hash='hash', meta={'result_key': 'k'})
+    task = owner._tasks.get(timeout=5)
+    assert task == (job_id, b'imagen', 'hash', None, False)
+
+    owner._results.put((job_id, 'running', 0))
+    owner._results.put((job_id, 'done', ({'total_leaves': 2}, 'v1')))
+    wait_until(lambda: store.get(job_id)['status'] == 'done')
+
+    assert other.get(job_id)['version'] == 'v1'
+    assert done == [(job_id, {'total_leaves': 2})]
+
+
+@pytest.mark.skipif(job_queue_module.fcntl is None, reason="requiere flock")
+def test_next_process_takes_over_pending_jobs(make_queue, store):
+    first = make_queue()
+    wait_until(lambda: first.owner)
+    second = make_queue()
+
+    job_id = second.submit(b'imagen')
+    assert first._tasks.get(timeout=5)[0] == job_id
+    first.shutdown()
+
+    # Sin terminar en el dueño anterior: el nuevo dueño lo vuelve a ejecutar
+    wait_until(lambda: second.owner)
+    assert second._tasks.get(timeout=5)[0] == job_id
+
+
+def test_submit_respects_max_queue(make_queue):
+    queue = make_queue(max_queue=1)
+    queue.submit(b'a')
+    with pytest.raises(QueueFullError):
+        queue.submit(b'b')
+
+
+# ========== Endpoints ==========
+
+def test_polling_unknown_job_does_not_start_pool(monkeypatch, store):
+    monkeypatch.setattr(analysis, 'job_store', store)
+    monkeypatch.setattr(analysis, 'job_queue', None)
+    app = Flask(__name__)
+    app.register_blueprint(analysis.analysis_bp)
+    client = app.test_client()
+
+    assert client.get(f"/api/v1/classification/jobs/{'a' * 32}").status_code == 404
+    assert client.get(f"/api/v1/classification/jobs/{'a' * 32}/result").status_code == 404
+    assert analysis.job_queue is None
+
+
+def test_job_completed_records_once(monkeypatch):
+    cached, recorded = [], []
+    monkeypatch.setattr(analysis, '_cache_result', lambda *args: cached.append(args))
+    monkeypatch.setattr(analysis, '_record_analysis', lambda *args, **kwargs: recorded.append(args))
+    job = {
+        'version': 'v2',
+        'meta': {'result_key': 'k', 'image_hash': 'h', 'fingerprint': 'v1', 'target': [10, None]},
+    }
+
+    analysis._job_completed(object(), job, {'total_leaves': 1})
+    assert cached == [('k', 'v2', {'total_leaves': 1})]
+    assert recorded == [({'total_leaves': 1}, 'h', 'v2', (10, None))]
@@ -0,0 +1,41 @@
+import sys
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("cv2")
+pytest.importorskip("ultralytics")
+
+from app.scripts import quantization
+
+
+def test_missing_yolo_dependencies(monkeypatch):
+    # None en sys.modules hace que el import falle
+    monkeypatch.setitem(sys.modules, 'onnxruntime.quantization', None)
+    assert quantization.missing_yolo_dependencies() == ['onnxruntime.quantization']
+
+
+def test_main_fails_before_loading_models(monkeypatch, tmp_path, capsys):
+    monkeypatch.setattr(quantization, 'missing_yolo_dependencies', lambda: ['onnx'])
+    monkeypatch.setattr(
+        quantization, 'create_analysis_service', lambda *args: pytest.fail("modelos cargados")
+    )
+
+    with pytest.raises(SystemExit) as excinfo:
+        quantization.main(['--holdout-dir', str(tmp_path)])
+    assert excinfo.value.code == 2
+    assert 'onnx' in capsys.readouterr().err
+
+
+def test_skip_yolo_does_not_need_onnx(monkeypatch, tmp_path):
+    monkeypatch.setattr(quantization, 'missing_yolo_dependencies', lambda: ['onnx'])
+    loaded = []
+
+    def create_analysis_service(models_config):
+        loaded.append(models_config)
+        raise RuntimeError("fin de la prueba")
+
+    monkeypatch.setattr(quantization, 'create_analysis_service', create_analysis_service)
+    with pytest.raises(RuntimeError):
+        quantization.main(['--holdout-dir', str(tmp_path), '--skip-yolo'])
+    assert len(loaded) == 1
@@ -0,0 +1,129 @@
+from app.routes import analysis
+from app.scripts.timing import StageTimer
+from app.utils.result_cache import ResultCache, model_fingerprint
+
+
+def make_result(image=b'x' * 100):
+    return {'processed_image': image, 'leaves': []}
+
+
+def models_config(tmp_path, **yolo):
+    weights = tmp_path / 'yolo.pt'
+    if not weights.exists():
+        weights.write_bytes(b'pesos')
+    return {
+        'YOLO': {'weights': str(weights), 'conf': 0.15, **yolo},
+        'RESNET': {'weights': str(tmp_path / 'resnet.pth')},
+        'SAM': {'checkpoint': str(tmp_path / 'sam.pth')},
+    }
+
+
+# ========== LRU por bytes ==========
+
+def test_get_after_put():
+    cache = ResultCache(max_bytes=100)
+    cache.put('a', 'v1', 'resultado', 10)
+
+    assert cache.get('a', 'v1') == 'resultado'
+    assert cache.get('b', 'v1') is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['bytes']) == (1, 1, 10)
+
+
+def test_evicts_least_recently_used():
+    cache = ResultCache(max_bytes=30)
+    cache.put('a', 'v1', 'A', 10)
+    cache.put('b', 'v1', 'B', 10)
+    cache.put('c', 'v1', 'C', 10)
+    cache.get('a', 'v1')
+    cache.put('d', 'v1', 'D', 10)
+
+    assert cache.get('b', 'v1') is None
+    assert [cache.get(k, 'v1') for k in 'acd'] == ['A', 'C', 'D']
+    assert cache.stats()['evictions'] == 1
+
+
+def test_replacing_entry_updates_size():
+    cache = ResultCache(max_bytes=100)
+    cache.put('a', 'v1', 'A', 40)
+    cache.put('a', 'v1', 'A2', 20)
+
+    assert cache.get('a', 'v1') == 'A2'
+    assert cache.stats()['bytes'] == 20
+
+
+def test_oversized_result_not_cached():
+    cache = ResultCache(max_bytes=10)
+    cache.put('a', 'v1', 'A', 5)
+    cache.put('b', 'v1', 'B', 11)
+
+    assert cache.get('b', 'v1') is None
+    assert cache.get('a', 'v1') == 'A'
+
+
+def test_new_fingerprint_invalidates():
+    cache = ResultCache(max_bytes=100)
+    cache.put('a', 'v1', 'A', 10)
+
+    assert cache.get('a', 'v2') is None
+    assert cache.get('a', 'v1') is None
+    assert cache.stats()['invalidations'] == 1
+
+
+# ========== Huella de modelos ==========
+
+def test_fingerprint_stable(tmp_path):
+    assert model_fingerprint(models_config(tmp_path)) == model_fingerprint(models_config(tmp_path))
+
+
+def test_fingerprint_changes_with_config_and_weights(tmp_path):
+    base = model_fingerprint(models_config(tmp_path))
+    assert model_fingerprint(models_config(tmp_path, conf=0.3)) != base
+
+    (tmp_path / 'yolo.pt').write_bytes(b'pesos nuevos')
+    assert model_fingerprint(models_config(tmp_path)) != base
+
+
+# ========== Recarga de modelos ==========
+
+def test_result_from_previous_version_does_not_flush_cache(monkeypatch):
+    cache = ResultCache(max_bytes=1 << 20)
+    monkeypatch.setattr(analysis, 'result_cache', cache)
+    monkeypatch.setattr(analysis, '_model_version', lambda: 'v2')
+
+    analysis._cache_result('a', 'v2', make_result())
+    # Préstamo iniciado antes de la recarga termina con la versión anterior
+    analysis._cache_result('b', 'v1', make_result())
+
+    assert cache.get('a', 'v2') is not None
+    assert cache.get('b', 'v2') is None
+    stats = cache.stats()
+    assert (stats['entries'], stats['invalidations']) == (1, 0)
+
+
+# ========== Perfil adaptativo ==========
+
+def test_result_with_degraded_profile_not_cached(monkeypatch):
+    cache = ResultCache(max_bytes=1 << 20)
+    monkeypatch.setattr(analysis, 'result_cache', cache)
+    monkeypatch.setattr(analysis, '_model_version', lambda: 'v1')
+
+    analysis._cache_result('a', 'v1', {**make_result(), 'profile': {'imgsz': 320, 'degraded': True}})
+    analysis._cache_result('b', 'v1', {**make_result(), 'profile': {'imgsz': 640, 'degraded': False}})
+
+    assert cache.get('a', 'v1') is None
+    assert cache.get('b', 'v1') is not None
+
+
+def test_cache_hit_reports_its_own_timings(monkeypatch):
+    cache = ResultCache(max_bytes=1 << 20)
+    monkeypatch.setattr(analysis, 'result_cache', cache)
+    original = {**make_result(), 'timings': {'detect': 900.0, 'total': 1500.0}}
+    cache.put('a', 'v1', original, 100)
+
+    hit = analysis._cached_result('a', 'v1', StageTimer())
+    assert set(hit['timings']) == {'cache', 'total'}
+    assert hit['timings']['total'] < 1500.0
+    # La entrada guardada conserva los tiempos del análisis
+    assert cache.get('a', 'v1')['timings'] == {'detect': 900.0, 'total': 1500.0}
+    assert analysis._cached_result('b', 'v1', StageTimer()) is None
@@ -0,0 +1,162 @@
+import threading
+import time
+
+from app.utils.service_registry import ERROR, READY, ServiceRegistry
+
+
+class FakeModels:
+    """Fábrica con versión en disco controlable"""
+
+    def __init__(self, version='v1'):
+        self.version = version
+        self.built = []
+        self.fail = False
+
+    def factory(self):
+        if self.fail:
+            raise RuntimeError("pesos corruptos")
+        service = {'version': self.version}
+        self.built.append(service)
+        return service
+
+    def registry(self, **kwargs):
+        return ServiceRegistry(self.factory, version=lambda: self.version, **kwargs)
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condición no alcanzada"
+        time.sleep(0.005)
+
+
+# ========== Carga ==========
+
+def test_concurrent_get_builds_once():
+    models = FakeModels()
+    gate = threading.Event()
+
+    def slow_factory():
+        gate.wait(5)
+        return models.factory()
+
+    registry = ServiceRegistry(slow_factory, version=lambda: models.version)
+    threads = [threading.Thread(target=registry.get) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(models.built) == 1
+    assert registry.state == READY
+    assert registry.version == 'v1'
+
+
+def test_failed_load_leases_nothing():
+    models = FakeModels()
+    models.fail = True
+    registry = models.registry()
+
+    with registry.lease() as (service, version):
+        assert (service, version) == (None, None)
+    assert registry.state == ERROR
+
+
+def test_preload_then_warm():
+    models = FakeModels()
+    warmed = []
+    registry = models.registry(warmup=warmed.append)
+
+    service = registry.preload()
+    assert warmed == []
+    registry.warm()
+    assert warmed == [service]
+
+
+# ========== Recarga y préstamos ==========
+
+def test_reload_only_when_version_changes():
+    models = FakeModels()
+    registry = models.registry()
+    registry.get()
+
+    assert registry.reload() is False
+    assert registry.reload(force=True) is True
+    models.version = 'v2'
+    assert registry.reload() is True
+    assert (registry.version, registry.reloads) == ('v2', 2)
+
+
+def test_lease_keeps_previous_version_until_released():
+    models = FakeModels()
+    registry = models.registry()
+
+    with registry.lease() as (old_service, old_version):
+        models.version = 'v2'
+        assert registry.reload() is True
+
+        # Solicitudes nuevas usan la nueva versión; la anterior sigue prestada
+        with registry.lease() as (new_service, new_version):
+            assert new_version == 'v2'
+            assert new_service is not old_service
+        assert old_version == 'v1'
+        assert old_service['version'] == 'v1'
+        assert registry.versions()['draining'] == [{'version': 'v1', 'leases': 1}]
+
+    assert registry.versions()['draining'] == []
+
+
+def test_unleased_version_is_not_kept_draining():
+    models = FakeModels()
+    registry = models.registry()
+    registry.get()
+
+    models.version = 'v2'
+    registry.reload()
+    assert registry.versions()['draining'] == []
+
+
+def test_failed_reload_keeps_current_version():
+    models = FakeModels()
+    registry = models.registry()
+    service = registry.get()
+
+    models.version = 'v2'
+    models.fail = True
+    assert registry.reload() is False
+
+    assert registry.service is service
+    assert registry.version == 'v1'
+    assert 'pesos corruptos' in registry.versions()['last_reload_error']
+
+
+def test_watch_reloads_after_version_is_stable():
+    models = FakeModels()
+    registry = models.registry()
+    registry.get()
+    registry.watch(interval=0.01)
+    try:
+        models.version = 'v2'
+        wait_until(lambda: registry.version == 'v2')
+    finally:
+        registry.stop_watch()
+
+    assert registry.reloads == 1
+
+
+def test_watch_reload_without_warmup_calls_hook():
+    models = FakeModels()
+    warmed, reloaded = [], []
+    registry = models.registry(warmup=warmed.append)
+    registry.preload()
+    registry.watch(interval=0.01, warm=False, on_reload=lambda: reloaded.append(registry.version))
+    try:
+        models.version = 'v2'
+        wait_until(lambda: reloaded)
+    finally:
+        registry.stop_watch()
+
+    # Maestro con preload: sin inferencias antes de fork
+    assert warmed == []
+    assert reloaded == ['v2']
@@ -0,0 +1,44 @@
+from app.scripts.timing import LatencyHistograms, StageTimer
+
+
+def test_percentiles_never_exceed_max():
+    histograms = LatencyHistograms()
+    # Todas en el bucket (200, 500]: la interpolación llegaría a 500
+    for ms in (210, 220, 230, 240):
+        histograms.record({'yolo': ms})
+
+    stats = histograms.snapshot()['yolo']
+    assert stats['max_ms'] == 240
+    assert stats['p50_ms'] <= stats['p95_ms'] <= stats['p99_ms'] <= 240
+
+
+def test_percentiles_in_open_bucket():
+    histograms = LatencyHistograms()
+    for _ in range(4):
+        histograms.record({'total': 30000})
+    for _ in range(4):
+        histograms.record({'total': 90000})
+
+    # Mitad superior en (60000, 90000]: interpolada hasta el máximo observado
+    stats = histograms.snapshot()['total']
+    assert stats['max_ms'] == 90000
+    assert stats['p50_ms'] == 30000
+    assert stats['p95_ms'] == 87000
+    assert stats['p99_ms'] == 89400
+
+
+def test_snapshot_orders_known_stages_first():
+    histograms = LatencyHistograms()
+    histograms.record({'total': 5, 'classify': 2, 'decode': 1})
+
+    assert list(histograms.snapshot()) == ['decode', 'classify', 'total']
+
+
+def test_stage_timer_accumulates_repeated_stages():
+    timer = StageTimer()
+    timer.add('classify', 1.5)
+    timer.add('classify', 2.0)
+
+    timings = timer.as_dict()
+    assert timings['classify'] == 3.5
+    assert 'total' in timings